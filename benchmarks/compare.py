@@ -0,0 +1,45 @@
+"""Compare two JSON result files written by run_benchmarks.py.
+
+Usage:
+    python benchmarks/compare.py before.json after.json [--fail-above 10]
+
+Prints the median of every shared case and the relative change. With
+``--fail-above`` the exit status is 1 if any case got slower by more than
+that many percent.
+"""
+import argparse
+import json
+import sys
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files.")
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--fail-above", type=float, default=None,
+                        help="Exit with status 1 if any median regresses by more than this percent")
+    args = parser.parse_args()
+
+    with open(args.before) as f:
+        before = json.load(f)["results"]
+    with open(args.after) as f:
+        after = json.load(f)["results"]
+
+    regressions = []
+    print(f"{'case':<40} {'before ms':>12} {'after ms':>12} {'change':>9}")
+    for name in sorted(set(before) & set(after)):
+        if "median" not in before[name] or "median" not in after[name]:
+            continue
+        old, new = before[name]["median"], after[name]["median"]
+        change = (new - old) / old * 100 if old else 0.0
+        print(f"{name:<40} {old * 1000:12.3f} {new * 1000:12.3f} {change:+8.1f}%")
+        if args.fail_above is not None and change > args.fail_above:
+            regressions.append(name)
+
+    if regressions:
+        print(f"\nRegressed by more than {args.fail_above}%: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+"""Micro and end-to-end benchmarks over synthetic image trees.
+
+Usage:
+    python benchmarks/run_benchmarks.py --output results.json
+    python benchmarks/run_benchmarks.py --quick
+    python benchmarks/compare.py before.json after.json
+
+The synthetic tree and index are generated into ``--workdir`` (a temporary
+directory by default) and reused on later runs with the same parameters,
+since trees with millions of files take a while to create.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+if (ROOT / "src" / "imgserve").is_dir():
+    # Run from a checkout without installing
+    sys.path.insert(0, str(ROOT / "src"))
+
+from imgserve import synthetic  # noqa: E402
+from imgserve.app import create_app, list_images_in_directory  # noqa: E402
+from imgserve.renderer import (  # noqa: E402
+    compute_pagination_window,
+    render_gallery,
+    render_gallery_with_dirs,
+    IMAGES_PER_PAGE,
+)
+
+# Next-page warm-up runs on a background thread and would compete with (and
+# skew) the timed requests
+BENCH_CONFIG = {'PREFETCH': False}
+
+
+def measure(fn, repeat: int, number: int = 1) -> dict:
+    """Time ``fn`` ``repeat`` times (``number`` calls each) with GC paused."""
+    fn()  # warm-up
+    samples = []
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for _ in range(number):
+                fn()
+            samples.append((time.perf_counter() - start) / number)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    samples.sort()
+    return {
+        "repeat": repeat,
+        "number": number,
+        "min": samples[0],
+        "median": statistics.median(samples),
+        "mean": statistics.fmean(samples),
+        "p95": samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+        "stdev": statistics.stdev(samples) if len(samples) > 1 else 0.0,
+    }
+
+
+def prepare_workdir(workdir: Path, params: dict) -> tuple[Path, Path, Path]:
+    """Create (or reuse) the trees and index described by ``params``."""
+    marker = workdir / "params.json"
+    tree = workdir / "tree"
+    flat = workdir / "flat"
+    index_path = workdir / "index.json"
+    if marker.exists() and json.loads(marker.read_text()) == params:
+        return tree, flat, index_path
+
+    for path in (tree, flat):
+        shutil.rmtree(path, ignore_errors=True)
+    print(f"Generating synthetic data in {workdir} ...", file=sys.stderr)
+    synthetic.generate_tree(str(tree), depth=params["depth"], fanout=params["fanout"],
+                            files_per_dir=params["files_per_dir"], real_images=params["real_images"],
+                            progress=lambda n: print(f"  {n} files", file=sys.stderr))
+    synthetic.generate_tree(str(flat), depth=0, fanout=0, files_per_dir=params["flat_files"],
+                            real_images=params["real_images"])
+    entries = synthetic.index_entries_for_tree(str(tree))
+    if params["index_entries"] > len(entries):
+        # Pad with entries for files that don't exist to reach the requested size
+        entries += synthetic.synthetic_index_entries(params["index_entries"] - len(entries))
+    synthetic.write_index(str(index_path), entries)
+    marker.write_text(json.dumps(params))
+    return tree, flat, index_path
+
+
+def sample_tiles(count: int) -> list[dict]:
+    return [{
+        "href": f"/images/dir/img_{i:06d}.jpg",
+        "img_src": f"/images/dir/img_{i:06d}.jpg",
+        "filename": f"img_{i:06d}.jpg",
+        "caption": "Jan 01, 2024",
+    } for i in range(count)]
+
+
+def run(params: dict, workdir: Path, repeat: int) -> dict:
+    tree, flat, index_path = prepare_workdir(workdir, params)
+    results = {}
+
+    def record(name: str, fn, number: int = 1, reps: int = repeat):
+        results[name] = measure(fn, reps, number)
+        print(f"{name:<40} median {results[name]['median'] * 1000:10.3f} ms", file=sys.stderr)
+
+    flat_dir = str(flat)
+    record("scan.list_images.name", lambda: list_images_in_directory(flat_dir, 'name'))
+    record("scan.list_images.date", lambda: list_images_in_directory(flat_dir, 'date'))
+
+    total = params["index_entries"]
+    record("pagination.compute_window",
+           lambda: compute_pagination_window(page=total // IMAGES_PER_PAGE // 2, total_items=total),
+           number=1000)
+
+    tiles = sample_tiles(IMAGES_PER_PAGE)
+    subdirs = [(f"dir_{i:03d}", f"dir_{i:03d}") for i in range(50)]
+    render_app = create_app(config=BENCH_CONFIG)
+    with render_app.app_context():
+        record("render.gallery", lambda: render_gallery(
+            title="Bench", page=5, total_pages=100, start_page_num=1, end_page_num=10, tiles=tiles))
+        record("render.gallery_with_dirs", lambda: render_gallery_with_dirs(
+            title="Bench", page=5, total_pages=100, start_page_num=1, end_page_num=10, tiles=tiles,
+            subdirs=subdirs, current_dir_rel="dir", sort_by="date"))
+
+    record("index.create_app_load", lambda: create_app(index_file=str(index_path), config=BENCH_CONFIG),
+           reps=max(3, repeat // 5))
+
+    cwd = os.getcwd()
+    os.chdir(flat_dir)
+    try:
+        client = create_app(config=BENCH_CONFIG).test_client()
+    finally:
+        os.chdir(cwd)
+    record("e2e.cwd.page1", lambda: client.get("/"))
+    record("e2e.cwd.page_date", lambda: client.get("/?sort=date&page=2"))
+    record("e2e.cwd.image", lambda: client.get("/images/img_000001.png").close())
+
+    os.chdir(str(tree))
+    try:
+        tree_app = create_app(config=BENCH_CONFIG)
+    finally:
+        os.chdir(cwd)
+    tree_client = tree_app.test_client()
+    crawl = tree_app.config['CRAWL_CACHE'].get(str(tree))
+    while not crawl.done:
+        time.sleep(0.05)
+    record("e2e.cwd.recursive_deep_page", lambda: tree_client.get("/?recursive=1&sort=date&page=3"))
+
+    index_client = create_app(index_file=str(index_path), config=BENCH_CONFIG).test_client()
+    deep_page = max(1, total // IMAGES_PER_PAGE // 2)
+    record("e2e.index.page1", lambda: index_client.get("/"))
+    record("e2e.index.deep_page", lambda: index_client.get(f"/?page={deep_page}"))
+
+    # Metrics overhead: the same request with and without the middleware
+    os.chdir(flat_dir)
+    try:
+        metrics_app = create_app(config=BENCH_CONFIG)
+    finally:
+        os.chdir(cwd)
+    plain_wsgi = metrics_app.wsgi_app.wsgi_app
+    environ_base = {"REQUEST_METHOD": "GET", "PATH_INFO": "/", "QUERY_STRING": "",
+                    "SERVER_NAME": "bench", "SERVER_PORT": "80", "wsgi.url_scheme": "http",
+                    "SERVER_PROTOCOL": "HTTP/1.1", "wsgi.input": None, "wsgi.errors": sys.stderr}
+
+    def call(wsgi):
+        def _go():
+            body = wsgi(dict(environ_base), lambda status, headers, exc_info=None: None)
+            b"".join(body)
+            if hasattr(body, "close"):
+                body.close()
+        return _go
+
+    record("overhead.request.plain", call(plain_wsgi))
+    record("overhead.request.metrics", call(metrics_app.wsgi_app))
+    plain = results["overhead.request.plain"]["median"]
+    instrumented = results["overhead.request.metrics"]["median"]
+    results["overhead.metrics_percent"] = {"value": (instrumented - plain) / plain * 100 if plain else 0.0}
+    print(f"{'overhead.metrics_percent':<40} {results['overhead.metrics_percent']['value']:+.2f} %",
+          file=sys.stderr)
+    return results
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run imgserve benchmarks over synthetic trees.")
+    parser.add_argument("--output", help="Write JSON results here (default: stdout)")
+    parser.add_argument("--workdir", help="Directory for synthetic data (reused between runs)")
+    parser.add_argument("--depth", type=int, default=2)
+    parser.add_argument("--fanout", type=int, default=4)
+    parser.add_argument("--files-per-dir", type=int, default=300)
+    parser.add_argument("--flat-files", type=int, default=10000,
+                        help="Images in the single flat directory used for scan benchmarks")
+    parser.add_argument("--index-entries", type=int, default=200000)
+    parser.add_argument("--real-images", action="store_true",
+                        help="Write tiny valid PNG/GIF files instead of empty ones")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--quick", action="store_true", help="Small sizes for a fast smoke run")
+    args = parser.parse_args()
+
+    if args.quick:
+        args.depth, args.fanout, args.files_per_dir = 1, 2, 50
+        args.flat_files, args.index_entries, args.repeat = 1000, 5000, 5
+
+    params = {
+        "depth": args.depth,
+        "fanout": args.fanout,
+        "files_per_dir": args.files_per_dir,
+        "flat_files": args.flat_files,
+        "index_entries": args.index_entries,
+        "real_images": args.real_images,
+    }
+    workdir = Path(args.workdir) if args.workdir else Path(tempfile.mkdtemp(prefix="imgserve-bench-"))
+    workdir.mkdir(parents=True, exist_ok=True)
+    try:
+        results = run(params, workdir, args.repeat)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "params": params,
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Check the CLI cold-start budget.
+
+Usage:
+    python benchmarks/startup.py [--budget-ms 60] [--runs 5]
+
+Measures ``python -X importtime -c "import <module>"`` for the CLI entry
+points and the wall time of ``image-serve --help``, and fails (exit status
+1) if an import exceeds the budget or pulls in Flask, Werkzeug, Jinja2 or
+Waitress, none of which are needed until the server actually starts.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+HEAVY_MODULES = ("flask", "werkzeug", "jinja2", "waitress")
+# Modules that must start without the web stack, with their budget factor
+ENTRY_MODULES = {"imgserve.cli": 1.0, "imgserve.bench": 2.0}
+
+
+def _env() -> dict:
+    env = dict(os.environ)
+    if (ROOT / "src" / "imgserve").is_dir():
+        env["PYTHONPATH"] = str(ROOT / "src") + os.pathsep + env.get("PYTHONPATH", "")
+    return env
+
+
+def import_profile(module: str) -> tuple[float, set[str]]:
+    """Return (cumulative import ms of ``module``, every module it imported)."""
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                          capture_output=True, text=True, env=_env(), check=True)
+    cumulative_ms, imported = 0.0, set()
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        parts = [p.strip() for p in line[len("import time:"):].split("|")]
+        if not parts[1].isdigit():
+            continue  # header line
+        name = parts[2]
+        imported.add(name.split(".")[0])
+        if name == module:
+            cumulative_ms = int(parts[1]) / 1000
+    return cumulative_ms, imported
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Check imgserve CLI startup time.")
+    parser.add_argument("--budget-ms", type=float, default=60.0,
+                        help="Budget for importing imgserve.cli (default: 60)")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    failed = False
+    for module, factor in ENTRY_MODULES.items():
+        samples, heavy = [], set()
+        for _ in range(args.runs):
+            ms, imported = import_profile(module)
+            samples.append(ms)
+            heavy |= imported & set(HEAVY_MODULES)
+        median = statistics.median(samples)
+        budget = args.budget_ms * factor
+        status = "ok" if median <= budget and not heavy else "FAIL"
+        print(f"{module:<16} import {median:7.1f} ms (budget {budget:.0f} ms) {status}")
+        if heavy:
+            print(f"  pulls in: {', '.join(sorted(heavy))}")
+        failed |= status != "ok"
+
+    walls = []
+    for _ in range(args.runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-m", "imgserve.cli", "--help"], env=_env(),
+                       stdout=subprocess.DEVNULL, check=True)
+        walls.append((time.perf_counter() - start) * 1000)
+    print(f"{'image-serve --help':<16} wall {statistics.median(walls):7.1f} ms (including interpreter start)")
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -7,14 +7,18 @@ def generate_image_index():
     """
     Traverses a specified root directory, finds image files, and generates
     a JSON index containing their absolute paths and modification timestamps.
+    With --dedup, identical files are indexed once and the other copies are
+    listed under "duplicates".
     """
-    if len(sys.argv) < 3:
-        print("Usage: python generate_index.py <root_directory_to_search> <output_json_file>")
+    args = [arg for arg in sys.argv[1:] if arg != '--dedup']
+    dedup = len(args) != len(sys.argv) - 1
+    if len(args) < 2:
+        print("Usage: python generate_index.py [--dedup] <root_directory_to_search> <output_json_file>")
         print("Example: python generate_index.py /path/to/your/photos image_index.json")
         sys.exit(1)
 
-    root_search_dir = sys.argv[1]
-    output_json_path = sys.argv[2]
+    root_search_dir = args[0]
+    output_json_path = args[1]
 
     if not os.path.isdir(root_search_dir):
         print(f"Error: The specified root directory '{root_search_dir}' does not exist or is not a directory.")
@@ -67,6 +71,9 @@ def generate_image_index():
     # Sort the collected data by modification time (earliest first)
     image_index_data.sort(key=lambda x: x['mtime'])
 
+    if dedup:
+        image_index_data = dedupe_index(image_index_data)
+
     try:
         with open(output_json_path, 'w') as f:
             json.dump(image_index_data, f, indent=4)
@@ -76,5 +83,35 @@ def generate_image_index():
         print(f"Error: Could not write index to '{output_json_path}': {e}")
         sys.exit(1)
 
+def dedupe_index(image_index_data):
+    """Keep the oldest copy of each identical image, listing the others."""
+    try:
+        from imgserve.dedup import find_duplicate_groups
+    except ImportError:
+        print("Error: --dedup needs the imgserve package (pip install image-serve).")
+        sys.exit(1)
+
+    print("Looking for duplicate images...")
+    files = []
+    for entry in image_index_data:
+        try:
+            files.append((entry["path"], os.path.getsize(entry["path"]), entry["mtime"]))
+        except OSError as e:
+            print(f"Warning: Could not access '{entry['path']}' (not deduplicated): {e}")
+    duplicates = {}
+    for group in find_duplicate_groups(files):
+        duplicates[group[0]] = group[1:]
+    dropped = {path for copies in duplicates.values() for path in copies}
+
+    deduped = []
+    for entry in image_index_data:
+        if entry["path"] in dropped:
+            continue
+        if entry["path"] in duplicates:
+            entry["duplicates"] = duplicates[entry["path"]]
+        deduped.append(entry)
+    print(f"Removed {len(dropped)} duplicate copies.")
+    return deduped
+
 if __name__ == '__main__':
     generate_image_index()
@@ -0,0 +1,96 @@
+"""Compact access-trace recording for later replay.
+
+Each request becomes one JSON line with short keys::
+
+    {"t": 1760000000.123, "p": "/", "q": "dir=a&page=2", "s": 200, "b": 18342, "d": 0.0123}
+
+(timestamp, path, query string, status, response bytes, seconds until the
+response started). Lines are appended with a single ``O_APPEND`` write, so
+several ``--workers`` processes can share one trace file.
+
+Traces are meant to be shared and replayed, so admin parameters (the admin
+token, ``__profile``) are stripped from query strings and admin pages are
+not recorded at all.
+"""
+import json
+import os
+import time
+
+try:
+    from .admin import ADMIN_PARAMS, ADMIN_PATH_PREFIX, strip_query_params
+except ImportError:
+    from admin import ADMIN_PARAMS, ADMIN_PATH_PREFIX, strip_query_params
+
+
+class TraceMiddleware:
+    """WSGI middleware appending one trace line per request to ``path``."""
+
+    def __init__(self, wsgi_app, path: str):
+        self.wsgi_app = wsgi_app
+        self.path = path
+        self._fd = None
+        self._pid = None
+
+    def _write(self, record: dict) -> None:
+        pid = os.getpid()
+        if self._fd is None or self._pid != pid:
+            # Reopen after a fork so every worker has its own descriptor
+            self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            self._pid = pid
+        line = json.dumps(record, separators=(',', ':')) + "\n"
+        try:
+            os.write(self._fd, line.encode('utf-8'))
+        except OSError:
+            pass
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        if path.startswith(ADMIN_PATH_PREFIX):
+            return self.wsgi_app(environ, start_response)
+        started_at = time.time()
+        start = time.perf_counter()
+        record = {
+            "t": round(started_at, 3),
+            "p": path,
+            "q": strip_query_params(environ.get('QUERY_STRING', ''), ADMIN_PARAMS),
+            "s": 0,
+            "b": 0,
+        }
+
+        def _start_response(status, headers, exc_info=None):
+            record["s"] = int(status[:3])
+            for name, value in headers:
+                if name.lower() == 'content-length':
+                    record["b"] = int(value) if value.isascii() and value.isdecimal() else 0
+                    break
+            record["d"] = round(time.perf_counter() - start, 6)
+            return start_response(status, headers, exc_info)
+
+        try:
+            return self.wsgi_app(environ, _start_response)
+        finally:
+            record.setdefault("d", round(time.perf_counter() - start, 6))
+            self._write(record)
+
+
+def read_trace(path: str) -> list[dict]:
+    """Load a trace file, skipping partial or malformed lines, ordered by time.
+
+    Admin requests (possibly written by older versions) are left out too, so
+    a replay never sends them.
+    """
+    records = []
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if not (isinstance(record, dict) and 'p' in record and 't' in record):
+                continue
+            if str(record['p']).startswith(ADMIN_PATH_PREFIX):
+                continue
+            record['q'] = strip_query_params(str(record.get('q', '')), ADMIN_PARAMS)
+            records.append(record)
+    records.sort(key=lambda r: r['t'])
+    return records
@@ -0,0 +1,30 @@
+import hmac
+from urllib.parse import parse_qs, parse_qsl, urlencode
+
+# Header carrying the admin token; ``?__token=`` works as well for browsers
+ADMIN_HEADER = 'HTTP_X_IMGSERVE_ADMIN'
+# Query parameters that are admin credentials or admin-only switches
+TOKEN_PARAM = '__token'
+ADMIN_PARAMS = (TOKEN_PARAM, '__profile')
+# Admin-only pages
+ADMIN_PATH_PREFIX = '/debug/'
+
+
+def is_admin_request(environ, admin_token: str | None) -> bool:
+    """Return True if the request carries the configured admin token.
+
+    Admin features are disabled entirely when no token is configured.
+    """
+    if not admin_token:
+        return False
+    supplied = environ.get(ADMIN_HEADER)
+    if supplied is None:
+        supplied = parse_qs(environ.get('QUERY_STRING', '')).get('__token', [''])[0]
+    return hmac.compare_digest(supplied.encode('utf-8'), admin_token.encode('utf-8'))
+
+
+def strip_query_params(query: str, names=(TOKEN_PARAM,)) -> str:
+    """Return ``query`` without the parameters in ``names`` (e.g. the admin token)."""
+    if not any(f"{name}=" in query for name in names):
+        return query
+    return urlencode([(k, v) for k, v in parse_qsl(query, keep_blank_values=True) if k not in names])
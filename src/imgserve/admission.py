@@ -0,0 +1,264 @@
+"""Admission control for expensive requests.
+
+Requests are sorted into work classes by path. Each class runs at most
+``slots`` requests at once and lets at most ``queue`` more wait (each up to
+``timeout`` seconds); anything beyond that is turned away immediately with
+503 and ``Retry-After``, so a flood of expensive requests cannot occupy
+every server thread. Optionally, each client (by address) may also run
+only a few requests of each class at once; excess requests get 429. Cheap
+requests such as image bodies and health checks are never limited.
+
+Classes can also be *deferred*: the middleware lets their requests through
+and the application takes the slot itself with ``admitted()``, around just
+the expensive part. Gallery pages use this so requests that only wait for
+an identical render already in progress don't need a slot of their own.
+
+Queued requests whose client has disconnected are dropped, and the
+``client_disconnected`` helper lets long-running work stop early.
+"""
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    from .metrics import REGISTRY
+except ImportError:
+    from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# Seconds between disconnect checks while a request waits for a slot
+WAIT_POLL_SECONDS = 0.25
+
+REJECTED = REGISTRY.counter(
+    "imgserve_rejected_requests_total", "Requests turned away by admission control",
+    ("class", "reason"))
+
+BUSY_PAGE = """<!DOCTYPE html>
+<html><head><meta http-equiv="refresh" content="{retry_after}"><title>Busy</title></head>
+<body style="font-family: Arial, sans-serif; text-align: center; padding-top: 40px;">
+<p>The server is busy right now. This page will retry in {retry_after} seconds.</p>
+</body></html>
+"""
+
+
+def client_disconnected(environ) -> bool:
+    """Return True if the server reports that the client has gone away.
+
+    Supported by Waitress (with ``channel_request_lookahead``) and the
+    asyncio backend; always False elsewhere.
+    """
+    check = environ.get('waitress.client_disconnected') or environ.get('imgserve.client_disconnected')
+    try:
+        return bool(check and check())
+    except Exception:
+        return False
+
+
+class Rejected(Exception):
+    """Raised by ``AdmissionMiddleware.admitted`` when no slot is available."""
+
+    def __init__(self, work_class: "WorkClass", reason: str):
+        super().__init__(f"{work_class.name}: {reason}")
+        self.work_class = work_class
+        self.reason = reason
+
+
+def busy_response(work_class: "WorkClass", reason: str) -> tuple[str, list, bytes]:
+    """``(status, headers, body)`` of the response to a rejected request."""
+    if reason == "disconnected":
+        # Nobody is listening; keep it short
+        return "499 Client Closed Request", [("Content-Length", "0")], b""
+    if reason == "client_limit":
+        status = "429 Too Many Requests"
+    else:
+        status = "503 Service Unavailable"
+    retry_after = work_class.retry_after
+    body = BUSY_PAGE.format(retry_after=retry_after).encode()
+    return status, [
+        ("Content-Type", "text/html; charset=utf-8"),
+        ("Content-Length", str(len(body))),
+        ("Retry-After", str(retry_after)),
+        ("Cache-Control", "no-store"),
+    ], body
+
+
+class WorkClass:
+    """A bounded pool of ``slots`` with a bounded wait queue."""
+
+    def __init__(self, name: str, slots: int, queue: int = 0, timeout: float = 5.0,
+                 retry_after: int = 2):
+        self.name = name
+        self.slots = max(1, slots)
+        self.queue = max(0, queue)
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self.active = 0
+        self.waiting = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, disconnected=lambda: False) -> str | None:
+        """Take a slot; return None on success or the reason for rejection."""
+        with self._cond:
+            if self.active < self.slots:
+                self.active += 1
+                return None
+            if self.waiting >= self.queue:
+                return "queue_full"
+            self.waiting += 1
+            try:
+                deadline = time.monotonic() + self.timeout
+                while self.active >= self.slots:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return "queue_timeout"
+                    self._cond.wait(min(remaining, WAIT_POLL_SECONDS))
+                    if disconnected():
+                        return "disconnected"
+                self.active += 1
+                return None
+            finally:
+                self.waiting -= 1
+
+    def release(self) -> None:
+        with self._cond:
+            self.active -= 1
+            self._cond.notify()
+
+
+class _ReleasingIterable:
+    """Response wrapper that frees the admission slot once the body is done.
+
+    The slot is released when the body is exhausted or closed, whichever
+    comes first.
+    """
+
+    def __init__(self, iterable, release):
+        self._iterable = iterable
+        self._release = release
+
+    def __iter__(self):
+        try:
+            yield from self._iterable
+        finally:
+            self._done()
+
+    def close(self):
+        try:
+            close = getattr(self._iterable, 'close', None)
+            if close is not None:
+                close()
+        finally:
+            self._done()
+
+    def _done(self):
+        release, self._release = self._release, None
+        if release is not None:
+            release()
+
+
+class AdmissionMiddleware:
+    """WSGI middleware applying per-class and per-client limits.
+
+    ``classify(path)`` returns a work class name, or None for requests that
+    are not limited. ``client_limit`` caps each client's running requests
+    per class (0: no per-client limit). Requests of the ``deferred`` classes
+    pass straight through; the application limits them with ``admitted()``.
+    """
+
+    def __init__(self, wsgi_app, classes: dict[str, WorkClass], classify,
+                 client_limit: int = 0, client_header: str | None = None, deferred=()):
+        self.wsgi_app = wsgi_app
+        self.classes = classes
+        self.classify = classify
+        self.deferred = set(deferred)
+        self.client_limit = client_limit
+        # e.g. 'X-Forwarded-For' when running behind a reverse proxy
+        self.client_environ_key = (
+            'HTTP_' + client_header.upper().replace('-', '_') if client_header else None
+        )
+        # (client, class name) -> running requests
+        self._clients: dict[tuple[str, str], int] = {}
+        self._lock = threading.Lock()
+        REGISTRY.gauge_func(
+            "imgserve_admission_active", "Running requests per work class",
+            lambda: {name: c.active for name, c in self.classes.items()}, label_name="class")
+        REGISTRY.gauge_func(
+            "imgserve_admission_queued", "Requests waiting for a slot per work class",
+            lambda: {name: c.waiting for name, c in self.classes.items()}, label_name="class")
+
+    def _client_key(self, environ) -> str:
+        if self.client_environ_key:
+            forwarded = environ.get(self.client_environ_key, '')
+            if forwarded:
+                # The first address is the original client
+                return forwarded.split(',')[0].strip()
+        return environ.get('REMOTE_ADDR', '')
+
+    def _release_client(self, client: tuple[str, str]) -> None:
+        with self._lock:
+            remaining = self._clients[client] - 1
+            if remaining:
+                self._clients[client] = remaining
+            else:
+                del self._clients[client]
+
+    def _acquire(self, work_class: WorkClass, environ):
+        """Take a slot and a client count; return a release function or raise ``Rejected``."""
+        address = self._client_key(environ)
+        # Counted per class, so a long ZIP download doesn't hold up pages
+        client = (address, work_class.name)
+        with self._lock:
+            running = self._clients.get(client, 0)
+            if self.client_limit and running >= self.client_limit:
+                reason = "client_limit"
+            else:
+                reason = None
+                self._clients[client] = running + 1
+        if reason is None:
+            reason = work_class.acquire(lambda: client_disconnected(environ))
+            if reason is not None:
+                self._release_client(client)
+        if reason is not None:
+            REJECTED.inc(work_class.name, reason)
+            logger.info(f"Admission: rejected {work_class.name} request from {address} ({reason})")
+            raise Rejected(work_class, reason)
+
+        def release():
+            work_class.release()
+            self._release_client(client)
+        return release
+
+    @contextmanager
+    def admitted(self, name: str, environ):
+        """Hold a slot of work class ``name`` for the block; raises ``Rejected``."""
+        work_class = self.classes.get(name)
+        if work_class is None:
+            yield
+            return
+        release = self._acquire(work_class, environ)
+        try:
+            yield
+        finally:
+            release()
+
+    def __call__(self, environ, start_response):
+        name = self.classify(environ.get('PATH_INFO', ''))
+        work_class = self.classes.get(name) if name else None
+        if work_class is None or name in self.deferred:
+            return self.wsgi_app(environ, start_response)
+
+        try:
+            release = self._acquire(work_class, environ)
+        except Rejected as e:
+            status, headers, body = busy_response(e.work_class, e.reason)
+            start_response(status, headers)
+            return [body]
+
+        try:
+            result = self.wsgi_app(environ, start_response)
+        except BaseException:
+            release()
+            raise
+        return _ReleasingIterable(result, release)
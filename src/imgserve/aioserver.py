@@ -0,0 +1,332 @@
+"""Minimal asyncio HTTP/1.1 front end for the imgserve WSGI app.
+
+The Flask app still does all routing, path checks and rendering, but it runs
+in a bounded thread pool. Connections themselves are cheap coroutines, and
+file bodies produced through ``wsgi.file_wrapper`` (which is what
+``flask.send_file`` uses) are written with ``loop.sendfile`` on the event
+loop, so slow image downloads never hold one of the app threads.
+"""
+import asyncio
+import io
+import logging
+import signal
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate
+from urllib.parse import unquote_to_bytes
+
+from .metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# Seconds an idle keep-alive connection is held open
+KEEPALIVE_TIMEOUT = 30
+# Largest request body accepted (the app only needs GET/HEAD)
+MAX_BODY_SIZE = 1024 * 1024
+# Hop-by-hop headers that the server manages itself
+_SERVER_HEADERS = ('connection', 'transfer-encoding', 'keep-alive')
+
+
+class FileWrapper:
+    """``wsgi.file_wrapper`` that lets the server find the underlying file."""
+
+    def __init__(self, filelike, block_size: int = 8192):
+        self.filelike = filelike
+        self.block_size = block_size
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> bytes:
+        data = self.filelike.read(self.block_size)
+        if not data:
+            raise StopIteration
+        return data
+
+    def close(self) -> None:
+        self.filelike.close()
+
+
+def _sendfile_source(result):
+    """Return ``(file, offset)`` if ``result`` can be sent with sendfile."""
+    if isinstance(result, FileWrapper):
+        fileobj = result.filelike
+        offset = 0
+    elif isinstance(getattr(result, 'iterable', None), FileWrapper):
+        # werkzeug wraps file responses in a range iterator for Range requests
+        fileobj = result.iterable.filelike
+        offset = getattr(result, 'start_byte', 0)
+    else:
+        return None
+    if not hasattr(fileobj, 'fileno'):
+        return None
+    try:
+        fileobj.fileno()
+    except (OSError, io.UnsupportedOperation):
+        return None
+    return fileobj, offset
+
+
+def _raise_nofile_limit() -> None:
+    """Raise the open file soft limit so thousands of sockets fit."""
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if hard == resource.RLIM_INFINITY or hard > soft:
+            target = hard if hard != resource.RLIM_INFINITY else max(soft, 65536)
+            resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+    except (ImportError, ValueError, OSError):
+        pass
+
+
+class AsyncioWSGIServer:
+    def __init__(self, application, host: str = "0.0.0.0", port: int = 8000,
+                 threads: int = 8, sock=None):
+        self.application = application
+        self.host = host
+        self.port = port
+        self.sock = sock
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="imgserve-app")
+        self.open_connections = 0
+        self.draining = False
+        self._server = None
+        # Connections waiting for their next request (closed when draining)
+        self._idle: set = set()
+        self._stopped = None
+
+    async def start(self):
+        if self.sock is not None:
+            self._server = await asyncio.start_server(self._handle, sock=self.sock, backlog=2048)
+        else:
+            self._server = await asyncio.start_server(
+                self._handle, host=self.host, port=self.port, backlog=2048, reuse_address=True
+            )
+        return self._server
+
+    async def serve_forever(self) -> None:
+        self._stopped = asyncio.Event()
+        server = await self.start()
+        async with server:
+            await self._stopped.wait()
+
+    async def drain(self, timeout: float) -> None:
+        """Stop accepting and give requests in progress ``timeout`` seconds to finish.
+
+        ``serve_forever`` returns once they have (or the time is up).
+        """
+        if self.draining:
+            return
+        self.draining = True
+        self._server.close()
+        for writer in list(self._idle):
+            writer.close()
+        deadline = asyncio.get_running_loop().time() + timeout
+        while self.open_connections and asyncio.get_running_loop().time() < deadline:
+            await asyncio.sleep(0.05)
+        if self.open_connections:
+            logger.warning(f"Stopping with {self.open_connections} connections still open")
+        self._stopped.set()
+
+    def _environ(self, method, target, version, headers, body, peer):
+        path, _, query = target.partition('?')
+        environ = {
+            'REQUEST_METHOD': method,
+            'SCRIPT_NAME': '',
+            'PATH_INFO': unquote_to_bytes(path).decode('latin-1'),
+            'QUERY_STRING': query,
+            'SERVER_NAME': self.host,
+            'SERVER_PORT': str(self.port),
+            'SERVER_PROTOCOL': version,
+            'REMOTE_ADDR': peer[0] if peer else '',
+            'REMOTE_PORT': str(peer[1]) if peer else '',
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': 'http',
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+            'wsgi.file_wrapper': FileWrapper,
+        }
+        for name, value in headers:
+            key = name.upper().replace('-', '_')
+            if key == 'CONTENT_TYPE':
+                environ['CONTENT_TYPE'] = value
+            elif key == 'CONTENT_LENGTH':
+                environ['CONTENT_LENGTH'] = value
+            else:
+                key = 'HTTP_' + key
+                environ[key] = f"{environ[key]},{value}" if key in environ else value
+        return environ
+
+    def _call_app(self, environ):
+        """Run the WSGI app (in a worker thread) up to its response headers."""
+        response = {}
+        written: list[bytes] = []
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and response:
+                raise exc_info[1].with_traceback(exc_info[2])
+            response['status'] = status
+            response['headers'] = headers
+            return written.append
+
+        result = self.application(environ, start_response)
+        if not response and not isinstance(result, (list, tuple)):
+            # Generators may delay start_response until their first chunk
+            first = next(iter(result), b'')
+            written.append(first)
+        if not response:
+            # e.g. an empty body from an app that never started a response
+            close = getattr(result, 'close', None)
+            if close is not None:
+                close()
+            raise RuntimeError("WSGI application returned without calling start_response")
+        return response['status'], response['headers'], written, result
+
+    async def _handle(self, reader, writer) -> None:
+        loop = asyncio.get_running_loop()
+        peer = writer.get_extra_info('peername')
+        self.open_connections += 1
+        try:
+            while not self.draining:
+                self._idle.add(writer)
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), KEEPALIVE_TIMEOUT)
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError):
+                    break
+                finally:
+                    self._idle.discard(writer)
+                lines = head.decode('latin-1').split("\r\n")
+                try:
+                    method, target, version = lines[0].split(" ", 2)
+                except ValueError:
+                    writer.write(b"HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+                    break
+                headers = []
+                for line in lines[1:]:
+                    if ':' in line:
+                        name, value = line.split(':', 1)
+                        headers.append((name.strip(), value.strip()))
+                lowered = {name.lower(): value for name, value in headers}
+                length = lowered.get('content-length', '') or '0'
+                if not (length.isascii() and length.isdecimal()):
+                    writer.write(b"HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+                    break
+                length = int(length)
+                if length > MAX_BODY_SIZE:
+                    writer.write(b"HTTP/1.1 413 Payload Too Large\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+                    break
+                body = await reader.readexactly(length) if length else b''
+
+                conn = lowered.get('connection', '').lower()
+                keep_alive = conn != 'close' if version == 'HTTP/1.1' else conn == 'keep-alive'
+                # A draining server answers what it has read, then hangs up
+                keep_alive = keep_alive and not self.draining
+                environ = self._environ(method, target, version, headers, body, peer)
+                # Lets the app drop queued or long-running work for a gone client
+                environ['imgserve.client_disconnected'] = lambda: reader.at_eof() or writer.is_closing()
+                keep_alive = await self._respond(loop, writer, environ, method, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception:
+            logger.exception("Unhandled error while serving connection")
+        finally:
+            self.open_connections -= 1
+            writer.close()
+
+    async def _respond(self, loop, writer, environ, method, keep_alive) -> bool:
+        try:
+            status, headers, written, result = await loop.run_in_executor(
+                self.executor, self._call_app, environ
+            )
+        except Exception:
+            logger.exception("Error in WSGI application")
+            writer.write(b"HTTP/1.1 500 Internal Server Error\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+            await writer.drain()
+            return False
+
+        try:
+            headers = [(k, v) for k, v in headers if k.lower() not in _SERVER_HEADERS]
+            content_length = next((v for k, v in headers if k.lower() == 'content-length'), None)
+            chunked = content_length is None and method != 'HEAD'
+            if chunked and environ['SERVER_PROTOCOL'] != 'HTTP/1.1':
+                chunked = False
+                keep_alive = False
+            head = [f"HTTP/1.1 {status}", "Server: imgserve"]
+            if not any(k.lower() == 'date' for k, _ in headers):
+                head.append(f"Date: {formatdate(usegmt=True)}")
+            head.extend(f"{k}: {v}" for k, v in headers)
+            if chunked:
+                head.append("Transfer-Encoding: chunked")
+            head.append("Connection: keep-alive" if keep_alive else "Connection: close")
+            writer.write(("\r\n".join(head) + "\r\n\r\n").encode('latin-1'))
+            if method == 'HEAD':
+                await writer.drain()
+                return keep_alive
+
+            def frame(data: bytes) -> bytes:
+                return b"%x\r\n%s\r\n" % (len(data), data) if chunked else data
+
+            for data in written:
+                if data:
+                    writer.write(frame(data))
+
+            source = _sendfile_source(result) if content_length is not None else None
+            if source is not None:
+                fileobj, offset = source
+                await writer.drain()
+                await loop.sendfile(writer.transport, fileobj, offset, int(content_length))
+            elif isinstance(result, (list, tuple)):
+                for data in result:
+                    if data:
+                        writer.write(frame(data))
+            else:
+                iterator = iter(result)
+                while True:
+                    data = await loop.run_in_executor(self.executor, next, iterator, None)
+                    if data is None:
+                        break
+                    if data:
+                        writer.write(frame(data))
+                    await writer.drain()
+            if chunked:
+                writer.write(b"0\r\n\r\n")
+            await writer.drain()
+        finally:
+            close = getattr(result, 'close', None)
+            if close is not None:
+                close()
+        return keep_alive
+
+
+def serve(application, host: str = "0.0.0.0", port: int = 8000, threads: int = 8, sock=None,
+          drain_timeout: float | None = None) -> None:
+    """Serve ``application`` with the asyncio backend until interrupted.
+
+    With ``drain_timeout``, SIGTERM stops the server gracefully: requests in
+    progress get up to that many seconds to finish.
+    """
+    _raise_nofile_limit()
+    server = AsyncioWSGIServer(application, host=host, port=port, threads=threads, sock=sock)
+    REGISTRY.gauge_func(
+        "imgserve_open_connections", "Client connections currently open",
+        lambda: server.open_connections)
+    REGISTRY.gauge_func(
+        "imgserve_executor_queue_depth", "App calls waiting for a free executor thread",
+        lambda: server.executor._work_queue.qsize())
+
+    async def main():
+        if drain_timeout is not None:
+            asyncio.get_running_loop().add_signal_handler(
+                signal.SIGTERM, lambda: asyncio.ensure_future(server.drain(drain_timeout)))
+        await server.serve_forever()
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.executor.shutdown(wait=False)
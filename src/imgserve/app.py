@@ -1,99 +1,560 @@
 import os
 import logging
-from flask import Flask, send_file, abort, request
+import stat
+from concurrent.futures import TimeoutError
+from urllib.parse import quote, urlencode
+from flask import Flask, Response, send_file, abort, redirect, request, jsonify
 
 logger = logging.getLogger(__name__)
 try:
     from .renderer import (
         render_gallery_with_dirs,
+        render_request_log,
         compute_pagination_window,
         format_date_from_timestamp,
+        IMAGES_PER_PAGE,
     )
+    from .crawler import CrawlCache
+    from .scancache import ScanCache
+    from .zipstream import stream_zip
+    from .singleflight import SingleFlight
+    from .admission import AdmissionMiddleware, WorkClass, Rejected, busy_response, client_disconnected
+    from .prefetch import PageCache, Prefetcher, page_key, readahead, is_prefetch_request
+    from .sprites import SpriteSheets, MAX_CONCURRENT_BUILDS, TILES_PER_SHEET, available as sprites_available
+    from .filecache import FileCache, file_response
+    from .statpool import StatPool, STAT_TIMEOUT_SECONDS, NETWORK_FS_TYPES, mount_fs_type
+    from .metrics import REGISTRY, SCAN_SECONDS, RENDER_SECONDS, MetricsMiddleware
+    from .metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE
+    from .profiling import stage, ServerTimingMiddleware, ProfilingMiddleware
+    from .accesstrace import TraceMiddleware
+    from .requestlog import RequestLog, RequestLogMiddleware
+    from .admin import is_admin_request
+    from .indexloader import IndexLoader, WATCH_INTERVAL
+    from .pathtrie import PathTrie
+    from .indexstore import IndexBuilder
+    from .dedup import ListingDeduper
+    from .imagemeta import MetadataCache, sort_by_capture_time
 except ImportError:
     # Allow running this file directly: `python path/to/imgserve/app.py`
     from renderer import (
         render_gallery_with_dirs,
+        render_request_log,
         compute_pagination_window,
         format_date_from_timestamp,
+        IMAGES_PER_PAGE,
     )
+    from crawler import CrawlCache
+    from scancache import ScanCache
+    from zipstream import stream_zip
+    from singleflight import SingleFlight
+    from admission import AdmissionMiddleware, WorkClass, Rejected, busy_response, client_disconnected
+    from prefetch import PageCache, Prefetcher, page_key, readahead, is_prefetch_request
+    from sprites import SpriteSheets, MAX_CONCURRENT_BUILDS, TILES_PER_SHEET, available as sprites_available
+    from filecache import FileCache, file_response
+    from statpool import StatPool, STAT_TIMEOUT_SECONDS, NETWORK_FS_TYPES, mount_fs_type
+    from metrics import REGISTRY, SCAN_SECONDS, RENDER_SECONDS, MetricsMiddleware
+    from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE
+    from profiling import stage, ServerTimingMiddleware, ProfilingMiddleware
+    from accesstrace import TraceMiddleware
+    from requestlog import RequestLog, RequestLogMiddleware
+    from admin import is_admin_request
+    from indexloader import IndexLoader, WATCH_INTERVAL
+    from pathtrie import PathTrie
+    from indexstore import IndexBuilder
+    from dedup import ListingDeduper
+    from imagemeta import MetadataCache, sort_by_capture_time
+
+# Cache lifetime of responses whose URL can never change meaning
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
 
 # Image extensions to consider
 IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.tiff', '.webp', '.heif')
 
 
-def create_app(index_file=None):
-    """Create and configure the Flask app."""
+def create_app(index_file=None, config=None):
+    """Create and configure the Flask app.
+
+    ``config`` is merged into ``app.config`` on top of the defaults below.
+    """
     app = Flask(__name__)
+    # Add a Server-Timing header (scan/sort/render/send) to every response
+    app.config['SERVER_TIMING'] = False
+    # Token unlocking admin-only features such as ?__profile=1
+    app.config['ADMIN_TOKEN'] = None
+    # Directory for saved request profiles (inline text report if unset)
+    app.config['PROFILE_DIR'] = None
+    # Append a compact access trace (for `image-serve bench replay`) here
+    app.config['TRACE_FILE'] = None
+    # Recent requests kept for /debug/requests (0: don't record)
+    app.config['REQUEST_LOG_SIZE'] = 1000
+    # Load --index-file on a background thread instead of before serving
+    app.config['BACKGROUND_INDEX_LOAD'] = False
+    # Show one tile per unique image in CWD listings (content-hash dedup)
+    app.config['DEDUP'] = False
+    # Persist directory scans here (in a 'scans' subdirectory) across restarts
+    app.config['CACHE_DIR'] = None
+    # Fan per-file stats out to a thread pool: 'auto' (network mounts only),
+    # 'on' or 'off'; STAT_TIMEOUT bounds each directory scan in seconds
+    app.config['STAT_POOL_MODE'] = 'auto'
+    app.config['STAT_TIMEOUT'] = STAT_TIMEOUT_SECONDS
+    # Bound concurrent gallery pages and ZIP downloads (sized from THREADS,
+    # the server's worker thread count) and per-client concurrency
+    app.config['ADMISSION_CONTROL'] = True
+    app.config['THREADS'] = 8
+    # Running gallery pages (and, separately, ZIP downloads) allowed per
+    # client address; 0: no per-client limit
+    app.config['CLIENT_LIMIT'] = 0
+    # Header carrying the real client address behind a reverse proxy
+    app.config['CLIENT_IP_HEADER'] = None
+    # Render the next gallery page in the background after each page view
+    app.config['PREFETCH'] = True
+    # Draw gallery tiles from per-page contact sheets (needs Pillow)
+    app.config['SPRITES'] = False
+    # Memory for hot image files, in MiB (0: read every request from disk)
+    app.config['FILE_CACHE_MB'] = 64
+    # Seconds between checks of --index-file for changes (0: never reload
+    # automatically; SIGHUP still works when the CLI runs the server)
+    app.config['INDEX_RELOAD_INTERVAL'] = WATCH_INTERVAL
+    if config:
+        app.config.update(config)
+
+    # Header-only dimensions and capture times, keyed by (path, mtime)
+    app.config['METADATA_CACHE'] = MetadataCache()
+    meta_cache = app.config['METADATA_CACHE']
+    cache_stats = {"metadata": meta_cache}
+    # Bumped whenever a new index is published; part of cache keys for pages
+    # built from the index
+    app.config['INDEX_GENERATION'] = 0
 
     if index_file:
-        # Index mode: load from JSON index file
-        import json
-        try:
-            with open(index_file, 'r') as f:
-                all_indexed_images = json.load(f)
-            # Sort by mtime descending (newest first)
-            all_indexed_images.sort(key=lambda x: float(x.get('mtime', 0)), reverse=True)
-            logger.info(f"Loaded {len(all_indexed_images)} images from index '{index_file}'.")
-        except (FileNotFoundError, json.JSONDecodeError) as e:
-            logger.error(f"Error loading index file '{index_file}': {e}")
-            all_indexed_images = []
-
-        # Store in app config for routes to access
+        # Index mode: load from JSON index file. Routes read
+        # ALL_INDEXED_IMAGES (or INDEX_TREE) once per request; the loader
+        # only ever replaces them, so each request sees one consistent
+        # snapshot, and in-flight requests finish on the old one after a
+        # reload.
         app.config['INDEX_MODE'] = True
-        app.config['ALL_INDEXED_IMAGES'] = all_indexed_images
+        # A CompactIndex: index[i] is an IndexEntry(path, name, mtime, copies)
+        app.config['ALL_INDEXED_IMAGES'] = IndexBuilder().build()
+        # Folder tree over the complete index (None while loading); it holds
+        # its own reference to the entries it was built from
+        app.config['INDEX_TREE'] = None
+
+        def publish(entries, complete):
+            tree = PathTrie(entries) if complete else None
+            app.config['ALL_INDEXED_IMAGES'] = entries
+            app.config['INDEX_TREE'] = tree
+            # Last, so a request that sees the new generation also sees the
+            # new index
+            app.config['INDEX_GENERATION'] += 1
+
+        index_loader = IndexLoader(index_file, publish)
+        app.config['INDEX_LOADER'] = index_loader
+        if app.config['BACKGROUND_INDEX_LOAD']:
+            index_loader.start()
+        else:
+            index_loader.load()
+        # Pick up a regenerated index without a restart
+        index_loader.watch(app.config['INDEX_RELOAD_INTERVAL'])
+        REGISTRY.gauge_func(
+            "imgserve_index_generation", "Index versions published (partial loads included)",
+            lambda: app.config['INDEX_GENERATION'])
+        REGISTRY.counter_func(
+            "imgserve_index_reloads_total", "Index reloads by outcome",
+            lambda: {"ok": index_loader.reloads, "failed": index_loader.reload_failures},
+            label_name="outcome")
         app.config['ROOT_DIR'] = None  # Not used in index mode
     else:
         # CWD mode: serve from current working directory
         app.config['INDEX_MODE'] = False
         app.config['ALL_INDEXED_IMAGES'] = []
         app.config['ROOT_DIR'] = os.getcwd()
+        # Parallel stats with a deadline, for NFS/SMB/sshfs roots
+        stat_pool = None
+        use_pool = app.config['STAT_POOL_MODE']
+        if use_pool == 'auto':
+            fs_type = mount_fs_type(app.config['ROOT_DIR'])
+            use_pool = 'on' if fs_type in NETWORK_FS_TYPES else 'off'
+            if use_pool == 'on':
+                logger.info(f"Root is on a '{fs_type}' mount; using the parallel stat pool.")
+        if use_pool == 'on':
+            stat_pool = StatPool(timeout=app.config['STAT_TIMEOUT'])
+            REGISTRY.counter_func(
+                "imgserve_stat_timeouts_total", "Directory scans cut short by the stat pool deadline",
+                lambda: stat_pool.timeouts)
+        app.config['STAT_POOL'] = stat_pool
+        # Directory listings revalidated by directory mtime, kept on disk
+        # under CACHE_DIR so a restarted server doesn't rescan everything
+        scan_cache = None
+        if app.config['CACHE_DIR']:
+            scan_cache = ScanCache(IMAGE_EXTENSIONS, os.path.join(app.config['CACHE_DIR'], 'scans'),
+                                   stat_pool=stat_pool)
+            cache_stats["scan"] = scan_cache
+        app.config['SCAN_CACHE'] = scan_cache
+        # Background crawls backing the recursive (flattened) view
+        app.config['CRAWL_CACHE'] = CrawlCache(IMAGE_EXTENSIONS, scan_cache=scan_cache,
+                                               stat_pool=stat_pool)
+        crawl_cache = app.config['CRAWL_CACHE']
+        # Content hashes and deduplicated listings (only used with DEDUP)
+        app.config['DEDUPER'] = ListingDeduper()
+        cache_stats["crawl"] = crawl_cache
+        cache_stats["content_hash"] = app.config['DEDUPER'].hashes
+
+    # Single-flight groups: directory listings and whole gallery pages
+    listing_flight = app.config['LISTING_FLIGHT'] = SingleFlight()
+    page_flight = app.config['PAGE_FLIGHT'] = SingleFlight()
+
+    # Next-page warm-up: rendered pages waiting for their first visitor
+    page_cache = app.config['PAGE_CACHE'] = PageCache()
+    cache_stats["page"] = page_cache
+
+    # Contact sheets: a handful of sheet requests per page instead of one
+    # request per tile
+    sprites = None
+    if app.config['SPRITES']:
+        if sprites_available():
+            sprites = SpriteSheets()
+            cache_stats["sprite"] = sprites
+        else:
+            logger.warning("Sprites need Pillow (pip install Pillow); serving plain tiles.")
+    app.config['SPRITE_SHEETS'] = sprites
+
+    # Hot image files served from memory (or an open descriptor)
+    file_cache = None
+    if app.config['FILE_CACHE_MB'] > 0:
+        file_cache = FileCache(int(app.config['FILE_CACHE_MB'] * (1 << 20)))
+        cache_stats["file"] = file_cache
+        REGISTRY.gauge_func("imgserve_file_cache_bytes", "Bytes of image files held in memory",
+                            lambda: file_cache.bytes)
+        REGISTRY.gauge_func("imgserve_file_cache_open_files",
+                            "Large image files kept open for reuse", file_cache.open_files)
+    app.config['FILE_CACHE'] = file_cache
+
+    def server_busy():
+        # Other pages being rendered, or anything queued for a slot
+        if page_flight.in_flight() > 0:
+            return True
+        admission = app.config.get('ADMISSION')
+        return admission is not None and any(c.waiting for c in admission.classes.values())
+
+    prefetcher = app.config['PREFETCHER'] = Prefetcher(busy=server_busy)
+    REGISTRY.counter_func(
+        "imgserve_prefetch_total", "Next-page warm-ups by outcome",
+        lambda: {"scheduled": prefetcher.scheduled, "completed": prefetcher.completed,
+                 "skipped": prefetcher.skipped, "cancelled": prefetcher.cancelled},
+        label_name="outcome")
+    REGISTRY.counter_func(
+        "imgserve_coalesced_requests_total",
+        "Calls that waited for an identical in-progress computation",
+        lambda: {"listing": listing_flight.coalesced, "page": page_flight.coalesced},
+        label_name="group")
+    REGISTRY.counter_func(
+        "imgserve_singleflight_leaders_total",
+        "Calls that ran the computation for their single-flight key",
+        lambda: {"listing": listing_flight.leaders, "page": page_flight.leaders},
+        label_name="group")
+
+    REGISTRY.counter_func(
+        "imgserve_cache_hits_total", "Cache lookups answered from cache",
+        lambda: {name: cache.hits for name, cache in cache_stats.items()}, label_name="cache")
+    REGISTRY.counter_func(
+        "imgserve_cache_misses_total", "Cache lookups that had to compute",
+        lambda: {name: cache.misses for name, cache in cache_stats.items()}, label_name="cache")
+
+    # Optional instrumentation is only wired in when enabled, so it costs
+    # nothing otherwise
+    if app.config['ADMIN_TOKEN']:
+        app.wsgi_app = ProfilingMiddleware(app.wsgi_app, app.config['ADMIN_TOKEN'],
+                                           app.config['PROFILE_DIR'])
+    if app.config['SERVER_TIMING']:
+        app.wsgi_app = ServerTimingMiddleware(app.wsgi_app)
+    if app.config['TRACE_FILE']:
+        app.wsgi_app = TraceMiddleware(app.wsgi_app, app.config['TRACE_FILE'])
+    if app.config['ADMISSION_CONTROL']:
+        # Expensive work never takes more than ~3/4 of the threads, leaving
+        # the rest for image bodies and health checks
+        threads = app.config['THREADS']
+        classes = {
+            'page': WorkClass('page', slots=max(1, threads * 3 // 8), queue=max(1, threads // 8)),
+            'download': WorkClass('download', slots=max(1, threads // 4), queue=0, retry_after=10),
+        }
+        if sprites is not None:
+            # As many as can be composed at once, and a queue holding at
+            # least one whole page of sheets: the browser requests them all
+            # together and never retries a CSS background
+            sheets_per_page = -(-IMAGES_PER_PAGE // TILES_PER_SHEET)
+            classes['sprite'] = WorkClass('sprite', slots=MAX_CONCURRENT_BUILDS,
+                                          queue=sheets_per_page * max(1, threads // 8),
+                                          timeout=10.0)
+        app.wsgi_app = app.config['ADMISSION'] = AdmissionMiddleware(
+            app.wsgi_app,
+            classes=classes,
+            classify=admission_class,
+            client_limit=app.config['CLIENT_LIMIT'],
+            client_header=app.config['CLIENT_IP_HEADER'],
+            # Pages and sheets take their slot around the render or build
+            # only (see admitted()), so cached and coalesced ones need none
+            deferred=('page', 'sprite'),
+        )
+    # Recent and slowest requests with their stage timings, for
+    # /debug/requests; outside admission control so queueing shows up too
+    request_log = None
+    if app.config['REQUEST_LOG_SIZE'] > 0:
+        request_log = RequestLog(app.config['REQUEST_LOG_SIZE'])
+        app.wsgi_app = RequestLogMiddleware(app.wsgi_app, request_log)
+    app.config['REQUEST_LOG'] = request_log
+    # Request counts, latency and bytes per route for /metrics
+    app.wsgi_app = MetricsMiddleware(app.wsgi_app)
+
+    @app.route('/healthz')
+    def healthz():
+        return jsonify(status="ok")
+
+    @app.route('/readyz')
+    def readyz():
+        loader = app.config.get('INDEX_LOADER')
+        if loader is None:
+            return jsonify(ready=True)
+        body = {
+            "ready": loader.ready,
+            "loaded": loader.loaded,
+            "progress": round(loader.progress, 4),
+        }
+        if loader.error is not None:
+            body["error"] = str(loader.error)
+        return jsonify(body), (200 if loader.ready else 503)
+
+    @app.route('/metrics')
+    def metrics():
+        return Response(REGISTRY.render(), content_type=METRICS_CONTENT_TYPE)
+
+    @app.route('/debug/requests')
+    def debug_requests():
+        # Admin only; without a valid token the page doesn't exist
+        if request_log is None or not is_admin_request(request.environ, app.config['ADMIN_TOKEN']):
+            abort(404)
+        snapshot = request_log.snapshot()
+        if request.args.get('format') == 'json':
+            response = jsonify(snapshot)
+        else:
+            token = request.args.get('__token')
+            token_query = f"&__token={quote(token)}" if token else ""
+            response = Response(render_request_log(snapshot, token_query), mimetype='text/html')
+        response.headers['Cache-Control'] = 'no-store'
+        return response
+
+    def request_deadline():
+        """The deadline for a request's filesystem work (None without a stat pool)."""
+        return stat_pool.deadline() if stat_pool is not None else None
+
+    def read_tile_meta(path: str, mtime: float, deadline):
+        """Tile metadata, given up on (None) once the request's deadline passes."""
+        if stat_pool is None:
+            return meta_cache.get(path, mtime)
+        try:
+            return stat_pool.call(meta_cache.get, path, mtime, deadline=deadline)
+        except TimeoutError:
+            return None
+
+    def directory_listing(dir_arg: str, sort_by: str, recursive: bool, deadline=None):
+        """Resolve ``dir_arg`` and return its gallery listing.
+
+        Returns ``(current_dir, listing, image_entries, copies, scanning,
+        sorting)``: the directory's ``DirectoryScan`` (or None), the sorted
+        and possibly deduplicated ``(rel_path, mtime)`` entries, copy counts,
+        whether a recursive crawl is still running, and whether capture
+        times are still being read (``sort=taken`` only). With a stat pool, the directory
+        checks and scan share ``deadline`` (default: the pool's timeout).
+        """
+        if deadline is None:
+            deadline = request_deadline()
+        current_dir = os.path.normpath(os.path.join(app.config['ROOT_DIR'], dir_arg))
+        if not current_dir.startswith(app.config['ROOT_DIR']):
+            abort(403, description="Access denied: Directory outside allowed root.")
+
+        if not is_directory(current_dir, stat_pool, deadline):
+            abort(404, description="Directory not found.")
+
+        def compute():
+            scanning = False
+            sorting = False
+            listing = scan_listing(current_dir, scan_cache, stat_pool, deadline)
+            if recursive:
+                # Flattened view: every image below current_dir, served from
+                # a cached background crawl (possibly still in progress)
+                crawl = app.config['CRAWL_CACHE'].get(current_dir)
+                with stage('sort'):
+                    image_entries, scanning = crawl.snapshot(sort_by)
+            else:
+                image_entries = list_images_in_directory(current_dir, sort_by, listing)
+
+            copies = {}
+            if app.config['DEDUP']:
+                with stage('dedup'):
+                    # Listings include each file's mtime, so rewritten files
+                    # and new crawl results both change the version
+                    version = (recursive, len(image_entries), hash(tuple(image_entries)))
+                    # Sizes come from the scan, so only files whose size
+                    # collides are opened (no extra stat per file)
+                    sizes = None
+                    if recursive:
+                        sizes = crawl.sizes()
+                    elif listing is not None:
+                        sizes = {name: size for name, _, size in listing.files}
+                    image_entries, copies = app.config['DEDUPER'].dedupe(
+                        current_dir, image_entries, version, sizes)
+            if sort_by == 'taken':
+                # Listings come back in name/date order; re-sort by EXIF
+                # capture time (mtime when a file has none or it isn't
+                # read yet: files are only read in the background)
+                with stage('meta'):
+                    image_entries, complete = sort_by_capture_time(current_dir, image_entries, meta_cache)
+                sorting = not complete
+            return listing, image_entries, copies, scanning, sorting
+
+        # Concurrent requests for the same listing (e.g. a shared link to a
+        # big folder) wait for one scan instead of each running their own
+        listing, image_entries, copies, scanning, sorting = listing_flight.do(
+            (current_dir, sort_by, recursive), compute)
+        return current_dir, listing, image_entries, copies, scanning, sorting
+
+    def gallery_key(path: str, args) -> tuple:
+        """Page-cache/single-flight key; stale once a new index is published."""
+        return page_key(path, args) + (app.config['INDEX_GENERATION'],)
 
     @app.route('/')
     def index():
+        key = gallery_key(request.path, request.args)
+        warmed = page_cache.pop(key)
+        if warmed is not None:
+            html, pagination, _ = warmed
+        else:
+            # Identical concurrent page requests share one render; only
+            # the request running it needs an admission slot
+            html, pagination, _ = page_flight.do(key, lambda: admitted('page', render_index))
+        # A browser prefetch of this page is itself the warm-up: don't chain
+        if app.config['PREFETCH'] and pagination['page'] < pagination['total_pages'] \
+                and not is_prefetch_request(request.headers):
+            schedule_warmup(request.path, request.args, pagination['page'] + 1)
+        return html
+
+    def admitted(name: str, fn):
+        """Return ``fn()`` run in a slot of work class ``name`` (raises ``Rejected``)."""
+        admission = app.config.get('ADMISSION')
+        if admission is None:
+            return fn()
+        with admission.admitted(name, request.environ):
+            return fn()
+
+    @app.errorhandler(Rejected)
+    def rejected(e):
+        status, headers, body = busy_response(e.work_class, e.reason)
+        return Response(body, status=status, headers=headers)
+
+    def schedule_warmup(path: str, args, next_page: int) -> None:
+        """Render the next page in the background and read ahead its images."""
+        next_args = args.copy()
+        next_args['page'] = str(next_page)
+        key = gallery_key(path, next_args)
+        if key in page_cache:
+            return
+
+        def warm(cancelled):
+            with app.test_request_context(path, query_string=next_args):
+                result = page_flight.do(key, render_index)
+            if cancelled():
+                return
+            page_cache.put(key, result)
+            with stage('readahead'):
+                readahead([path for path, _ in result[2]], cancelled,
+                          app.config.get('STAT_POOL'))
+            if sprites is not None:
+                version, _ = sprites.layout(result[2])
+                for sheet in range(sprites.sheet_count(version)):
+                    if cancelled():
+                        return
+                    sprites.get(version, sheet)
+
+        prefetcher.schedule(key, warm)
+
+    def render_index():
+        """Render the gallery page for the current request.
+
+        Returns ``(html, pagination, page_entries)`` with the page's
+        ``(path, mtime)`` entries; results may be shared between threads, so
+        they must not be mutated.
+        """
         if app.config['INDEX_MODE']:
             # Index mode: serve from pre-loaded index
-            total_images = len(app.config['ALL_INDEXED_IMAGES'])
+            dir_arg = request.args.get('dir', '')
+            recursive = request.args.get('recursive', '1') == '1'
+            indexed_images, positions, view = index_listing(dir_arg, recursive)
+            total_images = len(positions)
             logger.info(f"Index mode: {total_images} images from index file")
             page = request.args.get('page', 1, type=int)
 
             pagination = compute_pagination_window(page=page, total_items=total_images)
 
             tiles = []
-            for i in range(pagination['start_index'], min(pagination['end_index'], total_images)):
-                image_data = app.config['ALL_INDEXED_IMAGES'][i]
-                filename = os.path.basename(image_data['path'])
-                caption = format_date_from_timestamp(image_data.get('mtime', 0))
+            page_entries = []
+            for i in positions[pagination['start_index']:pagination['end_index']]:
+                image = indexed_images[i]
+                page_entries.append((image.path, image.mtime))
+                with stage('meta'):
+                    # Index pages never touch the files: metadata not cached
+                    # yet is read in the background for later views
+                    _, meta = meta_cache.lookup(image.path, image.mtime)
                 tiles.append({
-                    'href': f"/images/{i}",
-                    'img_src': f"/images/{i}",
-                    'filename': filename,
-                    'caption': caption,
+                    'href': index_image_url(image),
+                    'img_src': index_image_url(image),
+                    'filename': image.name,
+                    'caption': format_tile_date(meta, image.mtime),
+                    'size': meta.display_size if meta else (None, None),
+                    # Indexes built with generate_index.py --dedup list the
+                    # other copies of each kept image
+                    'copies': image.copies,
                 })
 
+            add_sprites(tiles, page_entries)
+
+            notice = None
+            loader = app.config['INDEX_LOADER']
+            if not loader.ready:
+                notice = (f"Loading index&hellip; {loader.progress * 100:.0f}% "
+                          f"({total_images} images available so far).")
+
+            if view is not None:
+                return render_index_folder(view, recursive, pagination, tiles, notice), \
+                    pagination, page_entries
+
             from .renderer import render_gallery
-            return render_gallery(
-                title="Indexed Image Gallery",
-                page=pagination['page'],
-                total_pages=pagination['total_pages'],
-                start_page_num=pagination['start_page_num'],
-                end_page_num=pagination['end_page_num'],
-                tiles=tiles,
-                empty_message="No image files found in the index.",
-            )
+            with RENDER_SECONDS.time(), stage('render'):
+                html = render_gallery(
+                    title="Indexed Image Gallery",
+                    page=pagination['page'],
+                    total_pages=pagination['total_pages'],
+                    start_page_num=pagination['start_page_num'],
+                    end_page_num=pagination['end_page_num'],
+                    tiles=tiles,
+                    empty_message="No image files found in the index.",
+                    notice=notice,
+                    downloads=[
+                        ("Download Page", f"/download.zip?page={pagination['page']}"),
+                        ("Download All", "/download.zip"),
+                    ] if total_images else None,
+                )
+            return html, pagination, page_entries
         else:
             # CWD mode: original logic
             dir_arg = request.args.get('dir', '')
             page = request.args.get('page', 1, type=int)
             sort_by = request.args.get('sort', 'name')
+            recursive = request.args.get('recursive', '') == '1'
 
-            current_dir = os.path.normpath(os.path.join(app.config['ROOT_DIR'], dir_arg))
-            if not current_dir.startswith(app.config['ROOT_DIR']):
-                abort(403, description="Access denied: Directory outside allowed root.")
-
-            if not os.path.isdir(current_dir):
-                abort(404, description="Directory not found.")
-
-            image_entries = list_images_in_directory(current_dir, sort_by)
+            # One deadline for all of this request's filesystem work, so a
+            # hung mount costs at most STAT_TIMEOUT
+            deadline = request_deadline()
+            current_dir, listing, image_entries, copies, scanning, sorting = directory_listing(
+                dir_arg, sort_by, recursive, deadline)
             total_images = len(image_entries)
 
             # Log directory statistics
@@ -101,129 +562,412 @@ def create_app(index_file=None):
             display_path = app.config['ROOT_DIR'] if rel_display == '.' else rel_display
             logger.info(f"Directory: {display_path} ({total_images} images)")
 
-            # Log subdirectory statistics
+            # Log subdirectory statistics (a scan per subdirectory: debug only)
             subdir_stats = []
-            try:
-                for item in os.listdir(current_dir):
-                    full_path = os.path.join(current_dir, item)
-                    if os.path.isdir(full_path) and not item.startswith('.'):
-                        subdir_images = len(list_images_in_directory(full_path, 'date'))
+            if logger.isEnabledFor(logging.DEBUG):
+                try:
+                    for item in list_subdirectories(current_dir, listing):
+                        full_path = os.path.join(current_dir, item)
+                        subdir_listing = scan_listing(full_path, scan_cache, stat_pool, deadline)
+                        subdir_images = len(list_images_in_directory(full_path, 'date', subdir_listing))
                         subdir_stats.append(f"{item}({subdir_images})")
-            except OSError:
-                pass
+                except OSError:
+                    pass
 
             if subdir_stats:
-                logger.info(f"Subdirectories: {', '.join(subdir_stats)}")
+                logger.debug(f"Subdirectories: {', '.join(subdir_stats)}")
 
             pagination = compute_pagination_window(page=page, total_items=total_images)
 
             tiles = []
+            page_entries = []
             for filename, mtime in image_entries[pagination['start_index']:pagination['end_index']]:
                 rel_path = os.path.relpath(current_dir, app.config['ROOT_DIR'])
                 if rel_path == '.':
                     img_path = filename
                 else:
                     img_path = os.path.join(rel_path, filename).replace(os.sep, '/')
-                caption = format_date_from_timestamp(mtime)
+                page_entries.append((os.path.join(current_dir, filename), mtime))
+                with stage('meta'):
+                    meta = read_tile_meta(page_entries[-1][0], mtime, deadline)
                 tiles.append({
                     'href': f"/images/{img_path}",
                     'img_src': f"/images/{img_path}",
                     'filename': filename,
-                    'caption': caption,
+                    'caption': format_tile_date(meta, mtime),
+                    'size': meta.display_size if meta else (None, None),
+                    'copies': copies.get(filename, 1),
                 })
 
+            add_sprites(tiles, page_entries)
+
             subdirs = []
             try:
-                for item in os.listdir(current_dir):
+                for item in list_subdirectories(current_dir, listing):
                     full_path = os.path.join(current_dir, item)
-                    if os.path.isdir(full_path) and not item.startswith('.'):
-                        rel_subdir = os.path.relpath(full_path, app.config['ROOT_DIR']).replace(os.sep, '/')
-                        subdirs.append((item, rel_subdir))
+                    rel_subdir = os.path.relpath(full_path, app.config['ROOT_DIR']).replace(os.sep, '/')
+                    subdirs.append((item, rel_subdir))
             except OSError:
                 pass
 
             rel_display = os.path.relpath(current_dir, app.config['ROOT_DIR'])
             display_path = app.config['ROOT_DIR'] if rel_display == '.' else rel_display
             title = f"CWD Image Gallery: {display_path}"
-
+            notice = None
+            if scanning:
+                notice = f"Still scanning subdirectories&hellip; {total_images} images found so far."
+            elif not recursive and listing is not None and not listing.complete:
+                notice = (f"The filesystem did not answer in time; showing the "
+                          f"{total_images} images listed so far. Reload to retry.")
+            elif sorting:
+                notice = "Still reading capture times&hellip; some images are ordered by date for now."
+
+            query = urlencode({k: v for k, v in (
+                ('dir', dir_arg), ('sort', sort_by if sort_by != 'name' else ''),
+                ('recursive', '1' if recursive else '')) if v})
+            download_all = f"/download.zip?{query}" if query else "/download.zip"
+            separator = "&" if query else "?"
+            downloads = [
+                ("Download Page", f"{download_all}{separator}page={pagination['page']}"),
+                ("Download All", download_all),
+            ] if total_images else None
+
+            with RENDER_SECONDS.time(), stage('render'):
+                html = render_gallery_with_dirs(
+                    title=title,
+                    page=pagination['page'],
+                    total_pages=pagination['total_pages'],
+                    start_page_num=pagination['start_page_num'],
+                    end_page_num=pagination['end_page_num'],
+                    tiles=tiles,
+                    empty_message="No image files found in current directory.",
+                    subdirs=subdirs,
+                    current_dir_rel=dir_arg,
+                    sort_by=sort_by,
+                    recursive=recursive,
+                    notice=notice,
+                    downloads=downloads,
+                )
+            return html, pagination, page_entries
+
+    def index_listing(dir_arg: str, recursive: bool):
+        """Return ``(entries, positions, view)`` for an index-mode folder.
+
+        ``positions`` index into ``entries``. Until the index has loaded
+        there is no folder tree; ``view`` is then None and every loaded
+        entry is listed.
+        """
+        tree = app.config['INDEX_TREE']
+        if tree is None:
+            indexed_images = app.config['ALL_INDEXED_IMAGES']
+            return indexed_images, range(len(indexed_images)), None
+        view = tree.find(dir_arg)
+        if view is None:
+            abort(404, description="Directory not found in the index.")
+        return tree.entries, view.positions(tree, recursive), view
+
+    def render_index_folder(view, recursive: bool, pagination: dict, tiles: list[dict], notice):
+        """Render an index-mode page with folder navigation."""
+        tree = app.config['INDEX_TREE']
+        subdirs = [(f"{name} ({count})", f"{view.path}/{name}" if view.path else name)
+                   for name, count in view.subdirs]
+        display_path = os.path.join(tree.root_path, view.path) if view.path else tree.root_path
+        query = urlencode({k: v for k, v in (
+            ('dir', view.path), ('recursive', '' if recursive else '0')) if v})
+        download_all = f"/download.zip?{query}" if query else "/download.zip"
+        separator = "&" if query else "?"
+        with RENDER_SECONDS.time(), stage('render'):
             return render_gallery_with_dirs(
-                title=title,
+                title=f"Indexed Image Gallery: {display_path or '/'}",
                 page=pagination['page'],
                 total_pages=pagination['total_pages'],
                 start_page_num=pagination['start_page_num'],
                 end_page_num=pagination['end_page_num'],
                 tiles=tiles,
-                empty_message="No image files found in current directory.",
+                empty_message="No images directly in this folder." if view.subdirs
+                else "No image files found in the index.",
                 subdirs=subdirs,
-                current_dir_rel=dir_arg,
-                sort_by=sort_by,
+                current_dir_rel=view.path,
+                recursive=recursive,
+                notice=notice,
+                downloads=[
+                    ("Download Page", f"{download_all}{separator}page={pagination['page']}"),
+                    ("Download All", download_all),
+                ] if pagination['total_pages'] else None,
+                # Index entries are only kept newest first
+                recursive_default=True,
+                sort_options=(),
             )
 
+    def index_image_url(image) -> str:
+        """Stable URL of an index entry; the name is only for saving."""
+        return f"/images/{image.id:016x}/{quote(image.name)}"
+
+    def add_sprites(tiles: list[dict], page_entries) -> None:
+        """Point each tile at its cell of the page's contact sheets."""
+        if sprites is None or not tiles:
+            return
+        version, cells = sprites.layout(page_entries)
+        for tile, (sheet, x, y) in zip(tiles, cells):
+            tile['sprite'] = (f"/sprites/{version}/{sheet}.jpg", x, y)
+
+    @app.route('/sprites/<version>/<int:sheet>.jpg')
+    def serve_sprite(version: str, sheet: int):
+        if sprites is None:
+            abort(404)
+        with stage('sprite'):
+            # None for versions this process hasn't served a page for (after
+            # a restart or eviction, or made up); never render pages for them
+            data = sprites.get(version, sheet, lambda build: admitted('sprite', build))
+        if data is None:
+            abort(404, description="Contact sheet not found; reload the page.")
+        response = Response(data, mimetype='image/jpeg')
+        # The version is derived from the page's paths and mtimes
+        response.headers['Cache-Control'] = f'public, max-age={IMMUTABLE_MAX_AGE}, immutable'
+        return response
+
+    @app.route('/download.zip')
+    def download_zip():
+        """Stream the images of a directory (or one page of it) as a ZIP."""
+        page = request.args.get('page', type=int)
+        if app.config['INDEX_MODE']:
+            indexed_images, positions, view = index_listing(
+                request.args.get('dir', ''), request.args.get('recursive', '1') == '1')
+            if page is not None:
+                pagination = compute_pagination_window(page=page, total_items=len(positions))
+                positions = positions[pagination['start_index']:pagination['end_index']]
+            # Index entries come from anywhere on disk; keep basenames but
+            # make them unique within the archive
+            members, seen = [], set()
+            for i in positions:
+                image = indexed_images[i]
+                members.append((unique_arcname(image.name, seen), image.path))
+            archive_name = (view and os.path.basename(view.path)) or "images"
+        else:
+            dir_arg = request.args.get('dir', '')
+            sort_by = request.args.get('sort', 'name')
+            recursive = request.args.get('recursive', '') == '1'
+            current_dir, _, image_entries, _, scanning, _ = directory_listing(
+                dir_arg, sort_by, recursive)
+            if scanning:
+                # A partial crawl would silently produce an incomplete archive
+                response = Response("Still scanning subdirectories; try again shortly.\n",
+                                    status=503, mimetype='text/plain')
+                response.headers['Retry-After'] = '5'
+                return response
+            if page is not None:
+                pagination = compute_pagination_window(page=page, total_items=len(image_entries))
+                image_entries = image_entries[pagination['start_index']:pagination['end_index']]
+            members = [(rel_path, os.path.join(current_dir, rel_path))
+                       for rel_path, _ in image_entries]
+            archive_name = os.path.basename(current_dir) or "images"
+        if not members:
+            abort(404, description="No images to download.")
+
+        if page is not None:
+            archive_name += f"-page{page}"
+        logger.info(f"Streaming {archive_name}.zip ({len(members)} images)")
+        environ = request.environ
+        response = Response(stream_zip(members, cancelled=lambda: client_disconnected(environ)),
+                            mimetype='application/zip',
+                            direct_passthrough=True)
+        ascii_name = archive_name.encode('ascii', 'replace').decode().replace('?', '_').replace('"', '_')
+        response.headers['Content-Disposition'] = (
+            f'attachment; filename="{ascii_name}.zip"; '
+            f"filename*=UTF-8''{quote(archive_name)}.zip"
+        )
+        return response
+
     @app.route('/images/<path:img_path>')
     def serve_image(img_path: str):
         if app.config['INDEX_MODE']:
-            # Index mode: serve by index
-            try:
+            # Index mode: serve by stable id (/images/<id>/<name>)
+            indexed_images = app.config['ALL_INDEXED_IMAGES']
+            # isdigit() alone would let e.g. "²" through to int()
+            if img_path.isascii() and img_path.isdecimal():
+                # Old positional URLs change meaning with every reload; send
+                # them, uncached, to the stable URL of what is there now
                 image_index = int(img_path)
-                if not (0 <= image_index < len(app.config['ALL_INDEXED_IMAGES'])):
+                if image_index >= len(indexed_images):
                     abort(404, description="Image not found in index.")
-                image_data = app.config['ALL_INDEXED_IMAGES'][image_index]
-                full_path = image_data['path']
-                # Security check: ensure path exists and is file
-                if not os.path.isfile(full_path):
-                    abort(404, description="File not found on disk.")
-                return send_file(full_path)
+                response = redirect(index_image_url(indexed_images[image_index]))
+                response.headers['Cache-Control'] = 'no-cache'
+                return response
+            id_hex = img_path.partition('/')[0]
+            try:
+                if len(id_hex) != 16:
+                    raise ValueError(id_hex)
+                position = indexed_images.find(int(id_hex, 16))
             except ValueError:
-                abort(400, description="Invalid image index.")
+                abort(400, description="Invalid image id.")
+            if position is None:
+                abort(404, description="Image not found in index.")
+            image = indexed_images[position]
+            # Security check: ensure path exists and is file
+            with stage('send'):
+                if file_cache is not None:
+                    cached = file_cache.get(image.path)
+                    if cached is None:
+                        abort(404, description="File not found on disk.")
+                    mtime = cached.mtime
+                    response = file_response(file_cache, cached)
+                else:
+                    try:
+                        st = os.stat(image.path)
+                    except OSError:
+                        abort(404, description="File not found on disk.")
+                    if not stat.S_ISREG(st.st_mode):
+                        abort(404, description="File not found on disk.")
+                    mtime = st.st_mtime
+                    response = send_file(image.path)
+            if mtime == image.mtime:
+                # The id covers path and mtime, so this URL always means
+                # these bytes; skipped if the file changed since indexing
+                response.cache_control.public = True
+                response.cache_control.max_age = IMMUTABLE_MAX_AGE
+                response.cache_control.immutable = True
+                response.cache_control.no_cache = None
+            return response
         else:
             # CWD mode: original logic
             full_path = os.path.normpath(os.path.join(app.config['ROOT_DIR'], img_path))
             if not full_path.startswith(app.config['ROOT_DIR']):
                 abort(403, description="Access forbidden: File outside allowed root.")
+            if file_cache is not None:
+                with stage('send'):
+                    cached = file_cache.get(full_path)
+                    if cached is None:
+                        abort(404, description="File not found.")
+                    return file_response(file_cache, cached)
             if not os.path.isfile(full_path):
                 abort(404, description="File not found.")
-            return send_file(full_path)
+            with stage('send'):
+                return send_file(full_path)
 
     return app
 
 
-def list_images_in_directory(directory_path: str, sort_by: str = 'name'):
-    """Return a sorted list of (filename, mtime) for image files in the directory.
+def admission_class(path: str) -> str | None:
+    """Work class for admission control; None for cheap requests."""
+    if path == '/':
+        return 'page'
+    if path == '/download.zip':
+        return 'download'
+    if path.startswith('/sprites/'):
+        return 'sprite'
+    return None
+
+
+def unique_arcname(name: str, seen: set) -> str:
+    """Return ``name``, or ``name (2).ext`` etc. if it is already in ``seen``."""
+    candidate, n = name, 1
+    stem, ext = os.path.splitext(name)
+    while candidate in seen:
+        n += 1
+        candidate = f"{stem} ({n}){ext}"
+    seen.add(candidate)
+    return candidate
+
+
+def format_tile_date(meta, mtime: float) -> str:
+    """Tile caption: the EXIF capture time when known, else the file mtime."""
+    if meta is not None and meta.taken is not None:
+        return format_date_from_timestamp(meta.taken)
+    return format_date_from_timestamp(mtime)
 
-    By default, sorted alphabetically by filename.
+
+def is_directory(path: str, stat_pool=None, deadline=None) -> bool:
+    """``os.path.isdir``, run on the stat pool when there is one.
+
+    A check that misses the deadline counts as a directory: the scan that
+    follows then comes back incomplete instead of blocking.
+    """
+    if stat_pool is None:
+        return os.path.isdir(path)
+    try:
+        return stat_pool.call(os.path.isdir, path, deadline=deadline)
+    except TimeoutError:
+        return True
+
+
+def scan_listing(directory_path: str, scan_cache=None, stat_pool=None, deadline=None):
+    """Scan a directory through the scan cache or stat pool.
+
+    Returns a ``DirectoryScan``, or None if neither is configured (or the
+    scan failed), in which case callers list the directory directly.
     """
-    if not os.path.isdir(directory_path):
-        return []
-
-    entries: list[tuple[str, float]] = []
-    for filename in os.listdir(directory_path):
-        if not filename.lower().endswith(IMAGE_EXTENSIONS):
-            continue
-        file_path = os.path.join(directory_path, filename)
-        if not os.path.isfile(file_path):
-            continue
-        if filename.startswith('._'):
-            continue
+    if scan_cache is None and stat_pool is None:
+        return None
+    with SCAN_SECONDS.time(), stage('scan'):
         try:
-            mtime = os.path.getmtime(file_path)
+            if scan_cache is not None:
+                return scan_cache.scan(directory_path, deadline)
+            return stat_pool.scan(directory_path, IMAGE_EXTENSIONS, deadline)
         except OSError:
-            mtime = float('inf')
-        entries.append((filename, mtime))
+            return None
 
-    if sort_by == 'name':
-        entries.sort(key=lambda x: x[0].lower())
-    else:  # date
-        entries.sort(key=lambda x: float(x[1]), reverse=True)  # newest first
+
+def list_subdirectories(directory_path: str, listing=None) -> list[str]:
+    """Return the names of the non-hidden subdirectories of a directory."""
+    if listing is not None:
+        return [name for name, _ in listing.subdirs]
+    return [item for item in os.listdir(directory_path)
+            if os.path.isdir(os.path.join(directory_path, item)) and not item.startswith('.')]
+
+
+def list_images_in_directory(directory_path: str, sort_by: str = 'name', listing=None):
+    """Return a sorted list of (filename, mtime) for image files in the directory.
+
+    By default, sorted alphabetically by filename. ``listing`` is a
+    ``DirectoryScan`` from ``scan_listing``; without one the directory is
+    listed here.
+    """
+    if listing is not None:
+        entries = [(filename, mtime) for filename, mtime, _ in listing.files]
+    else:
+        with SCAN_SECONDS.time():
+            if not os.path.isdir(directory_path):
+                return []
+
+            entries: list[tuple[str, float]] = []
+            with stage('scan'):
+                for filename in os.listdir(directory_path):
+                    if not filename.lower().endswith(IMAGE_EXTENSIONS):
+                        continue
+                    file_path = os.path.join(directory_path, filename)
+                    if not os.path.isfile(file_path):
+                        continue
+                    if filename.startswith('._'):
+                        continue
+                    try:
+                        mtime = os.path.getmtime(file_path)
+                    except OSError:
+                        mtime = float('inf')
+                    entries.append((filename, mtime))
+
+    with stage('sort'):
+        if sort_by == 'name':
+            entries.sort(key=lambda x: x[0].lower())
+        else:  # date
+            entries.sort(key=lambda x: float(x[1]), reverse=True)  # newest first
     return entries
 
 
-# Create default app for backward compatibility
-app = create_app()
+def __getattr__(name):
+    # `from imgserve.app import app` still works, but the default CWD app is
+    # only built on first use instead of as a side effect of importing
+    if name == 'app':
+        default_app = globals().get('_default_app')
+        if default_app is None:
+            default_app = globals()['_default_app'] = create_app()
+        return default_app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 if __name__ == "__main__":
     # Simple direct run with defaults (CWD mode, no CLI)
     import logging
+    app = create_app()
     try:
         from waitress import serve
         logging.basicConfig(level=logging.WARNING, format="%(message)s")
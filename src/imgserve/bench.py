@@ -0,0 +1,504 @@
+"""Load-testing tools behind ``image-serve bench``.
+
+``image-serve bench http`` starts a real server (either backend) on
+localhost against a synthetic or existing tree, drives a mix of gallery
+pages, deep pages and image downloads at a fixed concurrency, and reports
+throughput, latency percentiles, errors and the server's CPU time and RSS.
+
+``image-serve bench replay`` plays an access trace recorded with
+``--trace-file`` against a running instance, at the original or a scaled
+speed, and ``image-serve bench compare`` shows per-route latency changes
+between two saved runs.
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+from urllib.parse import quote, urlsplit
+
+from . import synthetic
+from .accesstrace import read_trace
+from .metrics import route_label
+from .renderer import IMAGES_PER_PAGE
+
+DEFAULT_MIX = "gallery=50,deep=20,image=30"
+# Image paths sampled from the tree to pick downloads from
+MAX_SAMPLED_IMAGES = 10000
+
+
+def percentile(sorted_values: list[float], q: float) -> float:
+    """Nearest-rank percentile of an already sorted list (0 if empty)."""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(q / 100 * len(sorted_values))) - 1))
+    return sorted_values[rank]
+
+
+def is_error(status: int) -> bool:
+    """No response, 5xx (503: shed by admission control) or 429 (per-client limit)."""
+    return status == 0 or status == 429 or status >= 500
+
+
+def latency_summary(latencies: list[float]) -> dict:
+    values = sorted(latencies)
+    return {
+        "count": len(values),
+        "p50_ms": percentile(values, 50) * 1000,
+        "p90_ms": percentile(values, 90) * 1000,
+        "p99_ms": percentile(values, 99) * 1000,
+        "max_ms": (values[-1] if values else 0.0) * 1000,
+    }
+
+
+def parse_mix(text: str) -> dict[str, float]:
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in ('gallery', 'deep', 'image'):
+            raise argparse.ArgumentTypeError(f"unknown request kind '{name}' in mix")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def _free_port(host: str) -> int:
+    with socket.socket() as s:
+        s.bind((host, 0))
+        return s.getsockname()[1]
+
+
+class ProcessSampler(threading.Thread):
+    """Sample CPU time and RSS of a process tree from /proc (Linux)."""
+
+    def __init__(self, pid: int, interval: float = 0.25):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak_rss_bytes = 0
+        self.cpu_seconds = 0.0
+        self.available = os.path.exists(f"/proc/{pid}/stat")
+        self._done = threading.Event()
+        self._ticks = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+        self._page_size = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+        self._cpu_start = None
+
+    def _tree(self) -> list[int]:
+        pids, todo = [], [self.pid]
+        while todo:
+            pid = todo.pop()
+            pids.append(pid)
+            try:
+                with open(f"/proc/{pid}/task/{pid}/children") as f:
+                    todo.extend(int(p) for p in f.read().split())
+            except OSError:
+                pass
+        return pids
+
+    def _sample(self) -> tuple[float, int]:
+        cpu, rss = 0.0, 0
+        for pid in self._tree():
+            try:
+                with open(f"/proc/{pid}/stat") as f:
+                    fields = f.read().rsplit(')', 1)[1].split()
+                cpu += (int(fields[11]) + int(fields[12])) / self._ticks
+                rss += int(fields[21]) * self._page_size
+            except (OSError, IndexError, ValueError):
+                pass
+        return cpu, rss
+
+    def run(self) -> None:
+        if not self.available:
+            return
+        while not self._done.is_set():
+            cpu, rss = self._sample()
+            if self._cpu_start is None:
+                self._cpu_start = cpu
+            self.cpu_seconds = cpu - self._cpu_start
+            self.peak_rss_bytes = max(self.peak_rss_bytes, rss)
+            self._done.wait(self.interval)
+
+    def stop(self) -> None:
+        self._done.set()
+        self.join()
+
+
+class RequestPlan:
+    """Picks request paths for each kind from the layout of the served tree."""
+
+    def __init__(self, tree: str, mix: dict[str, float], seed: int = 0):
+        self.mix_names = list(mix)
+        self.mix_weights = [mix[name] for name in self.mix_names]
+        self.dirs: list[tuple[str, int]] = []  # (rel dir, image count)
+        self.images: list[str] = []
+        rng = random.Random(seed)
+        seen = 0
+        for dirpath, dirnames, files in os.walk(tree):
+            dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+            rel = os.path.relpath(dirpath, tree).replace(os.sep, '/')
+            rel = '' if rel == '.' else rel
+            names = [f for f in files if f.lower().endswith(synthetic.DEFAULT_EXTENSIONS + ('.bmp', '.tiff', '.heif'))]
+            self.dirs.append((rel, len(names)))
+            for name in names:
+                seen += 1
+                path = f"{rel}/{name}" if rel else name
+                # Reservoir sample so huge trees don't have to fit in memory
+                if len(self.images) < MAX_SAMPLED_IMAGES:
+                    self.images.append(path)
+                else:
+                    slot = rng.randrange(seen)
+                    if slot < MAX_SAMPLED_IMAGES:
+                        self.images[slot] = path
+        if not self.images and 'image' in mix:
+            raise SystemExit(f"No images found under {tree}")
+
+    def pick(self, rng: random.Random) -> tuple[str, str]:
+        kind = rng.choices(self.mix_names, self.mix_weights)[0]
+        if kind == 'image':
+            return kind, "/images/" + quote(rng.choice(self.images))
+        rel, count = rng.choice(self.dirs)
+        dir_param = f"dir={quote(rel)}&" if rel else ""
+        if kind == 'gallery':
+            return kind, f"/?{dir_param}page=1"
+        last_page = max(1, (count + IMAGES_PER_PAGE - 1) // IMAGES_PER_PAGE)
+        return kind, f"/?{dir_param}sort=date&page={rng.randint(1, last_page)}"
+
+
+def _worker(host, port, plan, rng, deadline, max_requests, counter, lock, results):
+    conn = None
+    while time.monotonic() < deadline:
+        if max_requests is not None:
+            with lock:
+                if counter[0] >= max_requests:
+                    break
+                counter[0] += 1
+        kind, path = plan.pick(rng)
+        start = time.perf_counter()
+        status, size = 0, 0
+        try:
+            if conn is None:
+                conn = http.client.HTTPConnection(host, port, timeout=60)
+            conn.request("GET", path)
+            response = conn.getresponse()
+            size = len(response.read())
+            status = response.status
+            if response.getheader('Connection', '').lower() == 'close':
+                conn.close()
+                conn = None
+        except (OSError, http.client.HTTPException):
+            if conn is not None:
+                conn.close()
+            conn = None
+        results.append((kind, time.perf_counter() - start, status, size))
+    if conn is not None:
+        conn.close()
+
+
+def start_server(tree: str, host: str, port: int, server_args: list[str]) -> subprocess.Popen:
+    cmd = [sys.executable, "-m", "imgserve.cli", "--host", host, "--port", str(port)] + server_args
+    env = dict(os.environ)
+    package_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env["PYTHONPATH"] = package_root + os.pathsep + env.get("PYTHONPATH", "")
+    proc = subprocess.Popen(cmd, cwd=tree, env=env, stdout=subprocess.DEVNULL)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit(f"Server exited during startup with status {proc.returncode}")
+        try:
+            with socket.create_connection((host, port), timeout=0.5):
+                return proc
+        except OSError:
+            time.sleep(0.1)
+    proc.terminate()
+    raise SystemExit("Server did not start listening within 60s")
+
+
+def run_http(args) -> dict:
+    mix = parse_mix(args.mix)
+    tmpdir = None
+    tree = args.tree
+    if tree is None:
+        tmpdir = tempfile.mkdtemp(prefix="imgserve-load-")
+        tree = os.path.join(tmpdir, "tree")
+        print(f"Generating synthetic tree in {tree} ...", file=sys.stderr)
+        synthetic.generate_tree(tree, depth=args.depth, fanout=args.fanout,
+                                files_per_dir=args.files_per_dir, real_images=True)
+    try:
+        plan = RequestPlan(tree, mix, seed=args.seed)
+        port = args.port or _free_port(args.host)
+        server_args = ["--server", args.server, "--threads", str(args.threads),
+                       "--workers", str(args.workers)] + list(args.server_arg or [])
+        if not args.admission_control:
+            # Measure the server, not how much of the load it sheds
+            server_args.append("--no-admission-control")
+        proc = start_server(tree, args.host, port, server_args)
+        sampler = ProcessSampler(proc.pid)
+        try:
+            if args.warmup:
+                warm = []
+                _worker(args.host, port, plan, random.Random(args.seed), time.monotonic() + args.warmup,
+                        None, [0], threading.Lock(), warm)
+            sampler.start()
+            results: list[tuple[str, float, int, int]] = []
+            counter, lock = [0], threading.Lock()
+            deadline = time.monotonic() + args.duration
+            threads = [threading.Thread(
+                target=_worker,
+                args=(args.host, port, plan, random.Random(args.seed + i), deadline,
+                      args.requests, counter, lock, results),
+                daemon=True) for i in range(args.concurrency)]
+            started = time.perf_counter()
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            elapsed = time.perf_counter() - started
+            sampler.stop()
+        finally:
+            proc.terminate()
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+    finally:
+        if tmpdir:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+    report = {
+        "config": {
+            "server": args.server, "threads": args.threads, "workers": args.workers,
+            "server_args": list(args.server_arg or []), "concurrency": args.concurrency,
+            "admission_control": args.admission_control,
+            "mix": mix, "duration": args.duration, "requests": args.requests,
+        },
+        "elapsed_seconds": elapsed,
+        "requests": len(results),
+        "throughput_rps": len(results) / elapsed if elapsed else 0.0,
+        "errors": sum(1 for r in results if is_error(r[2])),
+        "bytes": sum(r[3] for r in results),
+        "latency": latency_summary([r[1] for r in results]),
+        "by_kind": {},
+        "server": {
+            "cpu_seconds": sampler.cpu_seconds if sampler.available else None,
+            "cpu_percent": sampler.cpu_seconds / elapsed * 100 if sampler.available and elapsed else None,
+            "peak_rss_mb": sampler.peak_rss_bytes / 1e6 if sampler.available else None,
+        },
+    }
+    report["error_rate"] = report["errors"] / len(results) if results else 0.0
+    for kind in mix:
+        kind_results = [r for r in results if r[0] == kind]
+        summary = latency_summary([r[1] for r in kind_results])
+        summary["errors"] = sum(1 for r in kind_results if is_error(r[2]))
+        report["by_kind"][kind] = summary
+    return report
+
+
+def print_http_report(report: dict) -> None:
+    cfg = report["config"]
+    print(f"server={cfg['server']} threads={cfg['threads']} workers={cfg['workers']} "
+          f"concurrency={cfg['concurrency']} {' '.join(cfg['server_args'])}".rstrip())
+    print(f"{report['requests']} requests in {report['elapsed_seconds']:.1f}s: "
+          f"{report['throughput_rps']:.1f} req/s, {report['bytes'] / 1e6:.1f} MB, "
+          f"error rate {report['error_rate'] * 100:.2f}%")
+    print(f"{'kind':<10} {'count':>8} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9} {'errors':>7}")
+    rows = list(report["by_kind"].items()) + [("all", dict(report["latency"], errors=report["errors"]))]
+    for kind, s in rows:
+        print(f"{kind:<10} {s['count']:>8} {s['p50_ms']:>9.2f} {s['p90_ms']:>9.2f} "
+              f"{s['p99_ms']:>9.2f} {s['max_ms']:>9.2f} {s['errors']:>7}")
+    server = report["server"]
+    if server["cpu_seconds"] is not None:
+        print(f"server cpu {server['cpu_seconds']:.1f}s ({server['cpu_percent']:.0f}%), "
+              f"peak rss {server['peak_rss_mb']:.1f} MB")
+
+
+def add_http_parser(subparsers) -> None:
+    p = subparsers.add_parser("http", help="Load-test a local server over HTTP")
+    p.add_argument("--tree", help="Serve this directory instead of a generated synthetic tree")
+    p.add_argument("--depth", type=int, default=2, help="Synthetic tree depth (default: 2)")
+    p.add_argument("--fanout", type=int, default=4, help="Synthetic subdirectories per directory (default: 4)")
+    p.add_argument("--files-per-dir", type=int, default=600,
+                   help="Synthetic images per directory (default: 600)")
+    p.add_argument("--server", choices=("waitress", "asyncio"), default="waitress")
+    p.add_argument("--threads", type=int, default=8, help="Server --threads (default: 8)")
+    p.add_argument("--workers", type=int, default=1, help="Server --workers (default: 1)")
+    p.add_argument("--server-arg", action="append", metavar="ARG",
+                   help="Extra argument passed to the server (repeatable), e.g. --server-arg=--verbose")
+    p.add_argument("--concurrency", type=int, default=16, help="Concurrent client connections (default: 16)")
+    p.add_argument("--admission-control", action="store_true",
+                   help="Leave the server's admission control on (503/429 count as errors)")
+    p.add_argument("--duration", type=float, default=10.0, help="Seconds to run (default: 10)")
+    p.add_argument("--requests", type=int, default=None, help="Stop after this many requests")
+    p.add_argument("--warmup", type=float, default=1.0, help="Seconds of single-client warm-up (default: 1)")
+    p.add_argument("--mix", default=DEFAULT_MIX,
+                   help=f"Weighted request mix of gallery/deep/image (default: {DEFAULT_MIX})")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=0, help="Port for the server (default: a free port)")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--output", help="Also write the report as JSON to this file")
+    p.set_defaults(func=_cmd_http)
+
+
+def _cmd_http(args) -> None:
+    report = run_http(args)
+    print_http_report(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+def run_replay(args) -> dict:
+    records = read_trace(args.trace)
+    if args.limit:
+        records = records[:args.limit]
+    if not records:
+        raise SystemExit(f"No requests in trace {args.trace}")
+    target = urlsplit(args.target if '://' in args.target else f"http://{args.target}")
+    host, port = target.hostname, target.port or 80
+
+    # A dispatcher releases requests at their (scaled) trace offsets; a pool
+    # of keep-alive client threads sends them as they become due.
+    pending: deque = deque()
+    cond = threading.Condition()
+    finished = [False]
+    results: list[tuple[str, float, int, int, float]] = []
+
+    def client():
+        conn = None
+        while True:
+            with cond:
+                while not pending and not finished[0]:
+                    cond.wait()
+                if not pending:
+                    break
+                record, due = pending.popleft()
+            path = record['p'] + (f"?{record['q']}" if record.get('q') else "")
+            lag = time.perf_counter() - due
+            start = time.perf_counter()
+            status, size = 0, 0
+            try:
+                if conn is None:
+                    conn = http.client.HTTPConnection(host, port, timeout=60)
+                conn.request("GET", path)
+                response = conn.getresponse()
+                size = len(response.read())
+                status = response.status
+                if response.getheader('Connection', '').lower() == 'close':
+                    conn.close()
+                    conn = None
+            except (OSError, http.client.HTTPException):
+                if conn is not None:
+                    conn.close()
+                conn = None
+            results.append((route_label(record['p']), time.perf_counter() - start, status, size, lag))
+        if conn is not None:
+            conn.close()
+
+    threads = [threading.Thread(target=client, daemon=True) for _ in range(args.concurrency)]
+    for t in threads:
+        t.start()
+    t0 = records[0]['t']
+    started = time.perf_counter()
+    for record in records:
+        due = started
+        if args.speed > 0:
+            due = started + (record['t'] - t0) / args.speed
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        with cond:
+            pending.append((record, due))
+            cond.notify()
+    with cond:
+        finished[0] = True
+        cond.notify_all()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    report = {
+        "config": {"trace": args.trace, "target": args.target, "speed": args.speed,
+                   "concurrency": args.concurrency},
+        "elapsed_seconds": elapsed,
+        "requests": len(results),
+        "throughput_rps": len(results) / elapsed if elapsed else 0.0,
+        "errors": sum(1 for r in results if is_error(r[2])),
+        "latency": latency_summary([r[1] for r in results]),
+        "schedule_lag_p99_ms": percentile(sorted(r[4] for r in results), 99) * 1000,
+        "by_route": {},
+    }
+    for route in sorted({r[0] for r in results}):
+        route_results = [r for r in results if r[0] == route]
+        summary = latency_summary([r[1] for r in route_results])
+        summary["errors"] = sum(1 for r in route_results if is_error(r[2]))
+        report["by_route"][route] = summary
+    return report
+
+
+def _cmd_replay(args) -> None:
+    report = run_replay(args)
+    print(f"Replayed {report['requests']} requests in {report['elapsed_seconds']:.1f}s "
+          f"({report['throughput_rps']:.1f} req/s, {report['errors']} errors, "
+          f"schedule lag p99 {report['schedule_lag_p99_ms']:.1f} ms)")
+    print(f"{'route':<10} {'count':>8} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9} {'errors':>7}")
+    for route, s in list(report["by_route"].items()) + [("all", dict(report["latency"], errors=report["errors"]))]:
+        print(f"{route:<10} {s['count']:>8} {s['p50_ms']:>9.2f} {s['p90_ms']:>9.2f} "
+              f"{s['p99_ms']:>9.2f} {s['max_ms']:>9.2f} {s['errors']:>7}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+def _cmd_compare(args) -> None:
+    runs = []
+    for path in (args.before, args.after):
+        with open(path) as f:
+            report = json.load(f)
+        groups = dict(report.get("by_route") or report.get("by_kind") or {})
+        groups["all"] = report["latency"]
+        runs.append(groups)
+    before, after = runs
+    print(f"{'route':<10} {'p50 before':>11} {'p50 after':>10} {'change':>8} "
+          f"{'p99 before':>11} {'p99 after':>10} {'change':>8}")
+    for route in [r for r in before if r in after]:
+        b, a = before[route], after[route]
+
+        def change(key):
+            return (a[key] - b[key]) / b[key] * 100 if b[key] else 0.0
+
+        print(f"{route:<10} {b['p50_ms']:>11.2f} {a['p50_ms']:>10.2f} {change('p50_ms'):>+7.1f}% "
+              f"{b['p99_ms']:>11.2f} {a['p99_ms']:>10.2f} {change('p99_ms'):>+7.1f}%")
+
+
+def add_replay_parsers(subparsers) -> None:
+    p = subparsers.add_parser("replay", help="Replay a recorded access trace against a server")
+    p.add_argument("trace", help="Trace file written by 'image-serve --trace-file'")
+    p.add_argument("--target", default="http://127.0.0.1:8000", help="Server to replay against")
+    p.add_argument("--speed", type=float, default=1.0,
+                   help="Playback speed relative to the recording; 0 sends as fast as possible (default: 1)")
+    p.add_argument("--concurrency", type=int, default=32,
+                   help="Maximum requests in flight (default: 32)")
+    p.add_argument("--limit", type=int, default=None, help="Replay only the first N requests")
+    p.add_argument("--output", help="Also write the report as JSON to this file")
+    p.set_defaults(func=_cmd_replay)
+
+    p = subparsers.add_parser("compare", help="Compare per-route latency of two saved runs")
+    p.add_argument("before", help="JSON report from 'bench replay' or 'bench http'")
+    p.add_argument("after", help="JSON report from 'bench replay' or 'bench http'")
+    p.set_defaults(func=_cmd_compare)
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(prog="image-serve bench", description="Benchmark an imgserve deployment.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    add_http_parser(subparsers)
+    add_replay_parsers(subparsers)
+    args = parser.parse_args(argv)
+    args.func(args)
@@ -1,9 +1,14 @@
 import argparse
 import logging
 import os
+import signal
+import sys
+import time
 
-# Import the Flask app factory
-from .app import create_app
+# Flask, Waitress and the app itself are imported only once we know we are
+# going to serve, so `--help` and the bench tools start without them.
+
+logger = logging.getLogger(__name__)
 
 
 def configure_logging(verbose: bool = False) -> None:
@@ -31,9 +36,16 @@ def configure_logging(verbose: bool = False) -> None:
         logging.getLogger("imgserve").setLevel(logging.WARNING)
 
 
-def main() -> None:
+def main(argv=None) -> None:
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] == "bench":
+        from .bench import main as bench_main
+        bench_main(argv[1:])
+        return
+
     parser = argparse.ArgumentParser(
-        description="Serve images in the current working directory as a simple gallery."
+        description="Serve images in the current working directory as a simple gallery.",
+        epilog="Run 'image-serve bench --help' for the load-testing tools.",
     )
     parser.add_argument(
         "--host",
@@ -52,6 +64,21 @@ def main() -> None:
         default=int(os.environ.get("IMGSERVE_THREADS", 8)),
         help="Number of worker threads (default: 8)",
     )
+    parser.add_argument(
+        "--server",
+        choices=("waitress", "asyncio"),
+        default=os.environ.get("IMGSERVE_SERVER", "waitress"),
+        help="Server backend: 'waitress' (thread per request) or 'asyncio' "
+             "(event loop with sendfile for image bodies; --threads sizes the "
+             "app thread pool) (default: waitress)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=int(os.environ.get("IMGSERVE_WORKERS", 1)),
+        help="Number of pre-forked worker processes sharing the listening "
+             "socket; dead workers are restarted (default: 1)",
+    )
     parser.add_argument(
         "-v",
         "--verbose",
@@ -62,29 +89,259 @@ def main() -> None:
         "--index-file",
         help="Path to JSON index file to serve from (instead of CWD). Use 'generate_index.py' to create one.",
     )
+    parser.add_argument(
+        "--index-reload-interval",
+        type=float,
+        default=float(os.environ.get("IMGSERVE_INDEX_RELOAD_INTERVAL", 5)),
+        metavar="SECONDS",
+        help="Check the index file for changes this often and reload it in the "
+             "background (default: 5; 0 disables, SIGHUP always reloads)",
+    )
+
+    parser.add_argument(
+        "--server-timing",
+        action="store_true",
+        default=bool(os.environ.get("IMGSERVE_SERVER_TIMING")),
+        help="Add a Server-Timing header (scan/sort/render/send) to every response",
+    )
+    parser.add_argument(
+        "--admin-token",
+        default=os.environ.get("IMGSERVE_ADMIN_TOKEN"),
+        help="Token enabling admin features such as '?__profile=1'; send it as "
+             "the X-Imgserve-Admin header or a '__token' query parameter",
+    )
+    parser.add_argument(
+        "--profile-dir",
+        default=os.environ.get("IMGSERVE_PROFILE_DIR"),
+        help="Save '?__profile=1' results here instead of returning them inline",
+    )
 
-    args = parser.parse_args()
+    parser.add_argument(
+        "--trace-file",
+        default=os.environ.get("IMGSERVE_TRACE_FILE"),
+        help="Append a compact access trace (one JSON line per request) to "
+             "this file for 'image-serve bench replay'",
+    )
+    parser.add_argument(
+        "--request-log-size",
+        type=int,
+        default=int(os.environ.get("IMGSERVE_REQUEST_LOG_SIZE", 1000)),
+        help="Recent requests (with stage timings) kept in memory for the "
+             "admin page /debug/requests (default: 1000; 0 turns recording off)",
+    )
+
+    parser.add_argument(
+        "--dedup",
+        action="store_true",
+        default=bool(os.environ.get("IMGSERVE_DEDUP")),
+        help="Show identical images (same content, any name) only once, with a "
+             "copy count; files are compared by size, then partial and full hashes",
+    )
+
+    parser.add_argument(
+        "--cache-dir",
+        default=os.environ.get("IMGSERVE_CACHE_DIR"),
+        help="Keep directory scans here so a restarted server doesn't rescan "
+             "unchanged directories",
+    )
+
+    parser.add_argument(
+        "--stat-pool",
+        choices=["auto", "on", "off"],
+        default=os.environ.get("IMGSERVE_STAT_POOL", "auto"),
+        help="Run per-file stat calls on a thread pool; 'auto' enables it when "
+             "the served directory is on a network filesystem (NFS, SMB, sshfs, ...)",
+    )
+    parser.add_argument(
+        "--stat-timeout",
+        type=float,
+        default=float(os.environ.get("IMGSERVE_STAT_TIMEOUT", 10)),
+        help="With the stat pool, seconds a directory scan may take before a "
+             "partial listing is shown (default: 10)",
+    )
+
+    parser.add_argument(
+        "--no-admission-control",
+        dest="admission_control",
+        action="store_false",
+        default=not os.environ.get("IMGSERVE_NO_ADMISSION_CONTROL"),
+        help="Don't limit concurrent gallery pages and ZIP downloads (by default "
+             "excess requests get 503/429 with Retry-After)",
+    )
+    parser.add_argument(
+        "--sprites",
+        action="store_true",
+        default=bool(os.environ.get("IMGSERVE_SPRITES")),
+        help="Draw gallery tiles from per-page contact sheets, a few requests "
+             "per page instead of one per image (requires Pillow)",
+    )
+    parser.add_argument(
+        "--file-cache-mb",
+        type=float,
+        default=float(os.environ.get("IMGSERVE_FILE_CACHE_MB", 64)),
+        help="Memory for frequently requested image files, in MiB (default: 64; "
+             "0 turns the cache off)",
+    )
+    parser.add_argument(
+        "--no-prefetch",
+        dest="prefetch",
+        action="store_false",
+        default=not os.environ.get("IMGSERVE_NO_PREFETCH"),
+        help="Don't render the next gallery page in the background while the "
+             "server is idle",
+    )
+    parser.add_argument(
+        "--client-limit",
+        type=int,
+        default=int(os.environ.get("IMGSERVE_CLIENT_LIMIT", 0)),
+        help="Gallery pages (and, separately, ZIP downloads) one client address "
+             "may run at once; more get 429 (default: 0, no per-client limit). "
+             "Behind a reverse proxy, also set --client-ip-header",
+    )
+    parser.add_argument(
+        "--client-ip-header",
+        default=os.environ.get("IMGSERVE_CLIENT_IP_HEADER"),
+        help="Header holding the real client address behind a reverse proxy "
+             "(e.g. X-Forwarded-For), used for per-client limits",
+    )
+
+    args = parser.parse_args(argv)
 
     # Create the app with the specified mode
-    application = create_app(index_file=args.index_file)
+    from .app import create_app
+    application = create_app(index_file=args.index_file, config={
+        "SERVER_TIMING": args.server_timing,
+        "ADMIN_TOKEN": args.admin_token,
+        "PROFILE_DIR": args.profile_dir,
+        "TRACE_FILE": args.trace_file,
+        "REQUEST_LOG_SIZE": args.request_log_size,
+        "DEDUP": args.dedup,
+        "CACHE_DIR": args.cache_dir,
+        "STAT_POOL_MODE": args.stat_pool,
+        "STAT_TIMEOUT": args.stat_timeout,
+        "ADMISSION_CONTROL": args.admission_control,
+        "THREADS": args.threads,
+        "CLIENT_LIMIT": args.client_limit,
+        "CLIENT_IP_HEADER": args.client_ip_header,
+        "PREFETCH": args.prefetch,
+        # Sheets are only known to the worker that served the page
+        "SPRITES": args.sprites and args.workers <= 1,
+        "FILE_CACHE_MB": args.file_cache_mb,
+        # With --workers the parent watches the index (see run_prefork)
+        "INDEX_RELOAD_INTERVAL": args.index_reload_interval if args.workers <= 1 else 0,
+        # Bind right away and load the index behind a "loading" banner; with
+        # --workers it is loaded before forking so workers share its memory
+        "BACKGROUND_INDEX_LOAD": args.workers <= 1,
+    })
 
     configure_logging(verbose=args.verbose)
+    if args.sprites and args.workers > 1:
+        logger.warning("--sprites is not supported with --workers; serving plain tiles.")
+
+    if args.workers > 1:
+        from .prefork import bind_socket, run_prefork, DRAIN_TIMEOUT_SECONDS
+        # Bind and build everything before forking so workers share the
+        # loaded index through copy-on-write memory
+        sock = bind_socket(args.host, args.port)
+        print(f"Server running at http://{args.host}:{args.port} ({args.workers} workers)")
+        # The parent reloads the index once and replaces the workers, so
+        # they keep sharing one copy
+        # Workers stop on SIGTERM by finishing their requests in progress,
+        # so replacing them after a reload drops nothing
+        run_prefork(lambda worker_sock: serve_app(application, args, sock=worker_sock,
+                                                  drain_timeout=DRAIN_TIMEOUT_SECONDS),
+                    sock, args.workers, index_loader=application.config.get('INDEX_LOADER'),
+                    reload_interval=args.index_reload_interval)
+        return
 
     print(f"Server running at http://{args.host}:{args.port}")
+    enable_index_reload(application, args.index_reload_interval)
+    serve_app(application, args)
+
+
+def enable_index_reload(application, interval: float) -> None:
+    """Reload ``--index-file`` on SIGHUP and, with ``interval``, when it changes.
+
+    Single-process servers only; with --workers the supervisor reloads.
+    """
+    loader = application.config.get('INDEX_LOADER')
+    if loader is None:
+        return
+    loader.watch(interval)
+    if hasattr(signal, 'SIGHUP'):
+        signal.signal(signal.SIGHUP, lambda signum, frame: loader.reload())
+
+
+def serve_app(application, args, sock=None, drain_timeout=None) -> None:
+    """Run ``application`` on the selected backend, optionally on a pre-bound socket.
+
+    With ``drain_timeout``, SIGTERM stops the server gracefully, giving
+    requests in progress up to that many seconds to finish.
+    """
+    if args.server == "asyncio":
+        from .aioserver import serve as serve_asyncio
+        serve_asyncio(application, host=args.host, port=args.port, threads=args.threads, sock=sock,
+                      drain_timeout=drain_timeout)
+        return
+
     # Serve the WSGI application using Waitress (production-ready WSGI server)
+    if sock is not None:
+        listen_kw = {"sockets": [sock]}
+    else:
+        listen_kw = {"host": args.host, "port": args.port}
     try:
-        from waitress import serve
-        serve(
+        from waitress.server import create_server
+        from .metrics import register_waitress_gauges
+        server = create_server(
             application,
-            host=args.host,
-            port=args.port,
             threads=args.threads,
             ident="imgserve",
+            # Read ahead so waitress can tell the app when a client has gone
+            channel_request_lookahead=1,
+            **listen_kw,
         )
+        register_waitress_gauges(server)
     except Exception as e:
         print(f"Error: Failed to start server with Waitress: {e}")
         print("Ensure Waitress is installed: pip install waitress")
         return
+    if drain_timeout is None:
+        server.run()
+    else:
+        run_waitress_draining(server, drain_timeout)
+
+
+def run_waitress_draining(server, drain_timeout: float) -> None:
+    """Run a waitress server until SIGTERM, then drain it.
+
+    The listener is closed, idle keep-alive connections are closed, and
+    connections with a request in progress get up to ``drain_timeout``
+    seconds to finish before the server stops.
+    """
+    stopping = []
+    # Only sets a flag: the loop below notices within one loop timeout
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+    loop_kw = {"map": server._map, "use_poll": server.adj.asyncore_use_poll}
+    while not stopping:
+        server.asyncore.loop(timeout=server.adj.asyncore_loop_timeout, count=1, **loop_kw)
+
+    # This process's copy of the listening socket; other workers keep theirs
+    server.del_channel()
+    server.socket.close()
+    deadline = time.monotonic() + drain_timeout
+    while time.monotonic() < deadline:
+        busy = False
+        for channel in list(server.active_channels.values()):
+            if channel.requests or channel.request is not None or channel.total_outbufs_len:
+                busy = True
+            else:
+                channel.will_close = True
+        if not busy and not server.active_channels:
+            break
+        server.asyncore.loop(timeout=0.1, count=1, **loop_kw)
+    if server.active_channels:
+        logger.warning(f"Stopping with {len(server.active_channels)} connections still open")
+    server.task_dispatcher.shutdown()
 
 
 if __name__ == "__main__":
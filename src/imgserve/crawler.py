@@ -0,0 +1,211 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+try:
+    from .scancache import scan_directory
+except ImportError:
+    from scancache import scan_directory
+
+logger = logging.getLogger(__name__)
+
+# Number of crawled subtrees kept in memory at once
+MAX_CACHED_CRAWLS = 16
+# Crawls walking the filesystem at once; further ones wait their turn
+MAX_CONCURRENT_CRAWLS = 2
+# Seconds between cancellation checks while a crawl waits for its turn
+CRAWL_WAIT_POLL_SECONDS = 0.5
+# Seconds a finished crawl is trusted before a fresh one is started
+CRAWL_TTL_SECONDS = 300
+# Entries gathered before they are published to readers
+CRAWL_BATCH_SIZE = 500
+
+
+class SubtreeCrawl:
+    """Incrementally built listing of every image below one directory.
+
+    A background thread walks the subtree and publishes entries in batches,
+    so readers can page over a partial result while the walk is running.
+    Entries are ``(rel_path, mtime)`` with ``rel_path`` relative to the
+    crawled directory and always using ``/`` as separator.
+    """
+
+    def __init__(self, directory: str, extensions, previous: "SubtreeCrawl | None" = None,
+                 scan_cache=None, stat_pool=None, slots: threading.Semaphore | None = None):
+        self.directory = directory
+        self.extensions = extensions
+        # Optional ScanCache; unchanged directories are then not re-listed
+        self.scan_cache = scan_cache
+        # Optional StatPool for parallel stats on network filesystems
+        self.stat_pool = stat_pool
+        # Optional semaphore shared by crawls to bound how many walk at once
+        self.slots = slots
+        # Set when the crawl is no longer wanted; checked between directories
+        self.cancelled = False
+        self.started_at = time.monotonic()
+        self.finished_at = None
+        self.dirs_scanned = 0
+        # Stale crawl of the same directory, served until this one finishes
+        self.previous = previous
+        self._entries: list[tuple[str, float]] = []
+        # rel_path -> file size, from the same scans (for deduplication)
+        self._sizes: dict[str, int] = {}
+        self._sorted: dict[str, tuple[int, list[tuple[str, float]]]] = {}
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(
+            target=self._run, name=f"imgserve-crawl:{directory}", daemon=True
+        )
+
+    def start(self) -> None:
+        self._thread.start()
+
+    @property
+    def done(self) -> bool:
+        return self.finished_at is not None
+
+    @property
+    def complete(self) -> bool:
+        """Finished walking the whole subtree (not cancelled part-way)."""
+        return self.done and not self.cancelled
+
+    def expired(self, ttl: float = CRAWL_TTL_SECONDS) -> bool:
+        return self.done and time.monotonic() - self.finished_at > ttl
+
+    def cancel(self) -> None:
+        """Stop the walk at the next directory (or before it starts)."""
+        self.cancelled = True
+
+    def _run(self) -> None:
+        if self.slots is not None:
+            while not self.slots.acquire(timeout=CRAWL_WAIT_POLL_SECONDS):
+                if self.cancelled:
+                    self.finished_at = time.monotonic()
+                    self.previous = None
+                    return
+        try:
+            self._walk()
+        finally:
+            if self.slots is not None:
+                self.slots.release()
+
+    def _walk(self) -> None:
+        batch: list[tuple[str, float, int]] = []
+        stack = [""]
+        try:
+            while stack and not self.cancelled:
+                rel_dir = stack.pop()
+                abs_dir = os.path.join(self.directory, rel_dir) if rel_dir else self.directory
+                try:
+                    if self.scan_cache is not None:
+                        listing = self.scan_cache.scan(abs_dir)
+                    else:
+                        listing = scan_directory(abs_dir, self.extensions, self.stat_pool)
+                except OSError as e:
+                    logger.info(f"Crawl: skipping unreadable directory {abs_dir}: {e}")
+                else:
+                    for name, is_symlink in listing.subdirs:
+                        if not is_symlink:
+                            stack.append(f"{rel_dir}/{name}" if rel_dir else name)
+                    for name, mtime, size in listing.files:
+                        batch.append((f"{rel_dir}/{name}" if rel_dir else name, mtime, size))
+                self.dirs_scanned += 1
+                if len(batch) >= CRAWL_BATCH_SIZE:
+                    self._publish(batch)
+                    batch = []
+        finally:
+            self._publish(batch)
+            self.finished_at = time.monotonic()
+            self.previous = None
+            logger.info(
+                f"Crawl of {self.directory} {'cancelled' if self.cancelled else 'finished'}: "
+                f"{len(self._entries)} images in {self.dirs_scanned} directories "
+                f"({self.finished_at - self.started_at:.2f}s)"
+            )
+
+    def _publish(self, batch: list[tuple[str, float, int]]) -> None:
+        if batch:
+            with self._lock:
+                self._sizes.update((rel_path, size) for rel_path, _, size in batch)
+                self._entries.extend((rel_path, mtime) for rel_path, mtime, _ in batch)
+
+    def sizes(self) -> dict[str, int]:
+        """File sizes by ``rel_path`` for the entries ``snapshot()`` returns.
+
+        The dict keeps growing while the crawl runs; use lookups only.
+        """
+        previous = self.previous
+        if previous is not None and not self.done:
+            return previous.sizes()
+        return self._sizes
+
+    def snapshot(self, sort_by: str = 'name') -> tuple[list[tuple[str, float]], bool]:
+        """Return ``(sorted_entries, still_scanning)`` for the current state.
+
+        A cancelled crawl counts as still scanning: its listing is partial.
+
+        While a refresh is running the previous complete listing is served
+        instead of the new partial one.
+        """
+        previous = self.previous
+        if previous is not None and not self.done:
+            entries, _ = previous.snapshot(sort_by)
+            return entries, True
+
+        with self._lock:
+            count = len(self._entries)
+            cached_count, cached = self._sorted.get(sort_by, (0, []))
+            if cached_count == count and (count or self.done):
+                return cached, not self.complete
+            # Append only the new tail; Timsort merges the two sorted runs
+            # in linear time, so repeated views during a crawl stay cheap.
+            merged = cached + self._entries[cached_count:count]
+        if sort_by == 'name':
+            merged.sort(key=lambda x: x[0].lower())
+        else:  # date
+            merged.sort(key=lambda x: float(x[1]), reverse=True)
+        with self._lock:
+            if self._sorted.get(sort_by, (0, None))[0] <= count:
+                self._sorted[sort_by] = (count, merged)
+        return merged, not self.complete
+
+
+class CrawlCache:
+    """Bounded, thread-safe LRU of subtree crawls keyed by directory."""
+
+    def __init__(self, extensions, max_crawls: int = MAX_CACHED_CRAWLS,
+                 ttl: float = CRAWL_TTL_SECONDS, scan_cache=None, stat_pool=None):
+        self.extensions = extensions
+        self.scan_cache = scan_cache
+        self.stat_pool = stat_pool
+        self.max_crawls = max_crawls
+        self.ttl = ttl
+        self._crawls: "OrderedDict[str, SubtreeCrawl]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Shared by all crawls: a bot walking every folder can't start more
+        # than this many concurrent subtree walks
+        self._slots = threading.Semaphore(MAX_CONCURRENT_CRAWLS)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, directory: str) -> SubtreeCrawl:
+        """Return the crawl for ``directory``, starting or refreshing it as needed."""
+        with self._lock:
+            crawl = self._crawls.get(directory)
+            if crawl is not None and not crawl.expired(self.ttl):
+                self._crawls.move_to_end(directory)
+                self.hits += 1
+                return crawl
+            self.misses += 1
+            crawl = SubtreeCrawl(directory, self.extensions, previous=crawl,
+                                 scan_cache=self.scan_cache, stat_pool=self.stat_pool,
+                                 slots=self._slots)
+            self._crawls[directory] = crawl
+            self._crawls.move_to_end(directory)
+            while len(self._crawls) > self.max_crawls:
+                # Nobody can look the evicted crawl up any more; stop its walk
+                _, evicted = self._crawls.popitem(last=False)
+                evicted.cancel()
+        crawl.start()
+        return crawl
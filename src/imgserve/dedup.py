@@ -0,0 +1,179 @@
+"""Content-hash deduplication of image files.
+
+Files are grouped by size first, then by a cheap partial hash of the first
+and last blocks, and only files that still collide are hashed in full. For
+a typical photo library that means almost no file is ever read completely.
+"""
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Bytes hashed from each end of a file for the partial hash
+PARTIAL_BLOCK_SIZE = 64 * 1024
+# Read size for full hashes
+FULL_READ_SIZE = 1024 * 1024
+# Hashes remembered per (path, size, mtime)
+MAX_CACHED_HASHES = 200_000
+
+
+def partial_hash(path: str, size: int) -> bytes:
+    """Hash the head and tail blocks (the whole file if it is small)."""
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        if size <= 2 * PARTIAL_BLOCK_SIZE:
+            h.update(f.read())
+        else:
+            h.update(f.read(PARTIAL_BLOCK_SIZE))
+            f.seek(-PARTIAL_BLOCK_SIZE, os.SEEK_END)
+            h.update(f.read(PARTIAL_BLOCK_SIZE))
+    return h.digest()
+
+
+def full_hash(path: str) -> bytes:
+    h = hashlib.blake2b(digest_size=32)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(FULL_READ_SIZE), b''):
+            h.update(block)
+    return h.digest()
+
+
+class HashCache:
+    """Thread-safe LRU of partial/full hashes keyed by (path, size, mtime)."""
+
+    def __init__(self, max_entries: int = MAX_CACHED_HASHES):
+        self.max_entries = max_entries
+        self._hashes: "OrderedDict[tuple, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, kind: str, path: str, size: int, mtime: float, compute) -> bytes:
+        key = (kind, path, size, mtime)
+        with self._lock:
+            digest = self._hashes.get(key)
+            if digest is not None:
+                self._hashes.move_to_end(key)
+                self.hits += 1
+                return digest
+            self.misses += 1
+        digest = compute()
+        with self._lock:
+            self._hashes[key] = digest
+            while len(self._hashes) > self.max_entries:
+                self._hashes.popitem(last=False)
+        return digest
+
+
+def find_duplicate_groups(files, cache: HashCache | None = None) -> list[list[str]]:
+    """Group paths with identical content.
+
+    ``files`` is an iterable of ``(path, size, mtime)``. Returns only groups
+    with more than one member, each in the order the paths were given.
+    Unreadable files are treated as unique.
+    """
+    by_size: dict[int, list[tuple[str, int, float]]] = {}
+    for path, size, mtime in files:
+        by_size.setdefault(size, []).append((path, size, mtime))
+
+    def hashed(kind, fn, path, size, mtime):
+        if cache is None:
+            return fn()
+        return cache.get(kind, path, size, mtime, fn)
+
+    groups = []
+    for size, same_size in by_size.items():
+        if len(same_size) < 2:
+            continue
+        by_partial: dict[bytes, list] = {}
+        for path, _, mtime in same_size:
+            try:
+                digest = hashed('partial', lambda: partial_hash(path, size), path, size, mtime)
+            except OSError as e:
+                logger.info(f"Dedup: cannot read {path}: {e}")
+                continue
+            by_partial.setdefault(digest, []).append((path, mtime))
+        for candidates in by_partial.values():
+            if len(candidates) < 2:
+                continue
+            if size <= 2 * PARTIAL_BLOCK_SIZE:
+                # The partial hash already covered the whole file
+                groups.append([path for path, _ in candidates])
+                continue
+            by_full: dict[bytes, list[str]] = {}
+            for path, mtime in candidates:
+                try:
+                    digest = hashed('full', lambda: full_hash(path), path, size, mtime)
+                except OSError as e:
+                    logger.info(f"Dedup: cannot read {path}: {e}")
+                    continue
+                by_full.setdefault(digest, []).append(path)
+            groups.extend(group for group in by_full.values() if len(group) > 1)
+    return groups
+
+
+def dedupe_entries(directory: str, entries: list[tuple[str, float]],
+                   cache: HashCache | None = None,
+                   sizes: dict[str, int] | None = None) -> tuple[list[tuple[str, float]], dict[str, int]]:
+    """Collapse duplicate files in a sorted ``(rel_path, mtime)`` listing.
+
+    The first copy in listing order is kept. Returns the filtered listing
+    and a map from each kept ``rel_path`` to its total number of copies.
+    ``sizes`` maps ``rel_path`` to the size the directory scan already
+    found; only files missing from it are stat'ed here.
+    """
+    files = []
+    for rel_path, mtime in entries:
+        full_path = os.path.join(directory, rel_path)
+        size = sizes.get(rel_path) if sizes is not None else None
+        if size is None:
+            try:
+                size = os.stat(full_path).st_size
+            except OSError:
+                continue
+        files.append((full_path, size, mtime))
+    if not files:
+        return entries, {}
+
+    prefix_len = len(os.path.join(directory, ''))
+    copies: dict[str, int] = {}
+    dropped: set[str] = set()
+    for group in find_duplicate_groups(files, cache):
+        # Groups keep listing order, so the first member is the one shown
+        copies[group[0][prefix_len:]] = len(group)
+        dropped.update(path[prefix_len:] for path in group[1:])
+    if not dropped:
+        return entries, {}
+    return [entry for entry in entries if entry[0] not in dropped], copies
+
+
+class ListingDeduper:
+    """Deduplicates gallery listings, remembering results per listing version.
+
+    ``version`` is any hashable value that changes whenever the listing may
+    have changed (directory mtime, crawl progress, sort order).
+    """
+
+    def __init__(self, max_listings: int = 64):
+        self.max_listings = max_listings
+        self.hashes = HashCache()
+        self._results: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def dedupe(self, directory: str, entries: list[tuple[str, float]], version,
+               sizes: dict[str, int] | None = None) -> tuple[list[tuple[str, float]], dict[str, int]]:
+        key = (directory, version)
+        with self._lock:
+            result = self._results.get(key)
+            if result is not None:
+                self._results.move_to_end(key)
+                return result
+        result = dedupe_entries(directory, entries, self.hashes, sizes)
+        with self._lock:
+            self._results[key] = result
+            while len(self._results) > self.max_listings:
+                self._results.popitem(last=False)
+        return result
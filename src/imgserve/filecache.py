@@ -0,0 +1,206 @@
+"""In-memory cache of hot image files.
+
+A handful of images tends to be requested over and over. ``FileCache``
+keeps small files' bytes in memory up to a byte budget (LRU), and keeps
+larger files open so they are read with ``pread`` instead of being looked
+up and opened again. A cached file is trusted without touching the
+filesystem for ``revalidate`` seconds; after that one ``stat`` confirms it
+is unchanged (same inode, size and mtime) before it is used again.
+
+``file_response`` turns a cache entry into the same response ``send_file``
+would produce (ETag, Last-Modified, conditional and range requests).
+"""
+import mimetypes
+import os
+import stat
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from flask import Response, request
+from werkzeug.wsgi import wrap_file
+
+# Total bytes of file contents kept in memory
+FILE_CACHE_BUDGET = 64 << 20
+# Files up to this size are kept in memory; larger ones as open descriptors
+MAX_CACHED_FILE_SIZE = 1 << 20
+# Open descriptors kept for large files
+MAX_OPEN_FILES = 64
+# Seconds a cached file is used without checking the filesystem
+REVALIDATE_SECONDS = 2.0
+
+
+class CachedFile:
+    __slots__ = ('path', 'signature', 'size', 'mtime', 'etag', 'mimetype', 'data', 'fd', 'checked')
+
+    def __init__(self, path: str, st: os.stat_result):
+        self.path = path
+        self.signature = (st.st_ino, st.st_size, st.st_mtime_ns)
+        self.size = st.st_size
+        self.mtime = st.st_mtime
+        # Same format as send_file, so cached and uncached responses agree
+        self.etag = f"{st.st_mtime}-{st.st_size}-{zlib.adler32(path.encode()) & 0xFFFFFFFF}"
+        self.mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        self.data = None
+        self.fd = None
+        self.checked = time.monotonic()
+
+
+class _PreadFile:
+    """File object over its own descriptor, reading with ``pread``.
+
+    ``fileno()`` lets servers send it with ``sendfile`` (which takes an
+    explicit offset, so the shared position never matters).
+    """
+
+    def __init__(self, fd: int, size: int):
+        self._fd = fd
+        self._size = size
+        self._pos = 0
+
+    def read(self, n: int = -1) -> bytes:
+        if n is None or n < 0:
+            n = self._size - self._pos
+        data = os.pread(self._fd, n, self._pos)
+        self._pos += len(data)
+        return data
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        if whence == os.SEEK_CUR:
+            offset += self._pos
+        elif whence == os.SEEK_END:
+            offset += self._size
+        self._pos = max(0, offset)
+        return self._pos
+
+    def tell(self) -> int:
+        return self._pos
+
+    def fileno(self) -> int:
+        if self._fd is None:
+            raise ValueError("I/O operation on closed file")
+        return self._fd
+
+    def close(self) -> None:
+        fd, self._fd = self._fd, None
+        if fd is not None:
+            os.close(fd)
+
+
+class FileCache:
+    """Byte-budgeted LRU of small files plus an LRU of open large files."""
+
+    def __init__(self, budget: int = FILE_CACHE_BUDGET, max_file_size: int = MAX_CACHED_FILE_SIZE,
+                 max_open: int = MAX_OPEN_FILES, revalidate: float = REVALIDATE_SECONDS):
+        self.budget = budget
+        self.max_file_size = min(max_file_size, budget)
+        self.max_open = max_open if hasattr(os, 'pread') else 0
+        self.revalidate = revalidate
+        self._files: "OrderedDict[str, CachedFile]" = OrderedDict()
+        self._handles: "OrderedDict[str, CachedFile]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, path: str) -> CachedFile | None:
+        """Return the cache entry for ``path``, or None if it isn't a regular file."""
+        with self._lock:
+            entry = self._files.get(path) or self._handles.get(path)
+            if entry is not None:
+                (self._files if entry.data is not None else self._handles).move_to_end(path)
+                if time.monotonic() - entry.checked < self.revalidate:
+                    self.hits += 1
+                    return entry
+        try:
+            st = os.stat(path)
+        except OSError:
+            self._drop(path)
+            return None
+        if entry is not None and (st.st_ino, st.st_size, st.st_mtime_ns) == entry.signature:
+            entry.checked = time.monotonic()
+            with self._lock:
+                self.hits += 1
+            return entry
+        self._drop(path)
+        if not stat.S_ISREG(st.st_mode):
+            return None
+        with self._lock:
+            self.misses += 1
+        return self._load(path, st)
+
+    def _load(self, path: str, st: os.stat_result) -> CachedFile | None:
+        entry = CachedFile(path, st)
+        if st.st_size > self.max_file_size:
+            if not self.max_open:
+                return entry
+            try:
+                entry.fd = os.open(path, os.O_RDONLY)
+            except OSError:
+                return None
+            with self._lock:
+                self._close(self._handles.pop(path, None))
+                self._handles[path] = entry
+                while len(self._handles) > self.max_open:
+                    self._close(self._handles.popitem(last=False)[1])
+            return entry
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+        if len(data) != st.st_size:
+            # Changed while being read; serve it but don't keep it
+            return entry
+        entry.data = data
+        with self._lock:
+            old = self._files.pop(path, None)
+            if old is not None:
+                self.bytes -= len(old.data)
+            self._files[path] = entry
+            self.bytes += len(data)
+            while self.bytes > self.budget:
+                _, old = self._files.popitem(last=False)
+                self.bytes -= len(old.data)
+        return entry
+
+    def _drop(self, path: str) -> None:
+        with self._lock:
+            old = self._files.pop(path, None)
+            if old is not None:
+                self.bytes -= len(old.data)
+            self._close(self._handles.pop(path, None))
+
+    @staticmethod
+    def _close(entry: CachedFile | None) -> None:
+        if entry is not None and entry.fd is not None:
+            os.close(entry.fd)
+            entry.fd = None
+
+    def open(self, entry: CachedFile):
+        """Return a private file object for a large entry."""
+        with self._lock:
+            # Dup under the lock: eviction closes the cached descriptor, and
+            # this response may outlive it
+            if entry.fd is not None:
+                return _PreadFile(os.dup(entry.fd), entry.size)
+        return open(entry.path, 'rb')
+
+    def open_files(self) -> int:
+        return len(self._handles)
+
+
+def file_response(cache: FileCache, entry: CachedFile) -> Response:
+    """Build the response ``send_file(entry.path)`` would, from the cache."""
+    if entry.data is not None:
+        response = Response(entry.data, mimetype=entry.mimetype)
+    else:
+        response = Response(wrap_file(request.environ, cache.open(entry)), mimetype=entry.mimetype,
+                            direct_passthrough=True)
+        response.content_length = entry.size
+    response.last_modified = entry.mtime
+    response.cache_control.no_cache = True
+    response.set_etag(entry.etag)
+    return response.make_conditional(request.environ, accept_ranges=True,
+                                     complete_length=entry.size)
@@ -0,0 +1,342 @@
+"""Header-only image metadata: dimensions, EXIF orientation and capture time.
+
+Only container headers and the EXIF IFD0/ExifIFD are read; pixel data is
+never decoded, so a lookup costs a few small reads per file. Supports JPEG,
+PNG, GIF, WebP, TIFF and BMP.
+"""
+import logging
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+
+logger = logging.getLogger(__name__)
+
+# Metadata entries remembered per (path, mtime)
+MAX_CACHED_METADATA = 200_000
+# Upper bound on segments/chunks/IFD entries walked per file
+MAX_WALK = 1024
+# Files waiting for a background read at most; the oldest requests go first
+MAX_PENDING_READS = 50_000
+
+_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7,
+                0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+# TIFF field type -> size in bytes
+_TIFF_TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 6: 1, 7: 1, 8: 2, 9: 4, 10: 8}
+
+TAG_WIDTH = 256
+TAG_HEIGHT = 257
+TAG_ORIENTATION = 274
+TAG_EXIF_IFD = 34665
+TAG_DATETIME_ORIGINAL = 36867
+TAG_DATETIME_DIGITIZED = 36868
+
+
+class ImageMeta(NamedTuple):
+    width: int | None = None
+    height: int | None = None
+    orientation: int = 1
+    # Capture time (EXIF DateTimeOriginal, local time) as a timestamp
+    taken: float | None = None
+
+    @property
+    def display_size(self) -> tuple[int | None, int | None]:
+        """Width and height as shown, after applying the EXIF orientation."""
+        if self.orientation in (5, 6, 7, 8):
+            return self.height, self.width
+        return self.width, self.height
+
+
+def parse_exif_datetime(value: str) -> float | None:
+    """Convert ``YYYY:MM:DD HH:MM:SS`` to a local timestamp."""
+    try:
+        return time.mktime(time.strptime(value.strip('\x00 ')[:19], "%Y:%m:%d %H:%M:%S"))
+    except (ValueError, OverflowError):
+        # Includes the "0000:00:00 00:00:00" placeholder some cameras write
+        return None
+
+
+def _read_at(f, offset: int, size: int) -> bytes:
+    f.seek(offset)
+    return f.read(size)
+
+
+def _parse_tiff(read_at, base: int = 0) -> dict[int, object]:
+    """Return the tags of interest from IFD0 and the Exif IFD.
+
+    ``read_at(offset, size)`` reads from the source; TIFF offsets are
+    relative to ``base``.
+    """
+    header = read_at(base, 8)
+    if len(header) < 8 or header[:2] not in (b'II', b'MM'):
+        return {}
+    endian = '<' if header[:2] == b'II' else '>'
+    if struct.unpack(endian + 'H', header[2:4])[0] != 42:
+        return {}
+
+    def read_ifd(offset: int, wanted: set[int]) -> dict[int, object]:
+        raw = read_at(base + offset, 2)
+        if len(raw) < 2:
+            return {}
+        count = min(struct.unpack(endian + 'H', raw)[0], MAX_WALK)
+        table = read_at(base + offset + 2, count * 12)
+        found = {}
+        for i in range(len(table) // 12):
+            tag, ftype, n, value = struct.unpack(endian + 'HHI4s', table[i * 12:(i + 1) * 12])
+            if tag not in wanted or ftype not in _TIFF_TYPE_SIZES:
+                continue
+            size = _TIFF_TYPE_SIZES[ftype] * n
+            if size > 4:
+                value = read_at(base + struct.unpack(endian + 'I', value)[0], min(size, 64))
+            if ftype == 2:
+                found[tag] = value[:size].decode('ascii', 'replace')
+            elif ftype == 3:
+                found[tag] = struct.unpack(endian + 'H', value[:2])[0]
+            elif ftype in (4, 9):
+                found[tag] = struct.unpack(endian + 'I', value[:4])[0]
+        return found
+
+    ifd0_offset = struct.unpack(endian + 'I', header[4:8])[0]
+    tags = read_ifd(ifd0_offset, {TAG_WIDTH, TAG_HEIGHT, TAG_ORIENTATION, TAG_EXIF_IFD})
+    exif_offset = tags.pop(TAG_EXIF_IFD, None)
+    if exif_offset:
+        tags.update(read_ifd(exif_offset, {TAG_DATETIME_ORIGINAL, TAG_DATETIME_DIGITIZED}))
+    return tags
+
+
+def _meta_from_tags(tags: dict, width=None, height=None) -> ImageMeta:
+    taken = None
+    for tag in (TAG_DATETIME_ORIGINAL, TAG_DATETIME_DIGITIZED):
+        if isinstance(tags.get(tag), str):
+            taken = parse_exif_datetime(tags[tag])
+            if taken is not None:
+                break
+    orientation = tags.get(TAG_ORIENTATION, 1)
+    if not isinstance(orientation, int) or not 1 <= orientation <= 8:
+        orientation = 1
+    return ImageMeta(width, height, orientation, taken)
+
+
+def _exif_payload_tags(payload: bytes) -> dict:
+    if payload.startswith(b'Exif\x00\x00'):
+        payload = payload[6:]
+    return _parse_tiff(lambda offset, size: payload[offset:offset + size])
+
+
+def _read_jpeg(f) -> ImageMeta:
+    tags, width, height = {}, None, None
+    offset = 2
+    for _ in range(MAX_WALK):
+        head = _read_at(f, offset, 4)
+        if len(head) < 2 or head[0] != 0xFF:
+            break
+        marker = head[1]
+        if marker == 0xFF:  # fill byte
+            offset += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:
+            offset += 2
+            continue
+        if marker in (0xD9, 0xDA) or len(head) < 4:  # EOI / start of scan
+            break
+        length = struct.unpack('>H', head[2:4])[0]
+        if length < 2:
+            # The length includes its own two bytes: corrupt, stop here
+            break
+        if marker == 0xE1 and not tags:
+            payload = _read_at(f, offset + 4, length - 2)
+            if payload.startswith(b'Exif\x00\x00'):
+                tags = _exif_payload_tags(payload)
+        elif marker in _SOF_MARKERS:
+            sof = _read_at(f, offset + 4, 5)
+            if len(sof) == 5:
+                height, width = struct.unpack('>HH', sof[1:5])
+            # EXIF (APP1) always precedes the frame header
+            break
+        offset += 2 + length
+    return _meta_from_tags(tags, width, height)
+
+
+def _read_png(f) -> ImageMeta:
+    tags, width, height = {}, None, None
+    offset = 8
+    for _ in range(MAX_WALK):
+        head = _read_at(f, offset, 8)
+        if len(head) < 8:
+            break
+        length, ctype = struct.unpack('>I4s', head)
+        if ctype == b'IHDR':
+            width, height = struct.unpack('>II', _read_at(f, offset + 8, 8))
+        elif ctype == b'eXIf':
+            tags = _exif_payload_tags(_read_at(f, offset + 8, length))
+        elif ctype in (b'IDAT', b'IEND'):
+            break
+        offset += 12 + length
+    return _meta_from_tags(tags, width, height)
+
+
+def _read_gif(f) -> ImageMeta:
+    width, height = struct.unpack('<HH', _read_at(f, 6, 4))
+    return ImageMeta(width, height)
+
+
+def _read_bmp(f) -> ImageMeta:
+    width, height = struct.unpack('<ii', _read_at(f, 18, 8))
+    return ImageMeta(width, abs(height))
+
+
+def _read_webp(f) -> ImageMeta:
+    tags, width, height = {}, None, None
+    # Only extended (VP8X) files can carry an EXIF chunk, after the bitstream
+    want_exif = False
+    offset = 12
+    for _ in range(MAX_WALK):
+        head = _read_at(f, offset, 8)
+        if len(head) < 8:
+            break
+        ctype, length = struct.unpack('<4sI', head)
+        if ctype == b'VP8X':
+            data = _read_at(f, offset + 8, 10)
+            width = 1 + int.from_bytes(data[4:7], 'little')
+            height = 1 + int.from_bytes(data[7:10], 'little')
+            want_exif = bool(data[0] & 0x08)
+        elif ctype == b'VP8 ' and width is None:
+            data = _read_at(f, offset + 8, 10)
+            width = struct.unpack('<H', data[6:8])[0] & 0x3FFF
+            height = struct.unpack('<H', data[8:10])[0] & 0x3FFF
+        elif ctype == b'VP8L' and width is None:
+            bits = struct.unpack('<I', _read_at(f, offset + 9, 4))[0]
+            width = 1 + (bits & 0x3FFF)
+            height = 1 + ((bits >> 14) & 0x3FFF)
+        elif ctype == b'EXIF':
+            tags = _exif_payload_tags(_read_at(f, offset + 8, length))
+            break
+        if width is not None and not want_exif:
+            break
+        offset += 8 + length + (length & 1)
+    return _meta_from_tags(tags, width, height)
+
+
+def _read_tiff(f) -> ImageMeta:
+    tags = _parse_tiff(lambda offset, size: _read_at(f, offset, size))
+    return _meta_from_tags(tags, tags.get(TAG_WIDTH), tags.get(TAG_HEIGHT))
+
+
+def read_metadata(path: str) -> ImageMeta | None:
+    """Return the metadata of an image file, or None if it is not understood."""
+    try:
+        with open(path, 'rb') as f:
+            magic = f.read(12)
+            if magic.startswith(b'\xff\xd8'):
+                reader = _read_jpeg
+            elif magic.startswith(b'\x89PNG\r\n\x1a\n'):
+                reader = _read_png
+            elif magic[:6] in (b'GIF87a', b'GIF89a'):
+                reader = _read_gif
+            elif magic[:4] == b'RIFF' and magic[8:12] == b'WEBP':
+                reader = _read_webp
+            elif magic[:4] in (b'II*\x00', b'MM\x00*'):
+                reader = _read_tiff
+            elif magic.startswith(b'BM'):
+                reader = _read_bmp
+            else:
+                return None
+            return reader(f)
+    except (OSError, struct.error, ValueError) as e:
+        logger.debug(f"Metadata: cannot parse {path}: {e}")
+        return None
+
+
+class MetadataCache:
+    """Thread-safe LRU of ``read_metadata`` results keyed by (path, mtime).
+
+    ``get`` reads files it hasn't seen in the calling thread. ``lookup``
+    never touches the filesystem: files it hasn't seen are queued for one
+    background thread to read (most recently requested first), so request
+    threads can't be held up by slow or hung mounts.
+    """
+
+    def __init__(self, max_entries: int = MAX_CACHED_METADATA):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[tuple[str, float], ImageMeta | None]" = OrderedDict()
+        self._lock = threading.Lock()
+        # (path, mtime) keys waiting for the background reader
+        self._pending: "OrderedDict[tuple[str, float], None]" = OrderedDict()
+        self._wakeup = threading.Condition(self._lock)
+        self._reader_pid = None
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, path: str, mtime: float) -> ImageMeta | None:
+        key = (path, mtime)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+        meta = read_metadata(path)
+        with self._lock:
+            self._entries[key] = meta
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return meta
+
+    def lookup(self, path: str, mtime: float) -> tuple[bool, ImageMeta | None]:
+        """Return ``(known, meta)`` from the cache alone.
+
+        Files not in the cache are queued for the background reader and
+        come back as ``(False, None)`` until it has read them.
+        """
+        key = (path, mtime)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, self._entries[key]
+            self._pending[key] = None
+            self._pending.move_to_end(key)
+            while len(self._pending) > MAX_PENDING_READS:
+                self._pending.popitem(last=False)
+            if self._reader_pid != os.getpid():
+                # First use (in this process: threads don't survive fork)
+                self._reader_pid = os.getpid()
+                threading.Thread(target=self._read_pending, name="imgserve-metadata",
+                                 daemon=True).start()
+            self._wakeup.notify()
+        return False, None
+
+    def _read_pending(self) -> None:
+        while True:
+            with self._wakeup:
+                while not self._pending:
+                    self._wakeup.wait()
+                key, _ = self._pending.popitem()
+            try:
+                self.get(*key)
+            except Exception:
+                logger.exception(f"Metadata: reading {key[0]} failed")
+
+
+def sort_by_capture_time(directory: str, entries: list[tuple[str, float]],
+                         cache: MetadataCache) -> tuple[list[tuple[str, float]], bool]:
+    """Return ``(rel_path, mtime)`` entries sorted newest capture time first.
+
+    Only cached capture times are used; files not read yet sort by mtime
+    and are queued for the background reader. The second value is False
+    until every file's capture time was known.
+    """
+    complete = True
+
+    def key(entry):
+        nonlocal complete
+        mtime = float(entry[1])
+        known, meta = cache.lookup(os.path.join(directory, entry[0]), mtime)
+        complete = complete and known
+        if meta is None or meta.taken is None:
+            return mtime
+        return meta.taken
+
+    return sorted(entries, key=key, reverse=True), complete
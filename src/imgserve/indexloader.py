@@ -0,0 +1,319 @@
+"""Loading of ``--index-file`` JSON indexes, optionally in the background.
+
+Entries are stored in a ``CompactIndex`` (see ``indexstore``). A background
+load parses the JSON array incrementally and periodically publishes a
+freshly sorted index of everything read so far, so the gallery can serve
+the loaded part (with a progress banner) while the rest loads. Published
+indexes are never mutated afterwards; readers that grabbed one keep a
+consistent snapshot.
+
+Once loaded, the index can be reloaded in the background, either on demand
+(SIGHUP) or when a watcher sees the file change. The old index keeps
+serving until the new one is complete. Every load is numbered when it
+starts and publishes are dropped once a later load has published, so a
+reload that finishes during the initial background load isn't overwritten
+by it (the initial load then stops).
+"""
+import json
+import logging
+import os
+import threading
+import time
+import weakref
+
+try:
+    from .indexstore import IndexBuilder
+except ImportError:
+    from indexstore import IndexBuilder
+
+logger = logging.getLogger(__name__)
+
+# Bytes read from the index file per chunk during a background load
+READ_CHUNK_SIZE = 1 << 20
+# Seconds between publishing partial results during a background load
+PUBLISH_INTERVAL = 0.5
+# Seconds between index file checks when watching for changes
+WATCH_INTERVAL = 5.0
+# Malformed files or entries (e.g. an entry without "path")
+LOAD_ERRORS = (OSError, ValueError, KeyError, TypeError)
+
+# Live loaders, and those whose publish lock is held across a fork
+_loaders = weakref.WeakSet()
+_forking = []
+
+
+def _before_fork() -> None:
+    # A fork (prefork workers after a reload) must not land in the middle of
+    # a publish, or the child would start with half-swapped index state
+    for loader in list(_loaders):
+        loader._publish_lock.acquire()
+        _forking.append(loader)
+
+
+def _after_fork_in_parent() -> None:
+    while _forking:
+        _forking.pop()._publish_lock.release()
+
+
+def _after_fork_in_child() -> None:
+    while _forking:
+        loader = _forking.pop()
+        loader._publish_lock.release()
+        # The parent's reload thread (if any) doesn't exist here
+        loader._reload_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(before=_before_fork, after_in_parent=_after_fork_in_parent,
+                        after_in_child=_after_fork_in_child)
+
+
+def iter_json_array(f, chunk_size: int = READ_CHUNK_SIZE):
+    """Yield ``(item, bytes_consumed)`` for each element of a top-level JSON array.
+
+    Only one chunk plus one element is held in memory at a time.
+    """
+    decoder = json.JSONDecoder()
+    buf = ""
+    consumed = 0  # characters of the file before ``buf`` (ASCII indexes: bytes)
+    pos = 0
+    started = False
+    eof = False
+    while True:
+        # Skip separators, refilling the buffer as needed
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n,":
+                pos += 1
+            if not started and pos < len(buf):
+                if buf[pos] != '[':
+                    raise json.JSONDecodeError("Expected a JSON array", buf, pos)
+                started = True
+                pos += 1
+                continue
+            if pos < len(buf) or eof:
+                break
+            chunk = f.read(chunk_size)
+            consumed += pos
+            buf, pos = buf[pos:] + chunk, 0
+            eof = not chunk
+        if pos >= len(buf):
+            if started:
+                raise json.JSONDecodeError("Unterminated JSON array", buf, pos)
+            return
+        if buf[pos] == ']':
+            return
+        try:
+            item, end = decoder.raw_decode(buf, pos)
+            # An element cut by the buffer edge (e.g. "2." of "2.5") may
+            # still decode; only trust it if a separator follows
+            if (end == len(buf) and not eof) or (end < len(buf) and buf[end] not in " \t\r\n,]"):
+                raise json.JSONDecodeError("Incomplete element", buf, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            chunk = f.read(chunk_size)
+            consumed += pos
+            buf, pos = buf[pos:] + chunk, 0
+            eof = not chunk
+            continue
+        pos = end
+        yield item, consumed + pos
+
+
+class IndexLoader:
+    """Load an index file and hand sorted results to ``publish(entries, complete)``.
+
+    ``complete`` is False for the partial lists of a background load.
+    ``on_reload``, if set, is called after a reloaded index is published.
+    """
+
+    def __init__(self, index_file: str, publish):
+        self.index_file = index_file
+        self.publish = publish
+        self.loaded = 0
+        self.progress = 0.0
+        self.ready = False
+        self.error = None
+        self.reloads = 0
+        self.reload_failures = 0
+        self.on_reload = None
+        self._thread = None
+        self._signature = None
+        self._reload_lock = threading.Lock()
+        # Held while publishing; forks wait for it (see _before_fork)
+        self._publish_lock = threading.Lock()
+        # Loads started, and the number of the load that last published
+        self._generation = 0
+        self._published = 0
+        self._watch_pid = None
+        _loaders.add(self)
+
+    def _file_signature(self):
+        try:
+            st = os.stat(self.index_file)
+        except OSError:
+            return None
+        return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def _read(self):
+        """Parse the whole file into a ``CompactIndex``; raises ``LOAD_ERRORS``.
+
+        Streams the file, so a reload running next to the live index holds
+        the new compact arrays and one chunk of JSON, not a list of dicts.
+        """
+        builder = IndexBuilder()
+        with open(self.index_file, 'r') as f:
+            builder.extend(item for item, _ in iter_json_array(f))
+        return builder.build()
+
+    def _begin(self) -> int:
+        with self._publish_lock:
+            self._generation += 1
+            return self._generation
+
+    def _superseded(self, generation: int) -> bool:
+        return generation < self._published
+
+    def _publish(self, generation: int, index, complete: bool) -> bool:
+        """Publish ``index`` unless a later load already did; call with ``_publish_lock``."""
+        if self._superseded(generation):
+            return False
+        self._published = generation
+        self.publish(index, complete)
+        return True
+
+    def load(self) -> None:
+        """Load the whole index in the calling thread and publish it once."""
+        generation = self._begin()
+        self._signature = self._file_signature()
+        try:
+            index = self._read()
+        except LOAD_ERRORS as e:
+            self._fail(e, generation)
+            return
+        self._finish(index, generation)
+
+    def start(self) -> None:
+        """Load the index on a background thread, publishing partial results."""
+        self._thread = threading.Thread(target=self._load_incrementally,
+                                        name="imgserve-index-loader", daemon=True)
+        self._thread.start()
+
+    def _load_incrementally(self) -> None:
+        generation = self._begin()
+        builder = IndexBuilder()
+        last_publish = time.monotonic()
+        interval = PUBLISH_INTERVAL
+        self._signature = self._file_signature()
+        try:
+            total = os.path.getsize(self.index_file) or 1
+            with open(self.index_file, 'r') as f:
+                for item, offset in iter_json_array(f):
+                    if self._superseded(generation):
+                        logger.info("Index reloaded during the initial load; stopping it")
+                        return
+                    builder.add(item)
+                    self.loaded = len(builder)
+                    self.progress = min(offset / total, 0.999)
+                    if time.monotonic() - last_publish >= interval:
+                        started = time.monotonic()
+                        partial = builder.build()
+                        with self._publish_lock:
+                            self._publish(generation, partial, False)
+                        last_publish = time.monotonic()
+                        # Each snapshot copies the arrays; on huge indexes
+                        # publish less often so copying doesn't dominate
+                        interval = max(PUBLISH_INTERVAL, 4 * (last_publish - started))
+            index = builder.build()
+        except LOAD_ERRORS as e:
+            self._fail(e, generation)
+            return
+        self._finish(index, generation)
+
+    def reload(self) -> bool:
+        """Re-read the index on a background thread and swap it in when done.
+
+        Returns False if a reload is already running. If the new file can't
+        be loaded the current index stays in place.
+        """
+        if not self._reload_lock.acquire(blocking=False):
+            logger.info("Index reload already in progress; ignoring request")
+            return False
+        threading.Thread(target=self._reload, name="imgserve-index-reload", daemon=True).start()
+        return True
+
+    def _reload(self) -> None:
+        reloaded = False
+        try:
+            generation = self._begin()
+            started = time.monotonic()
+            # Recorded even if loading fails, so the watcher waits for the
+            # next change instead of retrying a broken file
+            self._signature = self._file_signature()
+            try:
+                index = self._read()
+            except LOAD_ERRORS as e:
+                self.reload_failures += 1
+                logger.error(f"Reloading index file '{self.index_file}' failed; "
+                             f"keeping the current index: {e}")
+                return
+            self.reloads += 1
+            reloaded = self._finish(index, generation)
+            logger.info(f"Reloaded index in {time.monotonic() - started:.1f}s.")
+        finally:
+            self._reload_lock.release()
+        # Outside the lock: on_reload may fork (prefork recycles its workers)
+        if reloaded and self.on_reload is not None:
+            self.on_reload()
+
+    def watch(self, interval: float = WATCH_INTERVAL) -> None:
+        """Poll the index file and reload it after it changes.
+
+        A change is acted on once the file has stayed the same for one more
+        interval, so a file still being written isn't read half-way. Safe to
+        call again after ``fork()``: threads don't survive it, so each
+        process starts its own watcher.
+        """
+        if interval <= 0 or self._watch_pid == os.getpid():
+            return
+        self._watch_pid = os.getpid()
+        threading.Thread(target=self._watch, args=(interval,),
+                         name="imgserve-index-watch", daemon=True).start()
+
+    def _watch(self, interval: float) -> None:
+        pending = None
+        while True:
+            time.sleep(interval)
+            if not self.ready or self._reload_lock.locked():
+                continue
+            signature = self._file_signature()
+            if signature is None or signature == self._signature:
+                pending = None
+            elif signature != pending:
+                # Changed since the last check; wait for it to settle
+                pending = signature
+            else:
+                logger.info(f"Index file '{self.index_file}' changed; reloading")
+                pending = None
+                self.reload()
+
+    def _finish(self, index, generation: int) -> bool:
+        with self._publish_lock:
+            if not self._publish(generation, index, True):
+                return False
+            self.loaded = len(index)
+            self.progress = 1.0
+            self.ready = True
+        logger.info(f"Loaded {len(index)} images from index '{self.index_file}' "
+                    f"({index.memory_size() / 1e6:.1f} MB).")
+        return True
+
+    def _fail(self, error: Exception, generation: int) -> None:
+        logger.error(f"Error loading index file '{self.index_file}': {error}")
+        with self._publish_lock:
+            # A later load's index stays in place
+            if not self._publish(generation, IndexBuilder().build(), True):
+                return
+            self.error = error
+            self.progress = 1.0
+            self.ready = True
@@ -0,0 +1,221 @@
+"""Compact in-memory storage for loaded index entries.
+
+An index of millions of ``{"path": ..., "mtime": ...}`` dicts costs a few
+hundred bytes per entry, mostly for dict overhead and repeated directory
+prefixes. ``CompactIndex`` keeps the same data in flat arrays instead: each
+directory string once in a table, per-entry directory ids and mtimes in
+``array``s, and all basenames in one bytes blob addressed by offsets, for
+roughly 35 bytes per entry.
+
+Every entry also has a stable 64-bit id, a hash of its path and mtime, so
+image URLs survive reloads and re-sorting; ``find(id)`` looks it up in a
+sorted id table by binary search (12 more bytes per entry).
+
+``IndexBuilder`` collects entries in file order and ``build()`` returns an
+immutable, newest-first ``CompactIndex``; builders can keep growing after a
+build, which is how partial results are published during a background load.
+"""
+import hashlib
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from operator import itemgetter
+from typing import NamedTuple
+
+_pack_mtime = struct.Struct('<d').pack
+
+
+class IndexEntry(NamedTuple):
+    path: str
+    name: str
+    mtime: float
+    # 1 + the number of identical files listed under "duplicates"
+    copies: int
+    # Stable id (see image_id)
+    id: int
+
+
+def _id_digest(path_bytes: bytes, mtime: float) -> bytes:
+    return hashlib.blake2b(path_bytes + _pack_mtime(mtime), digest_size=8).digest()
+
+
+def image_id(path: str, mtime: float) -> int:
+    """Stable id of an index entry: a 64-bit hash of its path and mtime.
+
+    A file changed in place gets a new mtime and so a new id, which is what
+    lets URLs built from ids be cached as immutable.
+    """
+    return int.from_bytes(_id_digest(path.encode('utf-8', 'surrogateescape'), mtime), sys.byteorder)
+
+
+def _permute(values: array, order) -> array:
+    """Return ``values`` reordered by ``order`` (C speed via itemgetter)."""
+    if len(order) < 2:
+        return array(values.typecode, [values[i] for i in order])
+    return array(values.typecode, itemgetter(*order)(values))
+
+
+def _merge_ids(sorted_ids: array, by_id: array, ids: array, new: list) -> tuple[array, array]:
+    """Merge entries ``new`` (sorted by id) into ``sorted_ids``/``by_id``.
+
+    Returns new arrays (published indexes share the old ones). Copies runs
+    between insertion points, so it costs O(len(new) log n) plus a copy.
+    """
+    if len(new) >= len(sorted_ids):
+        # Mostly new entries (e.g. the first build): one merging sort is faster
+        merged = by_id.tolist() + new
+        merged.sort(key=ids.__getitem__)
+        return _permute(ids, merged), array('I', merged)
+    merged_ids, merged_by_id = array('Q'), array('I')
+    prev = 0
+    for i in new:
+        image_id = ids[i]
+        cut = bisect_left(sorted_ids, image_id, prev)
+        if cut > prev:
+            merged_ids += sorted_ids[prev:cut]
+            merged_by_id += by_id[prev:cut]
+            prev = cut
+        merged_ids.append(image_id)
+        merged_by_id.append(i)
+    merged_ids += sorted_ids[prev:]
+    merged_by_id += by_id[prev:]
+    return merged_ids, merged_by_id
+
+
+class CompactIndex:
+    """Immutable index entries in newest-first order.
+
+    ``index[i]`` returns an ``IndexEntry``; ``dirs`` and ``dir_ids`` expose
+    the directory table for grouping without building paths.
+    """
+
+    def __init__(self, dirs: list, dir_ids: array, mtimes: array, name_starts: array,
+                 name_lens: array, blob, copies: dict, sorted_ids: array, id_positions: array):
+        self.dirs = dirs
+        self.dir_ids = dir_ids
+        self.mtimes = mtimes
+        self._name_starts = name_starts
+        self._name_lens = name_lens
+        # Shared with the builder, which only ever appends to it
+        self._blob = blob
+        self._copies = copies
+        # Ids in ascending order and the position holding each
+        self._sorted_ids = sorted_ids
+        self._id_positions = id_positions
+
+    def __len__(self) -> int:
+        return len(self.mtimes)
+
+    def name(self, i: int) -> str:
+        start = self._name_starts[i]
+        return self._blob[start:start + self._name_lens[i]].decode('utf-8', 'surrogateescape')
+
+    def path(self, i: int) -> str:
+        return os.path.join(self.dirs[self.dir_ids[i]], self.name(i))
+
+    def __getitem__(self, i: int) -> IndexEntry:
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("index entry out of range")
+        name = self.name(i)
+        path = os.path.join(self.dirs[self.dir_ids[i]], name)
+        mtime = self.mtimes[i]
+        return IndexEntry(path, name, mtime, self._copies.get(i, 1), image_id(path, mtime))
+
+    def find(self, image_id: int) -> int | None:
+        """Return the position of the entry with ``image_id``, if any."""
+        k = bisect_left(self._sorted_ids, image_id)
+        if k < len(self._sorted_ids) and self._sorted_ids[k] == image_id:
+            return self._id_positions[k]
+        return None
+
+    def memory_size(self) -> int:
+        """Approximate bytes held (arrays, blob and directory table)."""
+        arrays = (self.dir_ids, self.mtimes, self._name_starts, self._name_lens,
+                  self._sorted_ids, self._id_positions)
+        return (sum(a.itemsize * len(a) for a in arrays) + len(self._blob)
+                + sum(len(d) + 49 for d in self.dirs))
+
+
+class IndexBuilder:
+    """Accumulates index entries (dicts as found in the JSON file)."""
+
+    def __init__(self):
+        self._dir_table: dict[str, int] = {}
+        self._dirs: list[str] = []
+        self._dir_ids = array('I')
+        self._mtimes = array('d')
+        self._name_starts = array('I')
+        self._name_lens = array('H')
+        self._blob = bytearray()
+        self._copies: dict[int, int] = {}
+        # 8-byte image id digests in file order
+        self._ids = bytearray()
+        # Entry ids sorted newest first; re-sorting a sorted run plus a new
+        # tail is a linear merge for Timsort
+        self._order: list[int] = []
+        # Image ids in ascending order and the entry (in file order) of each;
+        # each build merges in only the entries added since the last one
+        self._sorted_ids = array('Q')
+        self._by_id = array('I')
+
+    def __len__(self) -> int:
+        return len(self._mtimes)
+
+    def add(self, item: dict) -> None:
+        self.extend((item,))
+
+    def extend(self, items) -> None:
+        """Add entries from an iterable; items may be released as they are consumed."""
+        # Hot loop for millions of entries: keep everything in locals
+        sep = os.sep
+        dir_table, dirs = self._dir_table, self._dirs
+        blob, name_lens, dir_ids, mtimes = self._blob, self._name_lens, self._dir_ids, self._mtimes
+        ids = self._ids
+        for item in items:
+            path = item['path']
+            mtime = float(item.get('mtime', 0))
+            ids += _id_digest(path.encode('utf-8', 'surrogateescape'), mtime)
+            # Like os.path.split (for the paths indexes hold) at a fraction of the cost
+            directory, slash, name = path.rpartition(sep)
+            if slash and not directory:
+                directory = slash
+            dir_id = dir_table.get(directory)
+            if dir_id is None:
+                dir_id = dir_table[directory] = len(dirs)
+                dirs.append(directory)
+            encoded = name.encode('utf-8', 'surrogateescape')
+            start = len(blob)
+            if start + len(encoded) > 0xFFFFFFFF and self._name_starts.typecode == 'I':
+                self._name_starts = array('Q', self._name_starts)
+            self._name_starts.append(start)
+            name_lens.append(len(encoded))
+            blob += encoded
+            dir_ids.append(dir_id)
+            mtimes.append(mtime)
+            duplicates = item.get('duplicates')
+            if duplicates:
+                self._copies[len(mtimes) - 1] = 1 + len(duplicates)
+
+    def build(self) -> CompactIndex:
+        """Return everything added so far as a newest-first ``CompactIndex``."""
+        order = self._order
+        order.extend(range(len(order), len(self._mtimes)))
+        order.sort(key=self._mtimes.__getitem__, reverse=True)
+        copies = {}
+        if self._copies:
+            copies = {pos: self._copies[i] for pos, i in enumerate(order) if i in self._copies}
+        ids = array('Q')
+        ids.frombytes(self._ids)
+        new = sorted(range(len(self._by_id), len(ids)), key=ids.__getitem__)
+        self._sorted_ids, self._by_id = _merge_ids(self._sorted_ids, self._by_id, ids, new)
+        positions = array('I', bytes(4 * len(order)))
+        for pos, i in enumerate(order):
+            positions[i] = pos
+        return CompactIndex(
+            self._dirs, _permute(self._dir_ids, order), _permute(self._mtimes, order),
+            _permute(self._name_starts, order), _permute(self._name_lens, order),
+            self._blob, copies, self._sorted_ids, _permute(positions, self._by_id))
@@ -0,0 +1,249 @@
+"""Dependency-free metrics in the Prometheus text exposition format.
+
+Metrics live in a process-wide ``REGISTRY``. Counters and histograms are
+updated inline on the hot path (a ``perf_counter`` pair and a short locked
+update), while gauges and cache statistics are read from callbacks only when
+``/metrics`` is scraped. With ``--workers`` each process keeps its own
+registry, so a scrape reports the worker that answered it.
+"""
+import bisect
+import threading
+import time
+
+# Latency buckets in seconds, from a cache hit to a cold network scan
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _format_labels(labels: tuple[tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    inner = ",".join(
+        '{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for k, v in labels
+    )
+    return "{" + inner + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    type_name = "counter"
+
+    def __init__(self, name: str, help_text: str, label_names: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_text
+        self.label_names = label_names
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float = 1) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for label_values, value in items:
+            yield self.name, tuple(zip(self.label_names, label_values)), value
+
+
+class Histogram:
+    type_name = "histogram"
+
+    def __init__(self, name: str, help_text: str, label_names: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.label_names = label_names
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts (last is +Inf), sum]
+        self._series: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def time(self, *label_values) -> "_Timer":
+        """Context manager observing the elapsed wall time of its block."""
+        return _Timer(self, label_values)
+
+    def samples(self):
+        with self._lock:
+            items = [(k, list(v[0]), v[1]) for k, v in self._series.items()]
+        for label_values, counts, total in items:
+            labels = tuple(zip(self.label_names, label_values))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                yield self.name + "_bucket", labels + (("le", _format_value(bound)),), cumulative
+            yield self.name + "_sum", labels, total
+            yield self.name + "_count", labels, cumulative
+
+
+class _Timer:
+    __slots__ = ("histogram", "label_values", "start")
+
+    def __init__(self, histogram: Histogram, label_values: tuple):
+        self.histogram = histogram
+        self.label_values = label_values
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.start, *self.label_values)
+        return False
+
+
+class CallbackMetric:
+    """Gauge or counter whose samples come from ``fn()`` at scrape time.
+
+    ``fn`` returns a number, or a dict mapping a label value to a number.
+    """
+
+    def __init__(self, name: str, help_text: str, fn, type_name: str = "gauge",
+                 label_name: str | None = None):
+        self.name = name
+        self.help = help_text
+        self.fn = fn
+        self.type_name = type_name
+        self.label_name = label_name
+
+    def samples(self):
+        try:
+            value = self.fn()
+        except Exception:
+            return
+        if isinstance(value, dict):
+            for label_value, v in value.items():
+                yield self.name, ((self.label_name, label_value),), v
+        elif value is not None:
+            yield self.name, (), value
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None and type(existing) is type(metric) and not isinstance(metric, CallbackMetric):
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, help_text: str, label_names: tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, help_text, label_names))
+
+    def histogram(self, name: str, help_text: str, label_names: tuple[str, ...] = (),
+                  buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help_text, label_names, buckets))
+
+    def gauge_func(self, name: str, help_text: str, fn, label_name: str | None = None) -> CallbackMetric:
+        """Register (or replace) a gauge computed by ``fn`` at scrape time."""
+        return self._register(CallbackMetric(name, help_text, fn, "gauge", label_name))
+
+    def counter_func(self, name: str, help_text: str, fn, label_name: str | None = None) -> CallbackMetric:
+        """Register (or replace) a counter read from ``fn`` at scrape time."""
+        return self._register(CallbackMetric(name, help_text, fn, "counter", label_name))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUESTS = REGISTRY.counter(
+    "imgserve_requests_total", "HTTP requests handled, by route and status", ("route", "status"))
+REQUEST_SECONDS = REGISTRY.histogram(
+    "imgserve_request_duration_seconds", "Time until the response started, by route", ("route",))
+BYTES_SERVED = REGISTRY.counter(
+    "imgserve_response_bytes_total", "Response body bytes (from Content-Length), by route", ("route",))
+SCAN_SECONDS = REGISTRY.histogram(
+    "imgserve_scan_duration_seconds", "Time spent listing directories")
+RENDER_SECONDS = REGISTRY.histogram(
+    "imgserve_render_duration_seconds", "Time spent rendering gallery HTML")
+
+
+def route_label(path: str) -> str:
+    """Collapse a request path into a low-cardinality route label."""
+    if path == "/":
+        return "/"
+    if path.startswith("/images/"):
+        return "/images/"
+    return "other"
+
+
+class MetricsMiddleware:
+    """WSGI middleware counting requests, latency and bytes per route.
+
+    The returned body iterable is passed through untouched so servers can
+    still use ``wsgi.file_wrapper``/sendfile for images; bytes are taken
+    from ``Content-Length`` instead of by counting chunks.
+    """
+
+    def __init__(self, wsgi_app, registry: Registry = REGISTRY):
+        self.wsgi_app = wsgi_app
+        self.registry = registry
+
+    def __call__(self, environ, start_response):
+        route = route_label(environ.get('PATH_INFO', ''))
+        start = time.perf_counter()
+
+        def _start_response(status, headers, exc_info=None):
+            REQUESTS.inc(route, status[:3])
+            for name, value in headers:
+                if name.lower() == 'content-length':
+                    try:
+                        BYTES_SERVED.inc(route, amount=int(value))
+                    except ValueError:
+                        pass
+                    break
+            return start_response(status, headers, exc_info)
+
+        try:
+            return self.wsgi_app(environ, _start_response)
+        finally:
+            REQUEST_SECONDS.observe(time.perf_counter() - start, route)
+
+
+def register_waitress_gauges(server, registry: Registry = REGISTRY) -> None:
+    """Expose connection and queue gauges for a Waitress server object."""
+    dispatcher = server.task_dispatcher
+    socket_map = getattr(server, 'map', None) or getattr(server, '_map', {})
+    # The map also holds the listening socket and Waitress's wakeup trigger
+    from waitress.channel import HTTPChannel
+
+    registry.gauge_func(
+        "imgserve_open_connections", "Client connections currently open",
+        lambda: sum(1 for ch in list(socket_map.values()) if isinstance(ch, HTTPChannel)))
+    registry.gauge_func(
+        "imgserve_waitress_queue_depth", "Requests waiting for a free Waitress thread",
+        lambda: len(dispatcher.queue))
+    registry.gauge_func(
+        "imgserve_waitress_active_threads", "Waitress threads currently handling a request",
+        lambda: dispatcher.active_count)
@@ -0,0 +1,147 @@
+"""Virtual directory tree over an index's image paths.
+
+``PathTrie`` groups the entries of an ``--index-file`` by folder so index
+mode can be browsed like CWD mode without touching the filesystem. Folders
+are laid out depth-first in one array of entry positions, so every folder's
+own images and its whole subtree are contiguous ranges of that array:
+finding a folder costs O(depth) and listing a page of its own images
+O(page), however large the index. Chains of folders without images of their
+own are merged into one node (``2020/raw/camera1``), as in a compressed trie.
+
+Within a folder, entries keep the index's order (newest first). A subtree
+range mixes folders, so recursive listings use the subtree's positions
+re-sorted into index order; the root's is simply every position, and other
+subtrees are sorted on first use and kept in a bounded cache.
+"""
+import logging
+import os
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from typing import NamedTuple
+
+logger = logging.getLogger(__name__)
+
+# Positions kept in sorted subtree listings (4 bytes each)
+MAX_SORTED_POSITIONS = 4_000_000
+
+
+class _Node:
+    __slots__ = ('label', 'children', 'start', 'own_end', 'end')
+
+
+class TrieView(NamedTuple):
+    """A folder: its normalised path and ranges into ``PathTrie.order``."""
+    path: str
+    start: int
+    own_end: int   # [start, own_end): images directly in the folder
+    end: int       # [start, end): images in the whole subtree
+    subdirs: list  # (name, image count) of each subfolder
+
+    def positions(self, trie: "PathTrie", recursive: bool):
+        """Entry positions of the folder, or of its subtree, newest first."""
+        if not recursive or self.own_end == self.end:
+            # One folder: already in index order (O(1) view)
+            return trie.positions[self.start:self.own_end]
+        return trie.sorted_range(self.start, self.end)
+
+
+class PathTrie:
+    """Compressed path trie over the entries of a ``CompactIndex``."""
+
+    def __init__(self, entries):
+        started = time.perf_counter()
+        self.entries = entries
+        by_id: dict[int, list[int]] = {}
+        for i, dir_id in enumerate(entries.dir_ids):
+            by_id.setdefault(dir_id, []).append(i)
+        by_dir = {entries.dirs[dir_id]: ids for dir_id, ids in by_id.items()}
+        del by_id
+        try:
+            self.root_path = os.path.commonpath(list(by_dir)) if by_dir else ''
+        except ValueError:
+            # Mix of absolute and relative paths (or drives): no common root
+            self.root_path = ''
+
+        raw: dict = {}
+        for directory, ids in by_dir.items():
+            node = raw
+            rel = os.path.relpath(directory, self.root_path) if self.root_path else directory
+            if rel != '.':
+                for part in rel.split(os.sep):
+                    if part:
+                        node = node.setdefault(part, {})
+            node[None] = ids
+
+        self.order = array('I')
+        self.folders = 0
+        self.root = self._build('', raw)
+        # Slicing the memoryview is O(1); the array is never resized again
+        self.positions = memoryview(self.order)
+        # (start, end) -> that range of positions in ascending order
+        self._sorted: "OrderedDict[tuple[int, int], array]" = OrderedDict()
+        self._sorted_size = 0
+        self._lock = threading.Lock()
+        logger.info(f"Built folder tree of {self.folders} folders for {len(entries)} images "
+                    f"in {time.perf_counter() - started:.2f}s")
+
+    def _build(self, label: str, raw: dict) -> _Node:
+        node = _Node()
+        node.label = label
+        node.start = len(self.order)
+        self.order.extend(raw.get(None, ()))
+        node.own_end = len(self.order)
+        node.children = {}
+        self.folders += 1
+        for name in sorted((k for k in raw if k is not None), key=str.lower):
+            child, child_label = raw[name], name
+            while None not in child and len(child) == 1:
+                (part, child), = child.items()
+                child_label += '/' + part
+            node.children[name] = self._build(child_label, child)
+        node.end = len(self.order)
+        return node
+
+    def sorted_range(self, start: int, end: int):
+        """Positions in ``order[start:end]`` in index (newest-first) order."""
+        if start == 0 and end == len(self.order):
+            return range(end)
+        key = (start, end)
+        with self._lock:
+            positions = self._sorted.get(key)
+            if positions is not None:
+                self._sorted.move_to_end(key)
+                return positions
+        positions = array('I', sorted(self.positions[start:end]))
+        with self._lock:
+            if key not in self._sorted:
+                self._sorted[key] = positions
+                self._sorted_size += len(positions)
+            while self._sorted_size > MAX_SORTED_POSITIONS and len(self._sorted) > 1:
+                _, old = self._sorted.popitem(last=False)
+                self._sorted_size -= len(old)
+        return positions
+
+    def find(self, rel_dir: str) -> TrieView | None:
+        """Return the folder at ``rel_dir`` (relative to ``root_path``), if any."""
+        parts = [p for p in rel_dir.replace(os.sep, '/').split('/') if p and p != '.']
+        if '..' in parts:
+            return None
+        node, i = self.root, 0
+        while i < len(parts):
+            child = node.children.get(parts[i])
+            if child is None:
+                return None
+            label = child.label.split('/')
+            n = min(len(label), len(parts) - i)
+            if label[:n] != parts[i:i + n]:
+                return None
+            if n < len(label):
+                # Inside a merged chain: no images of its own, one subfolder
+                rest = '/'.join(label[n:])
+                return TrieView('/'.join(parts), child.start, child.start, child.end,
+                                [(rest, child.end - child.start)])
+            node, i = child, i + n
+        return TrieView('/'.join(parts), node.start, node.own_end, node.end,
+                        [(c.label, c.end - c.start) for c in node.children.values()])
@@ -0,0 +1,196 @@
+"""Speculative warm-up of the next gallery page.
+
+After a gallery page is served, the following page is rendered on a
+low-priority background thread and kept in a short-lived ``PageCache``,
+and the OS is asked to read ahead the original images on it
+(``posix_fadvise(WILLNEED)``). A visitor clicking "Next" then gets the
+page straight from the cache and its images from the page cache.
+
+Warm-up work is skipped while the server is busy, dropped when newer work
+supersedes it, and each task can be cancelled between steps.
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import TimeoutError
+
+logger = logging.getLogger(__name__)
+
+# Warm-up tasks waiting at once; older ones are dropped first
+MAX_PENDING = 4
+# Seconds a warmed page stays usable (it is a snapshot of the listing)
+PAGE_TTL_SECONDS = 30.0
+# Warmed pages kept at once
+MAX_CACHED_PAGES = 32
+# Niceness added to the warm-up thread where supported (Linux)
+WARMUP_NICENESS = 10
+
+
+def page_key(path: str, args) -> tuple:
+    """Normalised cache/single-flight key for a gallery URL.
+
+    Parameter order and parameters left at their defaults don't matter, so
+    ``/?page=2&sort=name`` and ``/?sort=name&page=2`` and ``/?page=2`` agree.
+    """
+    defaults = {('sort', 'name'), ('page', '1')}
+    items = sorted((k, v) for k, v in args.items(multi=True) if v and (k, v) not in defaults)
+    return (path, tuple(items))
+
+
+def is_prefetch_request(headers) -> bool:
+    """Whether the browser sent this request as a prefetch.
+
+    Prefetches (``<link rel=prefetch>``, speculation rules) are already the
+    warm-up; warming the page after them would run ever further ahead.
+    """
+    purpose = headers.get('Sec-Purpose') or headers.get('Purpose') or ''
+    return 'prefetch' in purpose.lower()
+
+
+def _advise_willneed(path: str) -> bool:
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return False
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        return True
+    except OSError:
+        return False
+    finally:
+        os.close(fd)
+
+
+def readahead(paths, cancelled=lambda: False, stat_pool=None) -> int:
+    """Ask the OS to start reading ``paths`` into the page cache.
+
+    With a ``stat_pool`` (slow or network mounts) the files are opened on
+    the pool within one pool deadline, and readahead stops at the first
+    file that doesn't answer in time, so a hung mount can't hold up the
+    warm-up thread.
+    """
+    if not hasattr(os, 'posix_fadvise'):
+        return 0
+    deadline = stat_pool.deadline() if stat_pool is not None else None
+    count = 0
+    for path in paths:
+        if cancelled():
+            break
+        if stat_pool is None:
+            count += _advise_willneed(path)
+            continue
+        try:
+            count += stat_pool.call(_advise_willneed, path, deadline=deadline)
+        except TimeoutError:
+            logger.info(f"Prefetch: readahead of {path} timed out; skipping the rest")
+            break
+    return count
+
+
+class PageCache:
+    """Short-lived store of warmed pages; each entry is served at most once."""
+
+    def __init__(self, ttl: float = PAGE_TTL_SECONDS, max_entries: int = MAX_CACHED_PAGES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._pages: "OrderedDict[tuple, tuple[float, object]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def pop(self, key):
+        """Return and remove the warmed page for ``key`` if it is still fresh."""
+        with self._lock:
+            entry = self._pages.pop(key, None)
+            if entry is not None and time.monotonic() - entry[0] <= self.ttl:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return None
+
+    def __contains__(self, key) -> bool:
+        with self._lock:
+            entry = self._pages.get(key)
+            return entry is not None and time.monotonic() - entry[0] <= self.ttl
+
+    def put(self, key, value) -> None:
+        with self._lock:
+            self._pages[key] = (time.monotonic(), value)
+            self._pages.move_to_end(key)
+            while len(self._pages) > self.max_entries:
+                self._pages.popitem(last=False)
+
+
+class _Task:
+    __slots__ = ('key', 'fn', 'cancelled')
+
+    def __init__(self, key, fn):
+        self.key = key
+        self.fn = fn
+        self.cancelled = False
+
+
+class Prefetcher:
+    """One low-priority worker thread running the most recent warm-up tasks.
+
+    ``busy()`` is consulted before scheduling and during work; while it
+    returns True no new warm-up starts and running tasks stop early.
+    """
+
+    def __init__(self, busy=lambda: False, max_pending: int = MAX_PENDING):
+        self.busy = busy
+        self.max_pending = max_pending
+        self._pending: deque[_Task] = deque()
+        self._running: _Task | None = None
+        self._cond = threading.Condition()
+        self._thread = None
+        self.scheduled = 0
+        self.completed = 0
+        self.skipped = 0
+        self.cancelled = 0
+
+    def schedule(self, key, fn) -> bool:
+        """Queue ``fn(cancelled)`` unless busy or already queued/running for ``key``."""
+        if self.busy():
+            self.skipped += 1
+            return False
+        with self._cond:
+            if (self._running is not None and self._running.key == key) or \
+                    any(task.key == key for task in self._pending):
+                return False
+            while len(self._pending) >= self.max_pending:
+                # The visitor has moved on; the oldest warm-up is least useful
+                self._pending.popleft().cancelled = True
+                self.cancelled += 1
+            self._pending.append(_Task(key, fn))
+            self.scheduled += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="imgserve-prefetch",
+                                                daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return True
+
+    def _run(self) -> None:
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), WARMUP_NICENESS)
+        except (AttributeError, OSError):
+            pass
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                task = self._running = self._pending.pop()  # newest first
+            try:
+                if task.cancelled or self.busy():
+                    self.skipped += 1
+                    continue
+                task.fn(lambda: task.cancelled or self.busy())
+                self.completed += 1
+            except Exception:
+                logger.exception(f"Prefetch of {task.key} failed")
+            finally:
+                with self._cond:
+                    self._running = None
@@ -0,0 +1,199 @@
+"""Pre-fork process supervisor.
+
+The parent binds the listening socket and builds the app (including any
+loaded index) once, then forks worker processes that all accept on the same
+socket. Index data is shared with the workers through copy-on-write; the
+parent only restarts workers that die and forwards shutdown signals to them.
+
+With an index, the parent also owns reloading it (on SIGHUP, or when its
+watcher sees the file change): it parses the new index once, then replaces
+the workers one at a time so the new ones share the new index.
+
+Workers are stopped with SIGTERM, which ``serve_worker`` should treat as a
+graceful drain: stop accepting, finish the requests in progress within
+``DRAIN_TIMEOUT_SECONDS``, exit. Only a worker that outlives that (plus a
+little grace) is killed, so replacing workers doesn't drop requests.
+"""
+import gc
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Minimum seconds between restarts of a worker slot that keeps crashing
+RESTART_BACKOFF_SECONDS = 1.0
+# Seconds a stopping worker has to finish its requests in progress
+DRAIN_TIMEOUT_SECONDS = 30.0
+# Further seconds before a worker that hasn't exited is killed
+KILL_GRACE_SECONDS = 5.0
+
+
+def bind_socket(host: str, port: int, backlog: int = 1024) -> socket.socket:
+    """Create a listening TCP socket to hand to every worker."""
+    family = socket.AF_INET6 if ':' in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+class Supervisor:
+    def __init__(self, serve_worker, sock: socket.socket, workers: int, on_hup=None):
+        """``serve_worker(sock)`` runs one worker's server until it exits
+        (draining on SIGTERM, see the module docstring).
+
+        ``on_hup()`` runs in the parent on SIGHUP; without it the signal is
+        forwarded to the workers.
+        """
+        self.serve_worker = serve_worker
+        self.sock = sock
+        self.workers = workers
+        self.on_hup = on_hup
+        self.children: dict[int, int] = {}  # pid -> slot
+        self.started_at: dict[int, float] = {}  # slot -> last spawn time
+        self.retiring: set[int] = set()  # pids being replaced by recycle()
+        self.stopping = False
+        self._recycle_lock = threading.Lock()
+
+    def _spawn(self, slot: int) -> None:
+        last = self.started_at.get(slot)
+        if last is not None and time.monotonic() - last < RESTART_BACKOFF_SECONDS:
+            time.sleep(RESTART_BACKOFF_SECONDS)
+        # Objects created so far (app, index) are never freed; moving them to
+        # the permanent generation keeps the GC from touching and un-sharing
+        # their pages in every worker. Repeated for each spawn, as a reload
+        # replaces the index in the parent.
+        gc.freeze()
+        pid = os.fork()
+        if pid == 0:
+            # Held by a parent thread at fork time (e.g. by recycle()), it
+            # would never be released here
+            self._recycle_lock = threading.Lock()
+            # serve_worker installs its own drain handler
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            if hasattr(signal, 'SIGHUP'):
+                # Reloads are the parent's job
+                signal.signal(signal.SIGHUP, signal.SIG_IGN)
+            code = 0
+            try:
+                self.serve_worker(self.sock)
+            except BaseException:
+                logger.exception(f"Worker {slot} crashed")
+                code = 1
+            finally:
+                os._exit(code)
+        self.children[pid] = slot
+        self.started_at[slot] = time.monotonic()
+
+    def _stop(self, signum, frame) -> None:
+        self.stopping = True
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        killer = threading.Timer(DRAIN_TIMEOUT_SECONDS + KILL_GRACE_SECONDS, self._kill_remaining)
+        killer.daemon = True
+        killer.start()
+
+    def _kill_remaining(self) -> None:
+        for pid in list(self.children):
+            self._kill(pid)
+
+    def _kill(self, pid: int) -> None:
+        logger.warning(f"Worker pid {pid} did not finish draining; killing it")
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+    def _forward(self, signum, frame) -> None:
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def _hup(self, signum, frame) -> None:
+        if self.on_hup is not None:
+            self.on_hup()
+        else:
+            self._forward(signum, frame)
+
+    def recycle(self) -> None:
+        """Replace every worker with a fresh fork, one at a time.
+
+        Safe to call from any thread; the main loop does the respawning.
+        Only one worker drains at a time, so the others keep serving; one
+        that doesn't finish within the drain timeout is killed.
+        """
+        with self._recycle_lock:
+            for pid in list(self.children):
+                if self.stopping:
+                    return
+                self.retiring.add(pid)
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+                deadline = time.monotonic() + DRAIN_TIMEOUT_SECONDS + KILL_GRACE_SECONDS
+                while pid in self.children and time.monotonic() < deadline:
+                    time.sleep(0.05)
+                if pid in self.children:
+                    self._kill(pid)
+                    while pid in self.children and not self.stopping:
+                        time.sleep(0.05)
+            logger.info(f"Replaced {self.workers} workers")
+
+    def run(self) -> None:
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        if hasattr(signal, 'SIGHUP'):
+            signal.signal(signal.SIGHUP, self._hup)
+        for slot in range(self.workers):
+            self._spawn(slot)
+
+        while self.children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            except InterruptedError:
+                continue
+            slot = self.children.pop(pid, None)
+            if slot is None or self.stopping:
+                continue
+            if pid in self.retiring:
+                self.retiring.discard(pid)
+                # Not a crash: start the replacement right away
+                self.started_at.pop(slot, None)
+            else:
+                logger.warning(f"Worker {slot} (pid {pid}) exited with status {status}; restarting")
+            self._spawn(slot)
+        self.sock.close()
+
+
+def run_prefork(serve_worker, sock: socket.socket, workers: int, index_loader=None,
+                reload_interval: float = 0) -> None:
+    """Fork ``workers`` processes running ``serve_worker(sock)`` and supervise them.
+
+    With an ``index_loader`` the parent reloads the index on SIGHUP (and
+    every ``reload_interval`` seconds if the file changed), then recycles
+    the workers.
+    """
+    if not hasattr(os, 'fork'):
+        raise RuntimeError("--workers requires a platform with os.fork()")
+    if index_loader is None:
+        Supervisor(serve_worker, sock, workers).run()
+        return
+    supervisor = Supervisor(serve_worker, sock, workers, on_hup=index_loader.reload)
+    index_loader.on_reload = supervisor.recycle
+    index_loader.watch(reload_interval)
+    supervisor.run()
@@ -0,0 +1,227 @@
+"""Per-request stage timing (``Server-Timing``) and on-demand profiling.
+
+Both features are WSGI middleware that ``create_app`` installs only when
+enabled. Code on the request path marks its stages with ``stage(name)``,
+which returns a shared no-op context manager when no timing is active
+(neither ``Server-Timing`` nor the request log is collecting).
+"""
+import cProfile
+import io
+import logging
+import os
+import pstats
+import threading
+import time
+from urllib.parse import parse_qs
+
+try:
+    from .admin import is_admin_request
+except ImportError:
+    from admin import is_admin_request
+
+logger = logging.getLogger(__name__)
+
+# Rows of profiler output returned inline
+PROFILE_STATS_LIMIT = 40
+# Allocation sites reported when tracemalloc is requested
+TRACEMALLOC_TOP = 25
+
+_local = threading.local()
+
+
+class _NullStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    __slots__ = ("timings", "name", "start")
+
+    def __init__(self, timings: dict, name: str):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.start
+        self.timings[self.name] = self.timings.get(self.name, 0.0) + elapsed
+        return False
+
+
+def stage(name: str):
+    """Time a block as stage ``name`` of the current request, if timing is on.
+
+    Repeated stages of the same name within one request are summed.
+    """
+    timings = getattr(_local, 'timings', None)
+    if timings is None:
+        return _NULL_STAGE
+    return _Stage(timings, name)
+
+
+def begin_request_timings() -> tuple[dict, bool]:
+    """Start collecting stage timings for this thread's request.
+
+    Returns ``(timings, owned)``; a collection already started by an outer
+    middleware is shared rather than replaced, and only its owner ends it.
+    """
+    timings = getattr(_local, 'timings', None)
+    if timings is not None:
+        return timings, False
+    timings = _local.timings = {}
+    return timings, True
+
+
+def end_request_timings(owned: bool) -> None:
+    if owned:
+        _local.timings = None
+
+
+def format_server_timing(timings: dict) -> str:
+    return ", ".join(f"{name};dur={seconds * 1000:.2f}" for name, seconds in timings.items())
+
+
+class ServerTimingMiddleware:
+    """Add a ``Server-Timing`` header with the stages of each request.
+
+    ``total`` covers everything up to the response headers; body transfer
+    happens afterwards and cannot be reported in the same response.
+    """
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        timings, owned = begin_request_timings()
+        start = time.perf_counter()
+
+        def _start_response(status, headers, exc_info=None):
+            timings['total'] = time.perf_counter() - start
+            headers = list(headers) + [('Server-Timing', format_server_timing(timings))]
+            return start_response(status, headers, exc_info)
+
+        try:
+            return self.wsgi_app(environ, _start_response)
+        finally:
+            end_request_timings(owned)
+
+
+class _ResumedBody:
+    """A response body whose first chunks were already read while profiling."""
+
+    def __init__(self, head: list[bytes], rest, result):
+        self.head = head
+        self.rest = rest
+        self.result = result
+
+    def __iter__(self):
+        yield from self.head
+        yield from self.rest
+
+    def close(self) -> None:
+        if hasattr(self.result, 'close'):
+            self.result.close()
+
+
+class ProfilingMiddleware:
+    """Run admin requests carrying ``?__profile=1`` under cProfile.
+
+    ``__profile=mem`` also records allocations with tracemalloc. With a
+    ``profile_dir`` the normal response is returned and the stats are saved
+    there (named in an ``X-Imgserve-Profile`` header); otherwise the
+    response is replaced by a plain-text report.
+
+    Profiling stops at the first body chunk: that covers a whole page, and
+    a streamed body (a ZIP download) is passed on, never held in memory.
+    """
+
+    def __init__(self, wsgi_app, admin_token: str | None, profile_dir: str | None = None):
+        self.wsgi_app = wsgi_app
+        self.admin_token = admin_token
+        self.profile_dir = profile_dir
+        self._lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        query = environ.get('QUERY_STRING', '')
+        if '__profile=' not in query:
+            return self.wsgi_app(environ, start_response)
+        mode = parse_qs(query).get('__profile', [''])[0]
+        if mode not in ('1', 'mem') or not is_admin_request(environ, self.admin_token):
+            return self.wsgi_app(environ, start_response)
+        # cProfile and tracemalloc are process-wide; profile one request at a time
+        with self._lock:
+            return self._profile(environ, start_response, with_memory=(mode == 'mem'))
+
+    def _profile(self, environ, start_response, with_memory: bool):
+        import tracemalloc
+
+        captured = {}
+        body: list[bytes] = []
+
+        def _capture(status, headers, exc_info=None):
+            captured['status'] = status
+            captured['headers'] = list(headers)
+            return body.append
+
+        tracing = with_memory and not tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.start()
+        profiler = cProfile.Profile()
+        profiler.enable()
+        result = None
+        try:
+            result = self.wsgi_app(environ, _capture)
+            rest = iter(result)
+            first = next(rest, None)
+            if first is not None:
+                body.append(first)
+        except BaseException:
+            if hasattr(result, 'close'):
+                result.close()
+            raise
+        finally:
+            profiler.disable()
+            snapshot = tracemalloc.take_snapshot() if with_memory and tracemalloc.is_tracing() else None
+            if tracing:
+                tracemalloc.stop()
+
+        report = io.StringIO()
+        stats = pstats.Stats(profiler, stream=report)
+        stats.sort_stats('cumulative').print_stats(PROFILE_STATS_LIMIT)
+        if snapshot is not None:
+            report.write(f"\nTop {TRACEMALLOC_TOP} allocation sites (tracemalloc):\n")
+            for stat in snapshot.statistics('lineno')[:TRACEMALLOC_TOP]:
+                report.write(f"{stat}\n")
+
+        if self.profile_dir:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            name = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{threading.get_ident()}"
+            prof_path = os.path.join(self.profile_dir, name + ".prof")
+            stats.dump_stats(prof_path)
+            with open(os.path.join(self.profile_dir, name + ".txt"), 'w') as f:
+                f.write(f"{environ.get('PATH_INFO', '')}?{environ.get('QUERY_STRING', '')}\n\n")
+                f.write(report.getvalue())
+            logger.info(f"Saved request profile to {prof_path}")
+            start_response(captured['status'],
+                           captured['headers'] + [('X-Imgserve-Profile', prof_path)])
+            return _ResumedBody(body, rest, result)
+
+        # Only the report is sent; don't produce the rest of the body
+        if hasattr(result, 'close'):
+            result.close()
+        data = report.getvalue().encode('utf-8')
+        start_response('200 OK', [('Content-Type', 'text/plain; charset=utf-8'),
+                                  ('Content-Length', str(len(data))),
+                                  ('Cache-Control', 'no-store')])
+        return [data]
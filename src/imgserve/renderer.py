@@ -1,6 +1,6 @@
 import os
 from datetime import datetime
-from flask import render_template_string
+from html import escape
 
 IMAGES_PER_PAGE = 300
 PAGINATION_LINKS_TO_SHOW = 10
@@ -56,14 +56,35 @@ def compute_pagination_window(page: int, total_items: int, per_page: int = IMAGE
     }
 
 
+def _prefetch_link(href: str | None) -> str:
+    """Hint the browser to fetch the next page while the visitor looks at this one."""
+    return f"<link rel='prefetch' href='{href}'>" if href else ""
+
+
+def _tile_image(tile: dict) -> str:
+    """Markup for a tile's picture: a contact-sheet cell or a plain <img>."""
+    sprite = tile.get("sprite")
+    if sprite:
+        url, x, y = sprite
+        return (f"<span class='sprite' role='img' aria-label='image' "
+                f"style='background-image: url({url}); background-position: -{x}px -{y}px'></span>")
+    width, height = tile.get("size", (None, None))
+    # Intrinsic size lets the browser reserve the box before loading
+    size_attrs = f' width="{width}" height="{height}"' if width and height else ""
+    return f'<img src="{tile.get("img_src", "")}" alt="image"{size_attrs}>'
+
+
 def render_gallery(title: str,
                    page: int,
                    total_pages: int,
                    start_page_num: int,
                    end_page_num: int,
                    tiles: list[dict],
-                   empty_message: str = "No image files found."):
+                   empty_message: str = "No image files found.",
+                   notice: str | None = None,
+                   downloads: list[tuple[str, str]] | None = None):
     """Render a simple tiled gallery without subdirectory navigation."""
+    prefetch_link = _prefetch_link(f"/?page={page + 1}" if page < total_pages else None)
     html_content = f"""
     <!DOCTYPE html>
     <html lang=\"en\">
@@ -109,6 +130,15 @@ def render_gallery(title: str,
                 margin: 0 auto;
                 border-radius: 4px;
             }}
+            .image-tile .sprite {{
+                width: 150px;
+                height: 150px;
+                display: block;
+                margin: 0 auto;
+                border-radius: 4px;
+                background-color: #eee;
+                background-repeat: no-repeat;
+            }}
             .image-tile a {{
                 text-decoration: none;
                 color: #333;
@@ -133,6 +163,16 @@ def render_gallery(title: str,
                 display: block;
                 font-weight: normal;
             }}
+            .image-copies {{
+                font-size: 0.7em;
+                color: #fff;
+                background-color: #6c757d;
+                border-radius: 8px;
+                padding: 0 6px;
+                margin: 2px auto;
+                display: inline-block;
+                font-weight: normal;
+            }}
             .no-images {{
                 text-align: center;
                 color: #666;
@@ -171,10 +211,40 @@ def render_gallery(title: str,
                 background-color: #f9f9f9;
                 cursor: not-allowed;
             }}
+            .notice {{
+                text-align: center;
+                color: #856404;
+                background-color: #fff3cd;
+                border: 1px solid #ffeeba;
+                border-radius: 5px;
+                padding: 8px;
+                margin: 0 auto 15px auto;
+                max-width: 600px;
+            }}
+            .downloads {{
+                text-align: center;
+                margin: 0 0 15px 0;
+            }}
+            .downloads a {{
+                margin: 0 6px;
+                color: #007bff;
+                text-decoration: none;
+            }}
         </style>
+        {prefetch_link}
     </head>
     <body>
         <h1>{title}</h1>
+    """
+
+    if downloads:
+        links = " ".join(f'<a href="{href}">{label}</a>' for label, href in downloads)
+        html_content += f'<p class="downloads">{links}</p>'
+
+    if notice:
+        html_content += f'<p class="notice">{notice} <a href="">Refresh</a></p>'
+
+    html_content += """
         <div class=\"gallery-container\">
     """
 
@@ -183,15 +253,17 @@ def render_gallery(title: str,
     else:
         for tile in tiles:
             href = tile.get("href", "#")
-            img_src = tile.get("img_src", "")
             filename = tile.get("filename", "")
             caption = tile.get("caption", "")
+            copies = tile.get("copies", 1)
+            copies_html = f"<p class=\"image-copies\">{copies} copies</p>" if copies > 1 else ""
             html_content += f"""
             <div class=\"image-tile\">
                 <a href=\"{href}\" target=\"_blank\">
-                    <img src=\"{img_src}\" alt=\"image\">
+                    {_tile_image(tile)}
                     <p class=\"image-filename\">{filename}</p>
                     <p class=\"image-date\">{caption}</p>
+                    {copies_html}
                 </a>
             </div>
             """
@@ -224,6 +296,7 @@ def render_gallery(title: str,
     </html>
     """
 
+    from flask import render_template_string
     return render_template_string(html_content)
 
 
@@ -236,10 +309,31 @@ def render_gallery_with_dirs(title: str,
                              empty_message: str = "No image files found.",
                              subdirs: list[tuple[str, str]] | None = None,
                              current_dir_rel: str = "",
-                             sort_by: str = "name"):
+                             sort_by: str = "name",
+                             recursive: bool = False,
+                             notice: str | None = None,
+                             downloads: list[tuple[str, str]] | None = None,
+                             recursive_default: bool = False,
+                             sort_options: tuple[str, ...] = ("date", "taken", "name")):
+    """Render a tiled gallery with sort buttons and subdirectory navigation.
+
+    ``recursive_default`` is what a URL without ``recursive`` means (index
+    mode shows subtrees by default); ``sort_options`` picks the sort buttons.
+    """
     if subdirs is None:
         subdirs = []
 
+    # Only spell out `recursive` when it differs from the default
+    recursive_param = "" if recursive == recursive_default else f"&recursive={int(recursive)}"
+    toggle_recursive = "" if recursive != recursive_default else f"&recursive={int(not recursive)}"
+
+    next_href = None
+    if page < total_pages:
+        next_href = (f"/?page={page + 1}"
+                     + (f"&dir={current_dir_rel}" if current_dir_rel else "")
+                     + (f"&sort={sort_by}" if sort_by != "name" else "")
+                     + recursive_param)
+    prefetch_link = _prefetch_link(next_href)
     html_content = f"""
     <!DOCTYPE html>
     <html lang=\"en\">
@@ -312,6 +406,15 @@ def render_gallery_with_dirs(title: str,
                 margin: 0 auto;
                 border-radius: 4px;
             }}
+            .image-tile .sprite {{
+                width: 150px;
+                height: 150px;
+                display: block;
+                margin: 0 auto;
+                border-radius: 4px;
+                background-color: #eee;
+                background-repeat: no-repeat;
+            }}
             .image-tile a {{
                 text-decoration: none;
                 color: #333;
@@ -336,6 +439,16 @@ def render_gallery_with_dirs(title: str,
                 display: block;
                 font-weight: normal;
             }}
+            .image-copies {{
+                font-size: 0.7em;
+                color: #fff;
+                background-color: #6c757d;
+                border-radius: 8px;
+                padding: 0 6px;
+                margin: 2px auto;
+                display: inline-block;
+                font-weight: normal;
+            }}
             .no-images {{
                 text-align: center;
                 color: #666;
@@ -394,7 +507,18 @@ def render_gallery_with_dirs(title: str,
                 background-color: #28a745;
                 color: #fff;
             }}
+            .notice {{
+                text-align: center;
+                color: #856404;
+                background-color: #fff3cd;
+                border: 1px solid #ffeeba;
+                border-radius: 5px;
+                padding: 8px;
+                margin: 0 auto 15px auto;
+                max-width: 600px;
+            }}
         </style>
+        {prefetch_link}
     </head>
     <body>
         <h1><span class="icon">🖼️</span>{title}</h1>
@@ -404,14 +528,27 @@ def render_gallery_with_dirs(title: str,
 
     dir_param = f"&dir={current_dir_rel}" if current_dir_rel else ""
     page_param = f"&page={page}" if page > 1 else ""
-    date_class = "active" if sort_by == "date" else ""
-    name_class = "active" if sort_by == "name" else ""
+    recursive_class = "active" if recursive else ""
+    sort_labels = {"date": "Sort by Date", "taken": "Sort by Capture Time", "name": "Sort by Name"}
 
+    for option in sort_options:
+        active = "active" if sort_by == option else ""
+        html_content += (f'                <a href="/?sort={option}{dir_param}{page_param}{recursive_param}" '
+                         f'class="{active}">{sort_labels[option]}</a>\n')
     html_content += f"""
-                <a href="/?sort=date{dir_param}{page_param}" class="{date_class}">Sort by Date</a>
-                <a href="/?sort=name{dir_param}{page_param}" class="{name_class}">Sort by Name</a>
+                <a href="/?sort={sort_by}{dir_param}{toggle_recursive}" class="{recursive_class}">Include Subdirectories</a>
+    """
+    for label, href in downloads or ():
+        html_content += f'            <a href="{href}">{label}</a>\n'
+    html_content += """
             </div>
         </div>
+    """
+
+    if notice:
+        html_content += f'<p class="notice">{notice} <a href="">Refresh</a></p>'
+
+    html_content += """
         <div class="gallery-container">
     """
 
@@ -420,15 +557,17 @@ def render_gallery_with_dirs(title: str,
     else:
         for tile in tiles:
             href = tile.get("href", "#")
-            img_src = tile.get("img_src", "")
             filename = tile.get("filename", "")
             caption = tile.get("caption", "")
+            copies = tile.get("copies", 1)
+            copies_html = f"<p class='image-copies'>{copies} copies</p>" if copies > 1 else ""
             html_content += f"""
             <div class="image-tile">
                 <a href="{href}" target="_blank">
-                    <img src="{img_src}" alt="image">
+                    {_tile_image(tile)}
                     <p class="image-filename">{filename}</p>
                     <p class="image-date">{caption}</p>
+                    {copies_html}
                 </a>
             </div>
             """
@@ -440,6 +579,7 @@ def render_gallery_with_dirs(title: str,
 
     dir_param = f"&dir={current_dir_rel}" if current_dir_rel else ""
     sort_param = f"&sort={sort_by}" if sort_by != "name" else ""
+    sort_param += recursive_param
     if page > 1:
         html_content += f"<a href='/?page={page - 1}{dir_param}{sort_param}'>&laquo; Previous</a>"
     else:
@@ -465,6 +605,7 @@ def render_gallery_with_dirs(title: str,
     if subdirs:
         html_content += '<div class="subdirs"><h3>Subdirectories:</h3>'
         sort_param = f"&sort={sort_by}" if sort_by != "name" else ""
+        sort_param += recursive_param
         for display_name, rel_path in subdirs:
             html_content += f'<a href="/?dir={rel_path}{sort_param}">{display_name}</a>'
         html_content += '</div>'
@@ -474,4 +615,49 @@ def render_gallery_with_dirs(title: str,
     </html>
     """
 
+    from flask import render_template_string
     return render_template_string(html_content)
+
+
+def _request_rows(records: list[dict]) -> str:
+    rows = []
+    for r in records:
+        stages = " ".join(f"{name}={seconds * 1000:.1f}" for name, seconds in r['stages'].items())
+        target = r['path'] + (f"?{r['query']}" if r['query'] else "")
+        size = "" if r['bytes'] is None else r['bytes']
+        rows.append(f"<tr><td>{datetime.fromtimestamp(r['time']).strftime('%H:%M:%S')}</td>"
+                    f"<td class='num'>{r['seconds'] * 1000:.1f}</td><td>{r['status']}</td>"
+                    f"<td class='num'>{size}</td><td>{escape(r['method'])} {escape(target)}</td>"
+                    f"<td>{escape(stages)}</td></tr>")
+    return "".join(rows)
+
+
+def render_request_log(snapshot: dict, token_query: str = "") -> str:
+    """Render the admin page of slowest and recent requests (times in ms)."""
+    header = "<tr><th>Time</th><th>ms</th><th>Status</th><th>Bytes</th><th>Request</th><th>Stages (ms)</th></tr>"
+    sections = "".join(
+        f"<h2>Slowest: {escape(route)}</h2><table>{header}{_request_rows(records)}</table>"
+        for route, records in snapshot['slowest'].items())
+    return f"""
+    <!DOCTYPE html>
+    <html lang=\"en\">
+    <head>
+        <meta charset=\"UTF-8\">
+        <title>Requests</title>
+        <style>
+            body {{ font-family: sans-serif; margin: 10px; }}
+            table {{ border-collapse: collapse; font-size: 13px; margin-bottom: 20px; }}
+            th, td {{ border-bottom: 1px solid #ddd; padding: 2px 8px; text-align: left; }}
+            td.num {{ text-align: right; }}
+        </style>
+    </head>
+    <body>
+        <h1>Requests</h1>
+        <p>{snapshot['recorded']} recorded in this process; the last {snapshot['capacity']} are kept.
+        <a href=\"?format=json{token_query}\">JSON</a></p>
+        {sections}
+        <h2>Recent</h2>
+        <table>{header}{_request_rows(snapshot['recent'])}</table>
+    </body>
+    </html>
+    """
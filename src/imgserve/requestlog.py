@@ -0,0 +1,129 @@
+"""Always-on record of recent and slow requests.
+
+``RequestLogMiddleware`` collects every request's stage timings (the same
+``stage()`` blocks ``--server-timing`` reports), status and response size
+into a fixed-size ring buffer, and keeps the slowest requests of each route
+in small heaps, so intermittent slowness can be looked at after the fact on
+the admin-only ``/debug/requests`` page. Recording costs a dict and a lock
+round-trip per request; nothing is written to disk.
+"""
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+
+try:
+    from .admin import strip_query_params
+    from .metrics import route_label
+    from .profiling import begin_request_timings, end_request_timings
+except ImportError:
+    from admin import strip_query_params
+    from metrics import route_label
+    from profiling import begin_request_timings, end_request_timings
+
+# Requests kept in the ring buffer
+REQUEST_LOG_SIZE = 1000
+# Slowest requests kept per route
+SLOWEST_PER_ROUTE = 20
+# Routes tracked separately; further paths share the "other" heap
+MAX_ROUTES = 32
+
+
+class RequestLog:
+    """Ring buffer of recent requests plus the slowest ones per route."""
+
+    def __init__(self, size: int = REQUEST_LOG_SIZE, slowest: int = SLOWEST_PER_ROUTE):
+        self.slowest_per_route = slowest
+        self._recent: deque[dict] = deque(maxlen=size)
+        # route -> min-heap of (seconds, seq, record); the root is the first to go
+        self._slowest: dict[str, list] = {}
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self.recorded = 0
+
+    def route(self, path: str) -> str:
+        label = route_label(path)
+        if label != "other":
+            return label
+        # Finer than the metrics label (/download.zip, /sprites/, ...), but
+        # bounded: arbitrary 404 paths must not grow the table
+        head, sep, _ = path[1:].partition('/')
+        label = f"/{head}{sep}"
+        if label in self._slowest or len(self._slowest) < MAX_ROUTES:
+            return label
+        return "other"
+
+    def add(self, record: dict) -> None:
+        entry = (record['seconds'], next(self._seq), record)
+        with self._lock:
+            self.recorded += 1
+            self._recent.append(record)
+            heap = self._slowest.setdefault(record['route'], [])
+            if len(heap) < self.slowest_per_route:
+                heapq.heappush(heap, entry)
+            elif entry[0] > heap[0][0]:
+                heapq.heapreplace(heap, entry)
+
+    def recent(self) -> list[dict]:
+        """Recorded requests, newest first."""
+        with self._lock:
+            records = list(self._recent)
+        records.reverse()
+        return records
+
+    def slowest(self) -> dict[str, list[dict]]:
+        """The slowest requests of each route, slowest first."""
+        with self._lock:
+            heaps = {route: list(heap) for route, heap in self._slowest.items()}
+        return {route: [record for _, _, record in sorted(heap, reverse=True)]
+                for route, heap in sorted(heaps.items())}
+
+    def snapshot(self) -> dict:
+        """Everything recorded, as plain JSON-ready data."""
+        return {"recorded": self.recorded, "capacity": self._recent.maxlen,
+                "slowest": self.slowest(), "recent": self.recent()}
+
+
+class RequestLogMiddleware:
+    """WSGI middleware adding one record per request to a ``RequestLog``.
+
+    Like the metrics middleware, it times the request until the application
+    returns and takes bytes from ``Content-Length``, leaving the body
+    iterable untouched for sendfile.
+    """
+
+    def __init__(self, wsgi_app, log: RequestLog):
+        self.wsgi_app = wsgi_app
+        self.log = log
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        record = {
+            "time": time.time(),
+            "method": environ.get('REQUEST_METHOD', 'GET'),
+            "path": path,
+            # Never store the admin token
+            "query": strip_query_params(environ.get('QUERY_STRING', '')),
+            "route": self.log.route(path),
+            "status": 0,
+            "bytes": None,
+        }
+        timings, owned = begin_request_timings()
+        start = time.perf_counter()
+
+        def _start_response(status, headers, exc_info=None):
+            record["status"] = int(status[:3])
+            for name, value in headers:
+                if name.lower() == 'content-length':
+                    record["bytes"] = int(value) if value.isascii() and value.isdecimal() else None
+                    break
+            return start_response(status, headers, exc_info)
+
+        try:
+            return self.wsgi_app(environ, _start_response)
+        finally:
+            record["seconds"] = time.perf_counter() - start
+            record["stages"] = dict(timings)
+            end_request_timings(owned)
+            self.log.add(record)
@@ -0,0 +1,172 @@
+"""Directory scans, cached in memory and on disk across restarts.
+
+A scan records the image files (name, mtime, size) and subdirectories of
+one directory. Cached scans are keyed by directory path and trusted only
+while the directory's mtime is unchanged, which is revalidated with a single
+``stat`` on every lookup. Each directory is stored as one small JSON file,
+loaded lazily the first time that directory is requested after a restart.
+
+Changing a directory's entry list updates its mtime; rewriting a file in
+place does not, so in-place edits show up once the directory itself changes.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import TimeoutError
+from typing import NamedTuple
+
+logger = logging.getLogger(__name__)
+
+# Scans kept in memory; the rest stay on disk until requested
+MAX_CACHED_SCANS = 4096
+# Scans of directories modified this recently are not cached: a change in
+# the same mtime tick as the scan would go unnoticed
+RACY_WINDOW_SECONDS = 2.0
+# Bumped whenever the on-disk record layout changes
+FORMAT_VERSION = 1
+
+
+class DirectoryScan(NamedTuple):
+    # (filename, mtime, size) of each image file
+    files: list[tuple[str, float, int]]
+    # (name, is_symlink) of each subdirectory not starting with '.'
+    subdirs: list[tuple[str, bool]]
+    # False if a StatPool deadline cut the scan short
+    complete: bool = True
+
+
+def scan_directory(directory: str, extensions, stat_pool=None, deadline: float | None = None) -> DirectoryScan:
+    """List image files and subdirectories of ``directory`` (raises OSError).
+
+    With a ``StatPool`` the per-file stats run in parallel under a deadline
+    (the pool's timeout from now, or ``deadline``).
+    """
+    if stat_pool is not None:
+        return stat_pool.scan(directory, extensions, deadline)
+    files, subdirs = [], []
+    with os.scandir(directory) as it:
+        for entry in it:
+            name = entry.name
+            try:
+                if entry.is_dir():
+                    if not name.startswith('.'):
+                        subdirs.append((name, entry.is_symlink()))
+                    continue
+                if not name.lower().endswith(extensions) or name.startswith('._'):
+                    continue
+                if not entry.is_file():
+                    continue
+                st = entry.stat()
+                files.append((name, st.st_mtime, st.st_size))
+            except OSError:
+                files.append((name, float('inf'), 0))
+    return DirectoryScan(files, subdirs)
+
+
+class ScanCache:
+    """Thread-safe scan cache with an optional on-disk layer under ``cache_dir``."""
+
+    def __init__(self, extensions, cache_dir: str | None = None,
+                 max_scans: int = MAX_CACHED_SCANS, stat_pool=None):
+        self.extensions = extensions
+        self.cache_dir = cache_dir
+        self.stat_pool = stat_pool
+        self.max_scans = max_scans
+        self._scans: "OrderedDict[str, tuple[int, DirectoryScan]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def scan(self, directory: str, deadline: float | None = None) -> DirectoryScan:
+        """Return the scan of ``directory``, rescanning only if it changed.
+
+        With a stat pool, everything (including the directory's own stat)
+        finishes by ``deadline`` or yields an incomplete scan.
+        """
+        if self.stat_pool is not None:
+            if deadline is None:
+                deadline = self.stat_pool.deadline()
+            try:
+                mtime_ns = self.stat_pool.call(os.stat, directory, deadline=deadline).st_mtime_ns
+            except TimeoutError:
+                self.stat_pool._timed_out(directory, "stat")
+                return DirectoryScan([], [], complete=False)
+        else:
+            mtime_ns = os.stat(directory).st_mtime_ns
+        with self._lock:
+            cached = self._scans.get(directory)
+            if cached is not None:
+                self._scans.move_to_end(directory)
+        if cached is None:
+            cached = self._load(directory)
+        if cached is not None and cached[0] == mtime_ns:
+            self.hits += 1
+            self._remember(directory, cached)
+            return cached[1]
+
+        self.misses += 1
+        result = scan_directory(directory, self.extensions, self.stat_pool, deadline)
+        if result.complete and time.time() - mtime_ns / 1e9 > RACY_WINDOW_SECONDS:
+            self._remember(directory, (mtime_ns, result))
+            self._save(directory, mtime_ns, result)
+        return result
+
+    def _remember(self, directory: str, cached: tuple[int, DirectoryScan]) -> None:
+        with self._lock:
+            self._scans[directory] = cached
+            self._scans.move_to_end(directory)
+            while len(self._scans) > self.max_scans:
+                self._scans.popitem(last=False)
+
+    def _record_path(self, directory: str) -> str:
+        digest = hashlib.blake2b(directory.encode('utf-8', 'surrogateescape'), digest_size=16)
+        return os.path.join(self.cache_dir, f"{digest.hexdigest()}.json")
+
+    def _load(self, directory: str) -> tuple[int, DirectoryScan] | None:
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._record_path(directory), 'r', encoding='utf-8') as f:
+                record = json.load(f)
+            if record.get('v') != FORMAT_VERSION or record.get('dir') != directory:
+                return None
+            files = [(name, float('inf') if mtime is None else mtime, size)
+                     for name, mtime, size in record['files']]
+            subdirs = [(name, bool(link)) for name, link in record['subdirs']]
+            return record['mtime_ns'], DirectoryScan(files, subdirs)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.info(f"Scan cache: ignoring unreadable record for {directory}: {e}")
+            return None
+
+    def _save(self, directory: str, mtime_ns: int, result: DirectoryScan) -> None:
+        if not self.cache_dir:
+            return
+        path = self._record_path(directory)
+        record = {
+            'v': FORMAT_VERSION,
+            'dir': directory,
+            'mtime_ns': mtime_ns,
+            # JSON has no infinity; unreadable files (mtime inf) get null
+            'files': [[name, mtime if mtime != float('inf') else None, size]
+                      for name, mtime, size in result.files],
+            'subdirs': [[name, int(link)] for name, link in result.subdirs],
+        }
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(record, f, separators=(',', ':'))
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.info(f"Scan cache: cannot write record for {directory}: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
@@ -0,0 +1,69 @@
+"""Single-flight coalescing of identical concurrent work.
+
+When several threads ask for the same key at once, only the first (the
+leader) runs the computation; the others wait for it and share its result
+or exception. Nothing is cached: once the leader finishes, the next call
+for the key computes afresh.
+"""
+import threading
+
+try:
+    from .profiling import stage
+except ImportError:
+    from profiling import stage
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesce concurrent ``do(key, fn)`` calls with equal keys."""
+
+    def __init__(self):
+        self._calls: dict = {}
+        self._lock = threading.Lock()
+        # Calls that ran fn / calls that waited for another thread's result
+        self.leaders = 0
+        self.coalesced = 0
+
+    def do(self, key, fn):
+        """Return ``fn()``, sharing one in-progress call per ``key``.
+
+        Results are shared between threads, so callers must not mutate them.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            with stage('coalesced'):
+                call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls)
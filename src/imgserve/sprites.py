@@ -0,0 +1,160 @@
+"""Contact sheets: a gallery page's thumbnails composed into a few images.
+
+With sprites enabled, a page of 300 tiles costs a handful of sheet requests
+instead of 300 image requests; each tile shows its cell of a sheet through
+CSS background offsets and still links to the original.
+
+A page's sheets are identified by a version hash of its ``(path, mtime)``
+entries, so a changed listing, page or sort order yields new sheet URLs and
+sheets can be cached by browsers indefinitely. Composing needs Pillow, which
+is optional; without it galleries fall back to plain ``<img>`` tiles.
+"""
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = ImageOps = None
+
+try:
+    from .singleflight import SingleFlight
+except ImportError:
+    from singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# Cell size in pixels; matches the 150px gallery tiles
+SPRITE_CELL = 150
+SPRITE_COLUMNS = 10
+# Tiles per sheet; a 300-image page becomes 5 sheets the browser fetches in parallel
+TILES_PER_SHEET = 60
+SPRITE_QUALITY = 80
+# Page layouts remembered (version -> paths) and encoded sheets kept in memory
+MAX_LAYOUTS = 256
+MAX_CACHED_SHEETS = 64
+# Sheets composed at once; decoding originals is CPU-heavy
+MAX_CONCURRENT_BUILDS = 2
+BACKGROUND = (238, 238, 238)
+
+
+def available() -> bool:
+    """True if Pillow is installed and sheets can be composed."""
+    return Image is not None
+
+
+def page_version(entries) -> str:
+    """Version hash of a page's ``(path, mtime)`` entries."""
+    digest = hashlib.blake2b(digest_size=8)
+    for path, mtime in entries:
+        digest.update(f"{path}\0{mtime!r}\n".encode('utf-8', 'surrogateescape'))
+    return digest.hexdigest()
+
+
+def _thumbnail(path: str, cell: int):
+    with Image.open(path) as im:
+        # JPEG decodes straight at a reduced scale; a big win for photos
+        im.draft('RGB', (cell, cell))
+        im = ImageOps.exif_transpose(im)
+        if im.mode in ('RGBA', 'LA', 'P', 'PA'):
+            im = im.convert('RGBA')
+            flat = Image.new('RGB', im.size, BACKGROUND)
+            flat.paste(im, mask=im.getchannel('A'))
+            im = flat
+        else:
+            im = im.convert('RGB')
+        return ImageOps.fit(im, (cell, cell))
+
+
+def compose_sheet(paths, cell: int = SPRITE_CELL, columns: int = SPRITE_COLUMNS,
+                  quality: int = SPRITE_QUALITY) -> bytes:
+    """Return a JPEG with ``paths`` center-cropped into a grid of cells.
+
+    Images that cannot be decoded leave their cell blank.
+    """
+    rows = max(1, (len(paths) + columns - 1) // columns)
+    sheet = Image.new('RGB', (min(len(paths), columns) * cell or cell, rows * cell), BACKGROUND)
+    for i, path in enumerate(paths):
+        try:
+            thumb = _thumbnail(path, cell)
+        except Exception as e:
+            logger.debug(f"Sprites: cannot thumbnail {path}: {e}")
+            continue
+        sheet.paste(thumb, ((i % columns) * cell, (i // columns) * cell))
+    out = BytesIO()
+    sheet.save(out, 'JPEG', quality=quality, optimize=True, progressive=True)
+    return out.getvalue()
+
+
+class SpriteSheets:
+    """Page layouts and an LRU of composed sheets."""
+
+    def __init__(self, tiles_per_sheet: int = TILES_PER_SHEET, columns: int = SPRITE_COLUMNS,
+                 cell: int = SPRITE_CELL, max_sheets: int = MAX_CACHED_SHEETS):
+        self.tiles_per_sheet = tiles_per_sheet
+        self.columns = columns
+        self.cell = cell
+        self.max_sheets = max_sheets
+        self._layouts: "OrderedDict[str, list[str]]" = OrderedDict()
+        self._sheets: "OrderedDict[tuple[str, int], bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._flight = SingleFlight()
+        self._builds = threading.Semaphore(MAX_CONCURRENT_BUILDS)
+        self.hits = 0
+        self.misses = 0
+
+    def layout(self, entries) -> tuple[str, list[tuple[int, int, int]]]:
+        """Register a page and return ``(version, [(sheet, x, y), ...])`` per entry."""
+        entries = list(entries)
+        version = page_version(entries)
+        with self._lock:
+            self._layouts[version] = [path for path, _ in entries]
+            self._layouts.move_to_end(version)
+            while len(self._layouts) > MAX_LAYOUTS:
+                self._layouts.popitem(last=False)
+        cells = []
+        for i in range(len(entries)):
+            sheet, slot = divmod(i, self.tiles_per_sheet)
+            cells.append((sheet, (slot % self.columns) * self.cell, (slot // self.columns) * self.cell))
+        return version, cells
+
+    def sheet_count(self, version: str) -> int:
+        with self._lock:
+            paths = self._layouts.get(version)
+        return 0 if paths is None else (len(paths) + self.tiles_per_sheet - 1) // self.tiles_per_sheet
+
+    def get(self, version: str, sheet: int, guard=None) -> bytes | None:
+        """Return sheet ``sheet`` of page ``version``; None if unknown.
+
+        ``guard(build)`` runs the build when the sheet has to be composed
+        (once per sheet, however many requests ask); cached sheets skip it.
+        """
+        key = (version, sheet)
+        with self._lock:
+            data = self._sheets.get(key)
+            if data is not None:
+                self._sheets.move_to_end(key)
+                self.hits += 1
+                return data
+            paths = self._layouts.get(version)
+        if paths is None:
+            return None
+        paths = paths[sheet * self.tiles_per_sheet:(sheet + 1) * self.tiles_per_sheet]
+        if sheet < 0 or not paths:
+            return None
+
+        def build():
+            with self._builds:
+                return compose_sheet(paths, self.cell, self.columns)
+
+        data = self._flight.do(key, build if guard is None else lambda: guard(build))
+        with self._lock:
+            self.misses += 1
+            self._sheets[key] = data
+            self._sheets.move_to_end(key)
+            while len(self._sheets) > self.max_sheets:
+                self._sheets.popitem(last=False)
+        return data
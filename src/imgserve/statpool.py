@@ -0,0 +1,144 @@
+"""Parallel directory scans for high-latency (network) filesystems.
+
+On NFS, SMB or sshfs every ``stat`` is a network round-trip. ``StatPool``
+lists a directory once and fans the per-file ``stat`` calls out to a
+bounded thread pool. Each scan has a deadline: whatever has not answered by
+then is left out and the scan is marked incomplete, so a hung mount yields
+a partial page instead of blocking a request thread indefinitely. A request
+takes one deadline (``deadline()``) and passes it to every scan and other
+filesystem call (``call()``) it makes, so its total wait stays bounded.
+"""
+import logging
+import os
+import re
+import stat
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError, wait
+
+try:
+    from .scancache import DirectoryScan
+except ImportError:
+    from scancache import DirectoryScan
+
+logger = logging.getLogger(__name__)
+
+# Threads issuing stat calls concurrently
+STAT_POOL_WORKERS = 32
+# Seconds one directory scan may take before a partial result is returned
+STAT_TIMEOUT_SECONDS = 10.0
+# Filesystem types (as in /proc/self/mounts) where the pool pays off
+NETWORK_FS_TYPES = {
+    'nfs', 'nfs4', 'cifs', 'smb3', 'smbfs', 'fuse.sshfs', 'sshfs', '9p',
+    'afpfs', 'davfs', 'fuse.davfs', 'fuse.rclone', 'fuse.s3fs', 'ceph',
+    'fuse.ceph', 'glusterfs', 'fuse.glusterfs', 'lustre', 'gpfs', 'beegfs',
+}
+
+
+def _unescape_mount_field(field: str) -> str:
+    # /proc/self/mounts escapes space, tab, newline and backslash as \ooo
+    return re.sub(r'\\([0-7]{3})', lambda m: chr(int(m.group(1), 8)), field)
+
+
+def mount_fs_type(path: str, mounts_file: str = '/proc/self/mounts') -> str | None:
+    """Return the filesystem type of the mount containing ``path``, if known."""
+    path = os.path.realpath(path)
+    best, best_type = '', None
+    try:
+        with open(mounts_file, 'r') as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) < 3:
+                    continue
+                mount_point = _unescape_mount_field(fields[1])
+                prefix = mount_point.rstrip('/') + '/'
+                if (path == mount_point or path.startswith(prefix)) and len(mount_point) >= len(best):
+                    best, best_type = mount_point, fields[2]
+    except OSError:
+        return None
+    return best_type
+
+
+def _list_directory(directory: str, extensions) -> tuple[list[str], list[tuple[str, bool]]]:
+    """Return (candidate image names, subdirectories); uses d_type, no stats."""
+    names, subdirs = [], []
+    with os.scandir(directory) as it:
+        for entry in it:
+            name = entry.name
+            try:
+                if entry.is_dir():
+                    if not name.startswith('.'):
+                        subdirs.append((name, entry.is_symlink()))
+                    continue
+            except OSError:
+                pass
+            if name.lower().endswith(extensions) and not name.startswith('._'):
+                names.append(name)
+    return names, subdirs
+
+
+class StatPool:
+    """Bounded thread pool scanning directories with a per-scan deadline."""
+
+    def __init__(self, workers: int = STAT_POOL_WORKERS, timeout: float = STAT_TIMEOUT_SECONDS):
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="imgserve-stat")
+        self._lock = threading.Lock()
+        self.timeouts = 0
+
+    def deadline(self) -> float:
+        """A ``time.monotonic()`` deadline for the filesystem work of one request."""
+        return time.monotonic() + self.timeout
+
+    def call(self, fn, *args, deadline: float | None = None):
+        """Return ``fn(*args)`` run on the pool; raises ``TimeoutError`` past ``deadline``."""
+        if deadline is None:
+            deadline = self.deadline()
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError()
+        future = self._executor.submit(fn, *args)
+        try:
+            return future.result(timeout=remaining)
+        except TimeoutError:
+            future.cancel()
+            raise
+
+    def scan(self, directory: str, extensions, deadline: float | None = None) -> DirectoryScan:
+        """Scan like ``scancache.scan_directory``; may return an incomplete scan."""
+        if deadline is None:
+            deadline = self.deadline()
+        listing = self._executor.submit(_list_directory, directory, extensions)
+        try:
+            names, subdirs = listing.result(timeout=max(0.0, deadline - time.monotonic()))
+        except TimeoutError:
+            listing.cancel()
+            self._timed_out(directory, "listing")
+            return DirectoryScan([], [], complete=False)
+
+        futures = {self._executor.submit(os.stat, os.path.join(directory, name)): name
+                   for name in names}
+        done, not_done = wait(futures, timeout=max(0.0, deadline - time.monotonic()))
+        files = []
+        for future, name in futures.items():
+            if future not in done:
+                continue
+            try:
+                st = future.result()
+            except OSError:
+                files.append((name, float('inf'), 0))
+                continue
+            if stat.S_ISREG(st.st_mode):
+                files.append((name, st.st_mtime, st.st_size))
+        if not_done:
+            # Drop queued stats so a hung mount doesn't clog the pool
+            for future in not_done:
+                future.cancel()
+            self._timed_out(directory, f"{len(not_done)} of {len(futures)} stats")
+        return DirectoryScan(files, subdirs, complete=not not_done)
+
+    def _timed_out(self, directory: str, what: str) -> None:
+        with self._lock:
+            self.timeouts += 1
+        logger.warning(f"Stat pool: {what} in {directory} did not finish within "
+                       f"{self.timeout:g}s; returning a partial listing")
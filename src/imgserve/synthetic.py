@@ -0,0 +1,106 @@
+"""Synthetic image trees and JSON indexes for benchmarks and load tests.
+
+Trees are deterministic for a given seed: the same parameters always produce
+the same names, layout and modification times.
+"""
+import json
+import os
+import random
+import struct
+import zlib
+
+# Spread of generated modification times (about ten years from 2017)
+MTIME_BASE = 1_500_000_000
+MTIME_SPAN = 315_000_000
+
+DEFAULT_EXTENSIONS = ('.jpg', '.png', '.gif', '.jpeg', '.webp')
+
+
+def _png_1x1() -> bytes:
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+    ihdr = struct.pack(">IIBBBBB", 1, 1, 8, 2, 0, 0, 0)
+    idat = zlib.compress(b"\x00\x80\x80\x80")
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", ihdr) + chunk(b"IDAT", idat) + chunk(b"IEND", b"")
+
+
+# Smallest valid images, used when real (non-empty) files are requested
+TINY_IMAGES = {
+    '.png': _png_1x1(),
+    '.gif': (b"GIF89a\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00\xff\xff\xff"
+             b"!\xf9\x04\x01\x00\x00\x00\x00,\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02D\x01\x00;"),
+}
+
+
+def count_tree_files(depth: int, fanout: int, files_per_dir: int) -> int:
+    """Number of images ``generate_tree`` creates for these parameters."""
+    return files_per_dir * sum(fanout ** level for level in range(depth + 1))
+
+
+def generate_tree(root: str, depth: int = 2, fanout: int = 4, files_per_dir: int = 100,
+                  real_images: bool = False, seed: int = 0,
+                  extensions: tuple[str, ...] = DEFAULT_EXTENSIONS, progress=None) -> int:
+    """Create a tree of images under ``root`` and return the number of files.
+
+    Every directory down to ``depth`` levels holds ``files_per_dir`` images
+    and ``fanout`` subdirectories (none at the deepest level). Files are
+    empty unless ``real_images`` is set, in which case only extensions with
+    a valid tiny image (``.png``, ``.gif``) are used.
+    """
+    rng = random.Random(seed)
+    if real_images:
+        extensions = tuple(ext for ext in extensions if ext in TINY_IMAGES) or tuple(TINY_IMAGES)
+    created = 0
+    stack = [(root, 0)]
+    while stack:
+        directory, level = stack.pop()
+        os.makedirs(directory, exist_ok=True)
+        for i in range(files_per_dir):
+            ext = extensions[i % len(extensions)]
+            path = os.path.join(directory, f"img_{i:06d}{ext}")
+            with open(path, 'wb') as f:
+                if real_images:
+                    f.write(TINY_IMAGES[ext])
+            mtime = MTIME_BASE + rng.random() * MTIME_SPAN
+            os.utime(path, (mtime, mtime))
+            created += 1
+            if progress is not None and created % 10000 == 0:
+                progress(created)
+        if level < depth:
+            for j in range(fanout):
+                stack.append((os.path.join(directory, f"dir_{level + 1}_{j:03d}"), level + 1))
+    return created
+
+
+def index_entries_for_tree(root: str, extensions: tuple[str, ...] = DEFAULT_EXTENSIONS) -> list[dict]:
+    """Return ``generate_index.py``-style entries for every image under ``root``."""
+    entries = []
+    for dirpath, _, files in os.walk(root):
+        for name in files:
+            if name.lower().endswith(extensions) and not name.startswith('._'):
+                path = os.path.abspath(os.path.join(dirpath, name))
+                entries.append({"path": path, "mtime": os.path.getmtime(path)})
+    entries.sort(key=lambda e: e['mtime'])
+    return entries
+
+
+def synthetic_index_entries(count: int, root: str = "/synthetic", files_per_dir: int = 100,
+                            seed: int = 0, extensions: tuple[str, ...] = DEFAULT_EXTENSIONS) -> list[dict]:
+    """Return ``count`` index entries for files that need not exist on disk."""
+    rng = random.Random(seed)
+    entries = []
+    for i in range(count):
+        ext = extensions[i % len(extensions)]
+        directory = f"{root}/dir_{i // files_per_dir // 100:04d}/sub_{i // files_per_dir % 100:02d}"
+        entries.append({
+            "path": f"{directory}/img_{i:08d}{ext}",
+            "mtime": MTIME_BASE + rng.random() * MTIME_SPAN,
+        })
+    entries.sort(key=lambda e: e['mtime'])
+    return entries
+
+
+def write_index(output_path: str, entries: list[dict]) -> None:
+    """Write entries in the JSON format read by ``--index-file``."""
+    with open(output_path, 'w') as f:
+        json.dump(entries, f)
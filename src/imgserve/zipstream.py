@@ -0,0 +1,147 @@
+"""Streaming ZIP writer.
+
+``stream_zip`` yields a ZIP archive chunk by chunk while reading the member
+files from disk, so memory use is constant and nothing is written to a
+temporary file. Sizes and CRCs go into data descriptors after each member,
+and ZIP64 records are used once sizes, offsets or the entry count exceed
+the classic format's limits.
+
+Already-compressed formats (JPEG, PNG, GIF, WebP, HEIF) are stored as is;
+only formats that actually shrink (BMP, TIFF) are deflated.
+"""
+import logging
+import os
+import struct
+import time
+import zlib
+
+logger = logging.getLogger(__name__)
+
+# Bytes read from each member file at a time
+READ_CHUNK_SIZE = 1 << 20
+# File extensions worth deflating; everything else is stored
+DEFLATE_EXTENSIONS = ('.bmp', '.tif', '.tiff')
+
+# Sizes/offsets and entry counts from which ZIP64 records are needed
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP_FILECOUNT_LIMIT = 0xFFFF
+# Written in classic fields whose value is in the ZIP64 records instead
+_ZIP64_MARKER = 0xFFFFFFFF
+_COUNT_MARKER = 0xFFFF
+
+_STORED = 0
+_DEFLATED = 8
+# Bit 3: sizes/CRC follow in a data descriptor; bit 11: UTF-8 names
+_FLAGS = 0x0008 | 0x0800
+
+
+def _dos_datetime(mtime: float) -> tuple[int, int]:
+    t = time.localtime(mtime)
+    if t.tm_year < 1980:
+        return 0, (1 << 5) | 1  # 1980-01-01 00:00
+    year = min(t.tm_year, 2107)
+    return ((t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2),
+            ((year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday)
+
+
+def stream_zip(members, chunk_size: int = READ_CHUNK_SIZE, cancelled=None):
+    """Yield a ZIP archive of ``members``, an iterable of ``(arcname, path)``.
+
+    Files that cannot be opened are skipped (and logged). If ``cancelled()``
+    becomes true (e.g. the client disconnected) the stream stops early.
+    """
+    central = []  # (name, method, dos_time, dos_date, crc, csize, usize, offset, zip64)
+    offset = 0
+    for arcname, path in members:
+        if cancelled is not None and cancelled():
+            logger.info("Zip: client went away; stopping")
+            return
+        try:
+            f = open(path, 'rb')
+        except OSError as e:
+            logger.info(f"Zip: skipping {path}: {e}")
+            continue
+        with f:
+            st = os.fstat(f.fileno())
+            name = arcname.encode('utf-8', 'surrogateescape')
+            method = _DEFLATED if arcname.lower().endswith(DEFLATE_EXTENSIONS) else _STORED
+            # Leave headroom for deflate growth and files growing while read
+            zip64 = st.st_size * 1.05 > ZIP64_LIMIT
+            dos_time, dos_date = _dos_datetime(st.st_mtime)
+
+            extra = struct.pack('<HHQQ', 0x0001, 16, 0, 0) if zip64 else b''
+            header = struct.pack(
+                '<IHHHHHIIIHH', 0x04034B50, 45 if zip64 else 20, _FLAGS, method,
+                dos_time, dos_date, 0, _ZIP64_MARKER if zip64 else 0,
+                _ZIP64_MARKER if zip64 else 0, len(name), len(extra),
+            ) + name + extra
+            yield header
+
+            crc = 0
+            usize = csize = 0
+            compressor = zlib.compressobj(6, zlib.DEFLATED, -15) if method == _DEFLATED else None
+            while True:
+                block = f.read(chunk_size)
+                if not block:
+                    break
+                usize += len(block)
+                crc = zlib.crc32(block, crc)
+                if compressor is not None:
+                    block = compressor.compress(block)
+                    if not block:
+                        continue
+                csize += len(block)
+                yield block
+            if compressor is not None:
+                block = compressor.flush()
+                csize += len(block)
+                yield block
+
+            if zip64:
+                descriptor = struct.pack('<IIQQ', 0x08074B50, crc, csize, usize)
+            else:
+                if usize > ZIP64_LIMIT or csize > ZIP64_LIMIT:
+                    # The local header promised 32-bit sizes; the archive
+                    # would be unreadable, so stop rather than emit garbage
+                    raise ValueError(f"{path} grew past 4 GiB while being zipped")
+                descriptor = struct.pack('<IIII', 0x08074B50, crc, csize, usize)
+            yield descriptor
+
+        central.append((name, method, dos_time, dos_date, crc, csize, usize, offset, zip64))
+        offset += len(header) + csize + len(descriptor)
+
+    cd_start = offset
+    for name, method, dos_time, dos_date, crc, csize, usize, entry_offset, zip64 in central:
+        # ZIP64 extra holds, in order, whichever fields overflow 32 bits
+        fields = []
+        if zip64 or usize >= ZIP64_LIMIT:
+            fields.append(usize)
+            usize = _ZIP64_MARKER
+        if zip64 or csize >= ZIP64_LIMIT:
+            fields.append(csize)
+            csize = _ZIP64_MARKER
+        if entry_offset >= ZIP64_LIMIT:
+            fields.append(entry_offset)
+            entry_offset = _ZIP64_MARKER
+        extra = struct.pack(f'<HH{len(fields)}Q', 0x0001, 8 * len(fields), *fields) if fields else b''
+        version = 45 if fields else 20
+        record = struct.pack(
+            '<IHHHHHHIIIHHHHHII', 0x02014B50, (3 << 8) | version, version, _FLAGS, method,
+            dos_time, dos_date, crc, csize, usize, len(name), len(extra), 0, 0, 0,
+            0o100644 << 16, entry_offset,
+        ) + name + extra
+        offset += len(record)
+        yield record
+
+    count = len(central)
+    cd_size = offset - cd_start
+    if count > ZIP_FILECOUNT_LIMIT or cd_start >= ZIP64_LIMIT or cd_size >= ZIP64_LIMIT:
+        yield struct.pack('<IQHHIIQQQQ', 0x06064B50, 44, 45, 45, 0, 0,
+                          count, count, cd_size, cd_start)
+        yield struct.pack('<IIQI', 0x07064B50, 0, offset, 1)
+        entries = _COUNT_MARKER if count > ZIP_FILECOUNT_LIMIT else count
+        yield struct.pack('<IHHHHIIH', 0x06054B50, 0, 0, entries, entries,
+                          _ZIP64_MARKER if cd_size >= ZIP64_LIMIT else cd_size,
+                          _ZIP64_MARKER if cd_start >= ZIP64_LIMIT else cd_start, 0)
+    else:
+        yield struct.pack('<IHHHHIIH', 0x06054B50, 0, 0, count, count, cd_size, cd_start, 0)
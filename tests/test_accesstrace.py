@@ -0,0 +1,31 @@
+import json
+
+from imgserve.accesstrace import read_trace
+from imgserve.app import create_app
+
+
+def test_trace_leaves_out_admin_token_and_admin_pages(tmp_path, monkeypatch):
+    (tmp_path / "a.jpg").write_bytes(b"jpeg")
+    trace = tmp_path / "trace.jsonl"
+    monkeypatch.chdir(tmp_path)
+    app = create_app(config={'ADMISSION_CONTROL': False, 'PREFETCH': False,
+                             'ADMIN_TOKEN': 's3cret', 'TRACE_FILE': str(trace)})
+    client = app.test_client()
+
+    assert client.get("/debug/requests?__token=s3cret").status_code == 200
+    client.get("/?page=1&__token=s3cret&__profile=1")
+    client.get("/images/a.jpg?__token=s3cret")
+
+    text = trace.read_text()
+    assert "s3cret" not in text
+    assert "__profile" not in text
+    records = [json.loads(line) for line in text.splitlines()]
+    assert [(r["p"], r["q"]) for r in records] == [("/", "page=1"), ("/images/a.jpg", "")]
+
+
+def test_replay_skips_admin_requests_from_old_traces(tmp_path):
+    trace = tmp_path / "trace.jsonl"
+    trace.write_text(
+        '{"t": 1, "p": "/debug/requests", "q": "__token=x"}\n'
+        '{"t": 2, "p": "/", "q": "__profile=1&page=2&__token=x"}\n')
+    assert [(r["p"], r["q"]) for r in read_trace(str(trace))] == [("/", "page=2")]
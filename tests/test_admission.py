@@ -0,0 +1,54 @@
+import threading
+import time
+
+from imgserve import app as app_module
+from imgserve.app import create_app
+
+
+def _slow_listing(monkeypatch, seconds):
+    list_images = app_module.list_images_in_directory
+
+    def slow(*args, **kwargs):
+        time.sleep(seconds)
+        return list_images(*args, **kwargs)
+    monkeypatch.setattr(app_module, "list_images_in_directory", slow)
+
+
+def _get_concurrently(app, urls):
+    statuses = [None] * len(urls)
+    start = threading.Barrier(len(urls))
+
+    def get(i):
+        client = app.test_client()
+        start.wait()
+        statuses[i] = client.get(urls[i]).status_code
+    threads = [threading.Thread(target=get, args=(i,)) for i in range(len(urls))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return statuses
+
+
+def test_identical_concurrent_pages_share_one_slot(tmp_path, monkeypatch):
+    for i in range(50):
+        (tmp_path / f"img_{i:03d}.jpg").write_bytes(b"not really an image")
+    monkeypatch.chdir(tmp_path)
+    _slow_listing(monkeypatch, 0.5)
+    # 8 threads: 3 page slots and a queue of 1
+    app = create_app(config={'PREFETCH': False, 'THREADS': 8})
+
+    assert _get_concurrently(app, ["/?dir="] * 8) == [200] * 8
+    assert app.config['PAGE_FLIGHT'].leaders == 1
+
+
+def test_distinct_concurrent_pages_are_still_limited(tmp_path, monkeypatch):
+    for i in range(8):
+        (tmp_path / f"d{i}").mkdir()
+        (tmp_path / f"d{i}" / "img.jpg").write_bytes(b"not really an image")
+    monkeypatch.chdir(tmp_path)
+    _slow_listing(monkeypatch, 0.5)
+    app = create_app(config={'PREFETCH': False, 'THREADS': 8})
+
+    statuses = _get_concurrently(app, [f"/?dir=d{i}" for i in range(8)])
+    assert sorted(statuses) == [200] * 4 + [503] * 4
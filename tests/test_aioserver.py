@@ -0,0 +1,127 @@
+import asyncio
+import os
+import time
+
+from imgserve import aioserver
+from imgserve.app import create_app
+
+
+async def _get(port: int, path: str) -> bytes:
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: test\r\nConnection: close\r\n\r\n".encode())
+    await writer.drain()
+    data = await reader.read()
+    writer.close()
+    return data
+
+
+def test_large_image_uses_sendfile_with_default_config(tmp_path, monkeypatch):
+    # Bigger than the file cache's in-memory limit, so it is served from an
+    # open descriptor
+    content = os.urandom(3 << 20)
+    (tmp_path / "big.jpg").write_bytes(content)
+    monkeypatch.chdir(tmp_path)
+    app = create_app(config={'ADMISSION_CONTROL': False})
+    assert app.config['FILE_CACHE'] is not None
+
+    calls = []
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        original = loop.sendfile
+
+        async def sendfile(transport, file, offset=0, count=None, **kwargs):
+            calls.append((offset, count))
+            return await original(transport, file, offset, count, **kwargs)
+
+        loop.sendfile = sendfile
+        server = aioserver.AsyncioWSGIServer(app, host='127.0.0.1', port=0, threads=2)
+        listener = await server.start()
+        port = listener.sockets[0].getsockname()[1]
+        try:
+            # The second request is answered from the cache
+            return [await _get(port, "/images/big.jpg") for _ in range(2)]
+        finally:
+            listener.close()
+            await listener.wait_closed()
+            server.executor.shutdown(wait=False)
+
+    for response in asyncio.run(run()):
+        head, _, body = response.partition(b"\r\n\r\n")
+        assert head.startswith(b"HTTP/1.1 200")
+        assert body == content
+    assert calls == [(0, len(content))] * 2
+
+
+def test_drain_finishes_requests_in_progress():
+    def slow_app(environ, start_response):
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        for i in range(5):
+            time.sleep(0.1)
+            yield b"%d\n" % i
+
+    async def run():
+        server = aioserver.AsyncioWSGIServer(slow_app, host='127.0.0.1', port=0, threads=2)
+        serving = asyncio.ensure_future(server.serve_forever())
+        while server._server is None:
+            await asyncio.sleep(0.01)
+        port = server._server.sockets[0].getsockname()[1]
+        idle_reader, idle_writer = await asyncio.open_connection('127.0.0.1', port)
+        request = asyncio.ensure_future(_get(port, "/"))
+        await asyncio.sleep(0.1)
+        await server.drain(5.0)
+        await asyncio.wait_for(serving, 1.0)
+        # The idle keep-alive connection was closed, not waited for
+        assert await idle_reader.read() == b""
+        idle_writer.close()
+        server.executor.shutdown(wait=False)
+        return await request
+
+    head, _, body = asyncio.run(run()).partition(b"\r\n\r\n")
+    assert head.startswith(b"HTTP/1.1 200")
+    assert b"Connection: close" in head
+    assert body == b"2\r\n0\n\r\n2\r\n1\n\r\n2\r\n2\n\r\n2\r\n3\n\r\n2\r\n4\n\r\n0\r\n\r\n"
+
+
+def _exchange(application, requests: list[bytes]) -> list[bytes]:
+    async def run():
+        server = aioserver.AsyncioWSGIServer(application, host='127.0.0.1', port=0, threads=2)
+        listener = await server.start()
+        port = listener.sockets[0].getsockname()[1]
+        responses = []
+        try:
+            for raw in requests:
+                reader, writer = await asyncio.open_connection('127.0.0.1', port)
+                writer.write(raw)
+                await writer.drain()
+                responses.append(await asyncio.wait_for(reader.read(), 5.0))
+                writer.close()
+        finally:
+            listener.close()
+            await listener.wait_closed()
+            server.executor.shutdown(wait=False)
+        return responses
+
+    return asyncio.run(run())
+
+
+def test_bad_content_length_gets_400():
+    def app(environ, start_response):
+        start_response('200 OK', [('Content-Length', '2')])
+        return [b"ok"]
+
+    responses = _exchange(app, [
+        b"POST / HTTP/1.1\r\nHost: test\r\nContent-Length: %s\r\n\r\n" % value
+        for value in (b"abc", b"-1", "²".encode('utf-8'))
+    ])
+    for response in responses:
+        assert response.startswith(b"HTTP/1.1 400")
+
+
+def test_app_that_never_starts_a_response_gets_500(caplog):
+    def app(environ, start_response):
+        return iter([])
+
+    response, = _exchange(app, [b"GET / HTTP/1.1\r\nHost: test\r\nConnection: close\r\n\r\n"])
+    assert response.startswith(b"HTTP/1.1 500")
+    assert "start_response" in caplog.text
@@ -0,0 +1,46 @@
+import threading
+import time
+
+from imgserve import crawler
+from imgserve.crawler import CrawlCache, MAX_CONCURRENT_CRAWLS
+
+
+def test_crawls_are_bounded_and_evicted_ones_stop(tmp_path, monkeypatch):
+    for i in range(10):
+        for j in range(5):
+            (tmp_path / f"top{i}" / f"sub{j}").mkdir(parents=True)
+            (tmp_path / f"top{i}" / f"sub{j}" / "img.jpg").write_bytes(b"x")
+
+    running = 0
+    peak = 0
+    lock = threading.Lock()
+    scan_directory = crawler.scan_directory
+
+    def slow_scan(*args, **kwargs):
+        nonlocal running, peak
+        with lock:
+            running += 1
+            peak = max(peak, running)
+        try:
+            time.sleep(0.02)
+            return scan_directory(*args, **kwargs)
+        finally:
+            with lock:
+                running -= 1
+    monkeypatch.setattr(crawler, "scan_directory", slow_scan)
+
+    cache = CrawlCache(('.jpg',), max_crawls=3)
+    crawls = [cache.get(str(tmp_path / f"top{i}")) for i in range(10)]
+    for crawl in crawls:
+        crawl._thread.join(10)
+
+    assert peak <= MAX_CONCURRENT_CRAWLS
+    evicted, kept = crawls[:7], crawls[7:]
+    assert all(crawl.cancelled and crawl.done for crawl in evicted)
+    # Most evicted crawls never got to walk at all
+    assert sum(crawl.dirs_scanned for crawl in evicted) < 7 * 6
+    for crawl in kept:
+        entries, scanning = crawl.snapshot()
+        assert not scanning and len(entries) == 5
+    # A cancelled crawl's partial listing is never reported as complete
+    assert all(crawl.snapshot()[1] for crawl in evicted)
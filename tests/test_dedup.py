@@ -0,0 +1,23 @@
+from imgserve import dedup
+from imgserve.crawler import SubtreeCrawl
+
+
+def test_dedupe_uses_scanned_sizes_instead_of_stat(tmp_path, monkeypatch):
+    (tmp_path / "sub").mkdir()
+    for rel in ("a.jpg", "b.jpg", "sub/c.jpg"):
+        (tmp_path / rel).write_bytes(b"same bytes")
+    (tmp_path / "d.jpg").write_bytes(b"other bytes")
+
+    crawl = SubtreeCrawl(str(tmp_path), ('.jpg',))
+    crawl.start()
+    crawl._thread.join()
+    entries, scanning = crawl.snapshot('name')
+    assert not scanning
+
+    def no_stat(path, *args, **kwargs):
+        raise AssertionError(f"stat of {path}")
+    monkeypatch.setattr(dedup.os, "stat", no_stat)
+    kept, copies = dedup.dedupe_entries(str(tmp_path), entries, sizes=crawl.sizes())
+
+    assert [rel for rel, _ in kept] == ["a.jpg", "d.jpg"]
+    assert copies == {"a.jpg": 3}
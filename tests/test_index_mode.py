@@ -0,0 +1,57 @@
+import json
+import os
+import re
+
+from imgserve.app import create_app
+
+
+def _index_app(tmp_path, files):
+    """Index-mode app over ``files``: (relative path, mtime) pairs."""
+    items = []
+    for rel, mtime in files:
+        path = tmp_path / "photos" / rel
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"not really an image")
+        items.append({"path": str(path), "mtime": mtime})
+    index_file = tmp_path / "index.json"
+    index_file.write_text(json.dumps(items))
+    return create_app(index_file=str(index_file),
+                      config={'ADMISSION_CONTROL': False, 'PREFETCH': False,
+                              'INDEX_RELOAD_INTERVAL': 0})
+
+
+def _tile_names(html: str) -> list[str]:
+    return re.findall(r"/images/[0-9a-f]{16}/([^\"']+)", html)
+
+
+def test_root_lists_newest_first_across_folders(tmp_path):
+    app = _index_app(tmp_path, [
+        ("a/x.jpg", 100.0),
+        ("b/y.png", 300.0),
+        ("c/w.gif", 500.0),
+        ("a/deeper/z.jpg", 400.0),
+    ])
+    client = app.test_client()
+
+    names = _tile_names(client.get("/").get_data(as_text=True))
+    assert list(dict.fromkeys(names)) == ["w.gif", "z.jpg", "y.png", "x.jpg"]
+    # Position 0 is the newest entry, the first tile
+    assert client.get("/images/0").headers["Location"].endswith("/w.gif")
+    # Unicode digits that int() rejects are invalid ids, not server errors
+    assert client.get("/images/\u00b2").status_code == 400
+
+
+def test_subfolder_recursive_and_own_listings(tmp_path):
+    app = _index_app(tmp_path, [
+        ("a/x.jpg", 100.0),
+        ("a/deeper/z.jpg", 400.0),
+        ("a/other/v.jpg", 200.0),
+        ("a/u.jpg", 300.0),
+        ("b/y.png", 500.0),
+    ])
+    client = app.test_client()
+
+    names = _tile_names(client.get("/?dir=a").get_data(as_text=True))
+    assert list(dict.fromkeys(names)) == ["z.jpg", "u.jpg", "v.jpg", "x.jpg"]
+    names = _tile_names(client.get("/?dir=a&recursive=0").get_data(as_text=True))
+    assert list(dict.fromkeys(names)) == ["u.jpg", "x.jpg"]
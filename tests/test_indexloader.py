@@ -0,0 +1,49 @@
+import json
+import threading
+import time
+
+from imgserve import indexloader
+from imgserve.indexloader import IndexLoader
+
+
+def _wait_for(condition, timeout: float = 5.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_reload_during_initial_load_is_not_overwritten(tmp_path, monkeypatch):
+    index_file = tmp_path / "index.json"
+    index_file.write_text(json.dumps([{"path": f"/old/{i}.jpg", "mtime": i} for i in range(20)]))
+
+    # Hold the initial load after its first entry until the reload is done
+    resume = threading.Event()
+    iter_json_array = indexloader.iter_json_array
+
+    def gated(f, *args):
+        for n, result in enumerate(iter_json_array(f, *args)):
+            if n == 1 and threading.current_thread().name == "imgserve-index-loader":
+                resume.wait(5)
+            yield result
+    monkeypatch.setattr(indexloader, "iter_json_array", gated)
+    monkeypatch.setattr(indexloader, "PUBLISH_INTERVAL", 0)
+
+    published = []
+    loader = IndexLoader(str(index_file), lambda entries, complete: published.append(
+        ([entry.path for entry in entries], complete)))
+    loader.start()
+    _wait_for(lambda: published)
+    assert published[-1] == (["/old/0.jpg"], False)
+
+    index_file.write_text(json.dumps([{"path": "/new/0.jpg", "mtime": 0}]))
+    assert loader.reload()
+    _wait_for(lambda: loader.reloads == 1 and not loader._reload_lock.locked())
+    assert published[-1] == (["/new/0.jpg"], True)
+    assert loader.ready
+
+    resume.set()
+    loader._thread.join(5)
+    # The initial load stopped without publishing anything more
+    assert published[-1] == (["/new/0.jpg"], True)
+    assert loader.loaded == 1 and loader.progress == 1.0
@@ -0,0 +1,87 @@
+import os
+import random
+
+from imgserve.indexstore import IndexBuilder, image_id
+from imgserve.pathtrie import PathTrie
+
+# "deep/a/b" has no images of its own and one subfolder: a merged chain
+DIRS = ["/r", "/r/x", "/r/x/y", "/r/deep/a/b/c", "/r/deep/a/b/c/d", "/r/z"]
+
+
+def _items(count: int, seed: int = 0) -> list[dict]:
+    rng = random.Random(seed)
+    items = []
+    for i in range(count):
+        item = {"path": f"{rng.choice(DIRS)}/img{i}.jpg", "mtime": float(rng.randrange(50))}
+        if rng.random() < 0.1:
+            item["duplicates"] = ["elsewhere"] * rng.randrange(1, 3)
+        items.append(item)
+    return items
+
+
+def _reference(items: list[dict]) -> list[dict]:
+    # Newest first; ties keep file order
+    return sorted(items, key=lambda item: item["mtime"], reverse=True)
+
+
+def _check_index(index, items: list[dict]) -> None:
+    expected = _reference(items)
+    assert len(index) == len(expected)
+    by_id = {}
+    for position, item in enumerate(expected):
+        entry = index[position]
+        assert (entry.path, entry.mtime) == (item["path"], item["mtime"])
+        assert entry.name == os.path.basename(item["path"])
+        assert entry.copies == 1 + len(item.get("duplicates", ()))
+        assert entry.id == image_id(item["path"], item["mtime"])
+        by_id[entry.id] = position
+    for entry_id, position in by_id.items():
+        assert index.find(entry_id) == position
+    assert index.find(image_id("/r/missing.jpg", 1.0)) is None
+
+
+def test_build_matches_reference_across_partial_builds():
+    items = _items(3000)
+    builder = IndexBuilder()
+    published = []
+    # Uneven chunks: small merges into a large index and the other way round
+    for end in (1, 10, 1500, 1510, 2900, 3000):
+        builder.extend(items[len(builder):end])
+        published.append((builder.build(), items[:end]))
+    # Earlier snapshots are unaffected by later builds
+    for index, loaded in published:
+        _check_index(index, loaded)
+
+
+def test_trie_ranges_match_reference():
+    items = _items(2000, seed=1)
+    index = IndexBuilder()
+    index.extend(items)
+    index = index.build()
+    trie = PathTrie(index)
+    assert trie.root_path == "/r"
+
+    expected = _reference(items)
+    own, subtree = {}, {}
+    for position, item in enumerate(expected):
+        directory = os.path.relpath(os.path.dirname(item["path"]), "/r")
+        own.setdefault(directory, []).append(position)
+        parts = [] if directory == "." else directory.split("/")
+        for depth in range(len(parts) + 1):
+            subtree.setdefault("/".join(parts[:depth]) or ".", []).append(position)
+
+    for folder, positions in subtree.items():
+        view = trie.find(folder)
+        assert view is not None, folder
+        assert list(view.positions(trie, recursive=False)) == own.get(folder, [])
+        assert list(view.positions(trie, recursive=True)) == positions
+        # Cached sorted ranges come back the same
+        assert list(view.positions(trie, recursive=True)) == positions
+
+    # Inside the merged chain: no images of its own, the rest as one subfolder
+    view = trie.find("deep/a")
+    assert view.own_end == view.start
+    assert view.subdirs == [("b/c", len(subtree["deep/a/b/c"]))]
+    assert [name for name, _ in trie.find("deep").subdirs] == ["a/b/c"]
+    assert trie.find("deep/a/x") is None
+    assert trie.find("../etc") is None
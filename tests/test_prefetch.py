@@ -0,0 +1,48 @@
+import threading
+import time
+
+from imgserve import prefetch
+from imgserve.app import create_app
+from imgserve.renderer import IMAGES_PER_PAGE
+from imgserve.statpool import StatPool
+
+
+def test_browser_prefetch_does_not_schedule_warmup(tmp_path, monkeypatch):
+    for i in range(IMAGES_PER_PAGE * 3):
+        (tmp_path / f"img_{i:04d}.jpg").write_bytes(b"not really an image")
+    monkeypatch.chdir(tmp_path)
+    app = create_app(config={'ADMISSION_CONTROL': False, 'PREFETCH': True})
+    prefetcher = app.config['PREFETCHER']
+    client = app.test_client()
+
+    # The page's own <link rel=prefetch> for page 2 must not warm page 3
+    assert client.get("/?page=2", headers={"Sec-Purpose": "prefetch"}).status_code == 200
+    assert client.get("/?page=2", headers={"Purpose": "prefetch"}).status_code == 200
+    assert prefetcher.scheduled == 0
+
+    assert client.get("/").status_code == 200
+    assert prefetcher.scheduled == 1
+
+
+def test_readahead_goes_through_the_stat_pool(tmp_path, monkeypatch):
+    hang = threading.Event()
+    opened = []
+
+    def hanging_advise(path):
+        # os.open() of a file on a mount that stopped answering
+        if path.startswith(str(tmp_path)):
+            opened.append(threading.current_thread().name)
+        hang.wait(5)
+        return False
+    monkeypatch.setattr(prefetch, "_advise_willneed", hanging_advise)
+
+    pool = StatPool(timeout=0.2)
+    paths = [str(tmp_path / f"img_{i}.jpg") for i in range(10)]
+    started = time.monotonic()
+    try:
+        assert prefetch.readahead(paths, stat_pool=pool) == 0
+    finally:
+        hang.set()
+    # Gave up at the first file that didn't answer, not once per file
+    assert time.monotonic() - started < 1.0
+    assert len(opened) == 1 and opened[0].startswith("imgserve-stat")
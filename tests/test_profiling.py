@@ -0,0 +1,61 @@
+import io
+import zipfile
+
+from imgserve.app import create_app
+from imgserve.profiling import ProfilingMiddleware
+
+
+def _environ(path, query):
+    return {"REQUEST_METHOD": "GET", "PATH_INFO": path, "QUERY_STRING": query,
+            "SERVER_NAME": "test", "SERVER_PORT": "80", "wsgi.url_scheme": "http",
+            "SERVER_PROTOCOL": "HTTP/1.1", "wsgi.input": io.BytesIO(), "wsgi.errors": io.StringIO()}
+
+
+def test_profiling_stops_at_the_first_chunk(tmp_path):
+    produced = []
+
+    class Stream:
+        closed = False
+
+        def __iter__(self):
+            for i in range(1000):
+                produced.append(i)
+                yield b"x" * 1024
+
+        def close(self):
+            Stream.closed = True
+
+    def app(environ, start_response):
+        start_response('200 OK', [('Content-Type', 'application/zip')])
+        return Stream()
+
+    profiled = ProfilingMiddleware(app, "secret", str(tmp_path))
+    body = profiled(_environ("/download.zip", "__profile=1&__token=secret"), lambda *a: None)
+    # Only the first chunk was produced under the profiler...
+    assert len(produced) == 1
+    assert list(tmp_path.glob("*.prof"))
+    # ...and the rest streams through without being collected first
+    assert sum(len(chunk) for chunk in body) == 1000 * 1024
+    body.close()
+    assert Stream.closed
+
+    # Inline reports don't produce the rest of the body at all
+    produced.clear()
+    Stream.closed = False
+    inline = ProfilingMiddleware(app, "secret")
+    report = b"".join(inline(_environ("/download.zip", "__profile=1&__token=secret"),
+                             lambda *a: None))
+    assert b"function calls" in report
+    assert len(produced) == 1 and Stream.closed
+
+
+def test_profiled_download_is_complete(tmp_path, monkeypatch):
+    for name in ("a.jpg", "b.jpg"):
+        (tmp_path / name).write_bytes(name.encode() * 1000)
+    monkeypatch.chdir(tmp_path)
+    app = create_app(config={'ADMISSION_CONTROL': False, 'PREFETCH': False,
+                             'ADMIN_TOKEN': "secret", 'PROFILE_DIR': str(tmp_path / "profiles")})
+    response = app.test_client().get("/download.zip?__profile=1&__token=secret")
+    assert response.headers["X-Imgserve-Profile"].endswith(".prof")
+    with zipfile.ZipFile(io.BytesIO(response.data)) as archive:
+        assert sorted(archive.namelist()) == ["a.jpg", "b.jpg"]
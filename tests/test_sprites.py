@@ -0,0 +1,49 @@
+import re
+import threading
+import time
+
+import pytest
+
+from imgserve import sprites as sprites_module
+from imgserve.app import create_app
+from imgserve.renderer import IMAGES_PER_PAGE
+
+Image = pytest.importorskip("PIL.Image")
+
+
+def test_a_whole_page_of_sheets_is_admitted(tmp_path, monkeypatch):
+    for i in range(IMAGES_PER_PAGE):
+        Image.new('RGB', (8, 8), (i % 256, 0, 0)).save(tmp_path / f"img_{i:03d}.jpg")
+    monkeypatch.chdir(tmp_path)
+    compose = sprites_module.compose_sheet
+
+    def slow_compose(*args, **kwargs):
+        time.sleep(0.3)
+        return compose(*args, **kwargs)
+    monkeypatch.setattr(sprites_module, "compose_sheet", slow_compose)
+    app = create_app(config={'PREFETCH': False, 'SPRITES': True, 'THREADS': 8})
+    client = app.test_client()
+
+    html = client.get("/").get_data(as_text=True)
+    urls = sorted(set(re.findall(r"/sprites/[0-9a-f]+/\d+\.jpg", html)))
+    assert len(urls) == 5
+
+    statuses = {}
+    start = threading.Barrier(len(urls))
+
+    def get(url):
+        sheet_client = app.test_client()
+        start.wait()
+        statuses[url] = sheet_client.get(url).status_code
+    threads = [threading.Thread(target=get, args=(url,)) for url in urls]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert list(statuses.values()) == [200] * 5
+
+    # Cached sheets are served even while every build slot and queue place is taken
+    sprite_class = app.config['ADMISSION'].classes['sprite']
+    sprite_class.active = sprite_class.slots
+    sprite_class.waiting = sprite_class.queue
+    assert client.get(urls[0]).status_code == 200
@@ -0,0 +1,48 @@
+import io
+import os
+import zipfile
+
+from imgserve import zipstream
+
+
+def _zip(members, **kwargs) -> zipfile.ZipFile:
+    archive = zipfile.ZipFile(io.BytesIO(b"".join(zipstream.stream_zip(members, **kwargs))))
+    assert archive.testzip() is None
+    return archive
+
+
+def test_zip64_sizes_and_offsets(tmp_path, monkeypatch):
+    # Scaled-down limit: the same records as past 4 GiB, without the gigabytes
+    monkeypatch.setattr(zipstream, "ZIP64_LIMIT", 10_000)
+    contents = {
+        "small.jpg": os.urandom(100),
+        "big.jpg": os.urandom(12_000),
+        "big.bmp": bytes(range(256)) * 50,
+        "after.jpg": os.urandom(500),
+    }
+    for name, data in contents.items():
+        (tmp_path / name).write_bytes(data)
+
+    archive = _zip([(name, str(tmp_path / name)) for name in contents], chunk_size=4096)
+    infos = {info.filename: info for info in archive.infolist()}
+    assert list(infos) == list(contents)
+    for name, data in contents.items():
+        assert archive.read(name) == data
+        assert infos[name].file_size == len(data)
+    assert infos["big.bmp"].compress_type == zipfile.ZIP_DEFLATED
+    # Big members need ZIP64 sizes; "after.jpg" starts past the limit
+    assert infos["big.jpg"].extract_version == 45
+    assert infos["after.jpg"].header_offset > 10_000
+    assert infos["after.jpg"].extract_version == 45
+    assert infos["small.jpg"].extract_version == 20
+
+
+def test_zip64_entry_count(tmp_path):
+    path = tmp_path / "tiny.jpg"
+    path.write_bytes(b"x")
+    count = zipstream.ZIP_FILECOUNT_LIMIT + 10
+    archive = _zip((f"{i}.jpg", str(path)) for i in range(count))
+    names = archive.namelist()
+    assert len(names) == count
+    assert names[-1] == f"{count - 1}.jpg"
+    assert archive.read(names[-1]) == b"x"